@@ -1,4 +1,12 @@
 from .store import KeyValueStore, Document
-from .http import app
 
-__all__ = ['KeyValueStore', 'Document', 'app'] 
\ No newline at end of file
+__all__ = ['KeyValueStore', 'Document', 'app']
+
+
+def __getattr__(name):
+    # The app opens a store when imported, which library users (and scan
+    # worker processes) don't want, so it is only imported on first access
+    if name == 'app':
+        from .http import app
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,165 @@
+import json
+import math
+import re
+from typing import TYPE_CHECKING, Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from .index import sort_rank
+from .query import get_path, split_field
+
+if TYPE_CHECKING:
+    from .store import Document
+
+
+class Accumulator:
+    """Running state of one aggregate function within one group."""
+
+    def add(self, value: Any) -> None:
+        raise NotImplementedError
+
+    def result(self) -> Any:
+        raise NotImplementedError
+
+
+class Count(Accumulator):
+    """COUNT(*) counts documents; COUNT(field) counts non-NULL values."""
+
+    def __init__(self):
+        self.count = 0
+
+    def add(self, value: Any) -> None:
+        if value is not None:
+            self.count += 1
+
+    def result(self) -> int:
+        return self.count
+
+
+def is_number(value: Any) -> bool:
+    """Whether SUM and AVG take a value into account: numbers other than booleans and NaN."""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return False
+    return not (isinstance(value, float) and math.isnan(value))
+
+
+class Sum(Accumulator):
+    def __init__(self):
+        self.total = 0
+        self.count = 0
+
+    def add(self, value: Any) -> None:
+        if is_number(value):
+            self.total += value
+            self.count += 1
+
+    def result(self) -> Optional[float]:
+        return self.total if self.count else None
+
+
+class Avg(Sum):
+    def result(self) -> Optional[float]:
+        return self.total / self.count if self.count else None
+
+
+class Extreme(Accumulator):
+    """
+    MIN or MAX in sorted index order: numbers before strings. NULLs and
+    values that can't be ordered (objects, arrays, NaN) are ignored.
+    """
+
+    def __init__(self, largest: bool):
+        self.largest = largest
+        self.best: Optional[Tuple[int, Any]] = None
+
+    def add(self, value: Any) -> None:
+        rank = sort_rank(value)
+        if not rank:  # None (unorderable) or 0 (NULL)
+            return
+        candidate = (rank, value)
+        if self.best is None or (candidate > self.best if self.largest else candidate < self.best):
+            self.best = candidate
+
+    def result(self) -> Any:
+        return self.best[1] if self.best is not None else None
+
+
+class Aggregate:
+    """An aggregate function applied to a field path, such as SUM(value.total)."""
+    PATTERN = re.compile(r"\s*(COUNT|SUM|MIN|MAX|AVG)\s*\(\s*(\*|\w+(?:\.\w+)*)\s*\)\s*", re.IGNORECASE)
+
+    def __init__(self, function: str, field: Optional[str]):
+        self.function = function.upper()
+        self.field = field
+        self.path = split_field(field) if field is not None else None
+        if field is None and self.function != 'COUNT':
+            raise ValueError(f"{self.function} needs a field")
+        self.name = f"{self.function.lower()}({field or '*'})"
+
+    @classmethod
+    def parse(cls, text: str) -> 'Aggregate':
+        """Parse an aggregate expression such as 'COUNT(*)' or 'avg(value.total)'."""
+        match = cls.PATTERN.fullmatch(text)
+        if not match:
+            raise ValueError(f"Invalid aggregate: {text}")
+        function, field = match.groups()
+        return cls(function, None if field == '*' else field)
+
+    def accumulator(self) -> Accumulator:
+        if self.function == 'COUNT':
+            return Count()
+        if self.function == 'SUM':
+            return Sum()
+        if self.function == 'AVG':
+            return Avg()
+        return Extreme(largest=self.function == 'MAX')
+
+    def value(self, doc: 'Document') -> Any:
+        if self.path is None:
+            return True  # COUNT(*) counts every document
+        return get_path(doc.value, self.path)
+
+
+def group_key(value: Any) -> Hashable:
+    """A hashable stand-in for a group-by value (objects and arrays by their JSON)."""
+    try:
+        hash(value)
+        return (type(value) is bool, value)  # Keep true apart from 1
+    except TypeError:
+        return ('json', json.dumps(value, sort_keys=True))
+
+
+def aggregate(
+    docs: Iterable['Document'],
+    aggregates: List[Aggregate],
+    group_by: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """
+    Compute aggregates over documents in one pass, optionally grouped by a
+    field. Returns one {"group": value, "values": {name: result}} entry per
+    group, ordered by group value; without group_by there is a single
+    entry (with a NULL group) even if no documents were given.
+    """
+    group_path = split_field(group_by) if group_by is not None else None
+    groups: Dict[Hashable, Tuple[Any, List[Accumulator]]] = {}
+    for doc in docs:
+        group = get_path(doc.value, group_path) if group_path is not None else None
+        key = group_key(group)
+        entry = groups.get(key)
+        if entry is None:
+            entry = groups[key] = (group, [agg.accumulator() for agg in aggregates])
+        for agg, accumulator in zip(aggregates, entry[1]):
+            accumulator.add(agg.value(doc))
+
+    if group_path is None and not groups:
+        groups[group_key(None)] = (None, [agg.accumulator() for agg in aggregates])
+
+    def order(entry: Tuple[Any, List[Accumulator]]) -> Tuple[int, Any]:
+        rank = sort_rank(entry[0])
+        return (3, json.dumps(entry[0], sort_keys=True)) if rank is None else (rank, entry[0])
+
+    return [
+        {
+            "group": group,
+            "values": {agg.name: accumulator.result() for agg, accumulator in zip(aggregates, accumulators)},
+        }
+        for group, accumulators in sorted(groups.values(), key=order)
+    ]
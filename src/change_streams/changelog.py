@@ -0,0 +1,75 @@
+from bisect import bisect_left, bisect_right
+from typing import TYPE_CHECKING, Iterator, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from .store import Document
+
+
+class ChangeLog:
+    """
+    Sequence of (collection, document) changes ordered by transaction ID.
+
+    Reading the changes after a transaction ID is a binary search followed
+    by a forward walk. Removed entries are blanked in place and the arrays
+    are compacted once they make up half of the log, which keeps removal
+    amortized O(log n).
+    """
+    # Don't bother compacting small logs
+    COMPACT_MIN_REMOVED = 1024
+
+    def __init__(self):
+        self._ids: List[int] = []
+        self._entries: List[Optional[Tuple[str, 'Document']]] = []
+        self._removed = 0
+
+    def __len__(self) -> int:
+        return len(self._ids) - self._removed
+
+    def append(self, collection: str, doc: 'Document') -> None:
+        """Add a change; out-of-order transaction IDs are inserted in place."""
+        transaction_id = doc.transaction_id
+        if not self._ids or transaction_id > self._ids[-1]:
+            self._ids.append(transaction_id)
+            self._entries.append((collection, doc))
+            return
+        i = bisect_left(self._ids, transaction_id)
+        self._ids.insert(i, transaction_id)
+        self._entries.insert(i, (collection, doc))
+
+    def remove(self, transaction_id: int) -> bool:
+        """Drop the change with the given transaction ID, if present."""
+        i = bisect_left(self._ids, transaction_id)
+        if i == len(self._ids) or self._ids[i] != transaction_id or self._entries[i] is None:
+            return False
+        self._entries[i] = None
+        self._removed += 1
+        if self._removed >= self.COMPACT_MIN_REMOVED and self._removed * 2 >= len(self._ids):
+            self._compact()
+        return True
+
+    def after(self, transaction_id: int) -> Iterator[Tuple[str, 'Document']]:
+        """Yield changes with a transaction ID greater than the given one, in order."""
+        i = bisect_right(self._ids, transaction_id)
+        entries = self._entries
+        while i < len(entries):
+            entry = entries[i]
+            if entry is not None:
+                yield entry
+            i += 1
+
+    def count_after(self, transaction_id: int) -> int:
+        """Number of changes with a transaction ID greater than the given one."""
+        i = bisect_right(self._ids, transaction_id)
+        if not self._removed:
+            return len(self._ids) - i
+        return sum(1 for entry in self._entries[i:] if entry is not None)
+
+    def _compact(self) -> None:
+        kept = [
+            (transaction_id, entry)
+            for transaction_id, entry in zip(self._ids, self._entries)
+            if entry is not None
+        ]
+        self._ids = [transaction_id for transaction_id, _ in kept]
+        self._entries = [entry for _, entry in kept]
+        self._removed = 0
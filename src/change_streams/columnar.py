@@ -0,0 +1,462 @@
+import operator
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Tuple
+
+from .aggregate import Aggregate
+from .planner import QueryPlan
+from .query import And, Comparison, MatchAll, Not, Or, Predicate, get_path, split_field
+
+try:
+    import numpy as np
+except ImportError:  # Columnar scans are optional; queries use the row path without them
+    np = None
+
+if TYPE_CHECKING:
+    from .store import Document
+
+HAS_NUMPY = np is not None
+
+# Integers beyond this can't be held exactly in a float64 column
+MAX_EXACT_INT = 2 ** 53
+
+ORDERINGS = {
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+}
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (bool, int, float))
+
+
+def _exact(value: Any) -> bool:
+    return not isinstance(value, int) or abs(value) <= MAX_EXACT_INT
+
+
+class Column:
+    """
+    One field of a collection's latest documents, held as NumPy arrays.
+
+    Numbers (booleans included, as Python compares them as numbers) are
+    float64, strings are codes into a dictionary of distinct strings, and
+    masks record which rows are NULL or missing, booleans, integers,
+    integers too large for a float64, or values no array holds (objects,
+    arrays). Comparisons evaluate over whole arrays with the same results
+    as Comparison.matches() on each row.
+    """
+
+    def __init__(self, field: str, capacity: int):
+        self.field = field
+        self.path = split_field(field)
+        self.numbers = np.full(capacity, np.nan)
+        self.codes = np.full(capacity, -1, dtype=np.int64)
+        self.nulls = np.zeros(capacity, dtype=bool)
+        self.booleans = np.zeros(capacity, dtype=bool)
+        self.integers = np.zeros(capacity, dtype=bool)
+        self.inexact = np.zeros(capacity, dtype=bool)
+        self.others = np.zeros(capacity, dtype=bool)
+        self.strings: List[str] = []
+        self._string_codes: Dict[str, int] = {}
+
+    def resize(self, capacity: int) -> None:
+        for name, fill in (
+            ('numbers', np.nan), ('codes', -1), ('nulls', False), ('booleans', False),
+            ('integers', False), ('inexact', False), ('others', False)
+        ):
+            old = getattr(self, name)
+            new = np.full(capacity, fill, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def set(self, row: int, doc: Optional['Document']) -> None:
+        """Store the field of a document (None for a free row) in the given row."""
+        value = get_path(doc.value, self.path) if doc is not None else None
+        self.numbers[row] = np.nan
+        self.codes[row] = -1
+        self.nulls[row] = value is None
+        self.booleans[row] = isinstance(value, bool)
+        self.integers[row] = isinstance(value, int) and not isinstance(value, bool)
+        self.inexact[row] = not _exact(value)
+        self.others[row] = False
+        if _is_number(value):
+            self.numbers[row] = float(value)
+        elif isinstance(value, str):
+            code = self._string_codes.get(value)
+            if code is None:
+                code = self._string_codes[value] = len(self.strings)
+                self.strings.append(value)
+            self.codes[row] = code
+        elif value is not None:
+            self.others[row] = True
+
+    def usable(self, rows: 'np.ndarray') -> bool:
+        """Whether every value in the rows selected by a mask is represented exactly."""
+        return not (self.inexact[:len(rows)] & rows).any()
+
+    def compare(self, comparison: Comparison, n: int) -> Optional['np.ndarray']:
+        """Rows among the first n matching a comparison, or None if it can't be vectorized."""
+        op, target = comparison.operator, comparison.target
+        if op == 'IS NULL':
+            return self.nulls[:n].copy()
+        if op == 'IS NOT NULL':
+            return ~self.nulls[:n]
+        if op in ('=', '!='):
+            equal = self._equal(target, n)
+            if equal is None or op == '=':
+                return equal
+            return ~equal
+        if op in ('IN', 'NOT IN'):
+            if not isinstance(target, frozenset):
+                return None
+            member = np.zeros(n, dtype=bool)
+            for value in target:
+                equal = self._equal(value, n)
+                if equal is None:
+                    return None
+                member |= equal
+            return member if op == 'IN' else ~member
+        if op in ORDERINGS:
+            return self._order(ORDERINGS[op], target, n)
+        if op == 'BETWEEN':
+            low, high = target
+            above = self._order(operator.ge, low, n)
+            below = self._order(operator.le, high, n)
+            if above is None or below is None:
+                return None
+            return above & below
+        return None
+
+    def _equal(self, target: Any, n: int) -> Optional['np.ndarray']:
+        if target is None:
+            return self.nulls[:n].copy()
+        if _is_number(target):
+            if not _exact(target):
+                return None
+            return self.numbers[:n] == float(target)
+        if isinstance(target, str):
+            code = self._string_codes.get(target)
+            if code is None:
+                return np.zeros(n, dtype=bool)
+            return self.codes[:n] == code
+        return None
+
+    def _order(self, compare, target: Any, n: int) -> Optional['np.ndarray']:
+        # Mismatched types raise TypeError in Python, which is never a match
+        if target is None:
+            return np.zeros(n, dtype=bool)
+        if _is_number(target):
+            if not _exact(target):
+                return None
+            return compare(self.numbers[:n], float(target))
+        if isinstance(target, str):
+            table = np.fromiter(
+                (compare(string, target) for string in self.strings), dtype=bool, count=len(self.strings)
+            )
+            # Code -1 (not a string) picks the trailing False
+            return np.append(table, False)[self.codes[:n]]
+        return None
+
+    def string_ranks(self) -> 'np.ndarray':
+        """Position of each string code in Python's string order."""
+        ranks = np.empty(len(self.strings), dtype=np.int64)
+        ranks[sorted(range(len(self.strings)), key=self.strings.__getitem__)] = np.arange(len(self.strings))
+        return ranks
+
+
+class ColumnarScan(QueryPlan):
+    """
+    Rows picked out by evaluating the where clause over columns. Exact when
+    every comparison was vectorized; otherwise the columns only narrow the
+    rows down and the executor re-checks them.
+    """
+    kind = "columnar_scan"
+
+    def __init__(self, columns: 'ColumnStore', rows: 'np.ndarray', exact: bool, fields: List[str]):
+        self.columns = columns
+        self.rows = rows
+        self.exact = exact
+        self.fields = fields
+        self.estimated_rows = len(rows)
+        # Every live row was evaluated, if only over arrays
+        self.rows_examined = len(columns)
+
+    def candidates(self) -> Iterable['Document']:
+        docs = self.columns.docs
+        return (docs[row] for row in self.rows.tolist())
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "type": self.kind,
+            "columns": self.fields,
+            "exact": self.exact,
+            "estimated_rows": self.estimated_rows,
+        }
+
+
+class ColumnStore:
+    """
+    Columnar shadow of selected fields of a collection's latest-version view.
+
+    Each live key owns a row, which is rewritten when the key changes and
+    freed (for reuse) when it is deleted. Needs NumPy; without it the store
+    keeps its field list but stays empty and every query uses the row path.
+    """
+    INITIAL_CAPACITY = 1024
+
+    def __init__(self, fields: Iterable[str] = ()):
+        self.enabled = HAS_NUMPY
+        self.fields: List[str] = list(fields)
+        self.docs: List[Optional['Document']] = []
+        self.columns: Dict[str, Column] = {}
+        self._rows: Dict[str, int] = {}
+        self._free: List[int] = []
+        self._capacity = self.INITIAL_CAPACITY
+        if self.enabled:
+            self._live = np.zeros(self._capacity, dtype=bool)
+            self.columns = {field: Column(field, self._capacity) for field in self.fields}
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def add_column(self, field: str) -> None:
+        self.fields.append(field)
+        if not self.enabled:
+            return
+        column = self.columns[field] = Column(field, self._capacity)
+        for row, doc in enumerate(self.docs):
+            if doc is not None:
+                column.set(row, doc)
+
+    def drop_column(self, field: str) -> None:
+        self.fields.remove(field)
+        self.columns.pop(field, None)
+
+    def set_latest(self, key: str, doc: Optional['Document']) -> None:
+        """Track the latest live version of a key (None once it has none)."""
+        if not self.enabled:
+            return
+        row = self._rows.get(key)
+        if row is None:
+            if doc is None:
+                return
+            row = self._allocate()
+            self._rows[key] = row
+        elif doc is None:
+            del self._rows[key]
+            self._free.append(row)
+        elif self.docs[row] is doc:
+            return
+        self.docs[row] = doc
+        self._live[row] = doc is not None
+        for column in self.columns.values():
+            column.set(row, doc)
+
+    def _allocate(self) -> int:
+        if self._free:
+            return self._free.pop()
+        row = len(self.docs)
+        self.docs.append(None)
+        if row >= self._capacity:
+            self._capacity *= 2
+            live = np.zeros(self._capacity, dtype=bool)
+            live[:row] = self._live[:row]
+            self._live = live
+            for column in self.columns.values():
+                column.resize(self._capacity)
+        return row
+
+    def describe(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                "field": field,
+                "rows": len(self) if self.enabled else None,
+                "distinct_strings": len(self.columns[field].strings) if self.enabled else None,
+            }
+            for field in self.fields
+        ]
+
+    def scan(self, predicate: Predicate) -> Optional[ColumnarScan]:
+        """Plan a columnar scan for a predicate, if its columns can narrow the rows down."""
+        if not self.enabled or isinstance(predicate, MatchAll):
+            return None
+        n = len(self.docs)
+        live = self._live[:n]
+        mask = self._mask(predicate, n, live)
+        exact = mask is not None
+        if mask is None and isinstance(predicate, And):
+            # Vectorize the conjuncts we can and re-check the rest row by row
+            masks = [self._mask(child, n, live) for child in predicate.children]
+            masks = [mask for mask in masks if mask is not None]
+            if masks:
+                mask = np.logical_and.reduce(masks)
+        if mask is None:
+            return None
+        fields = sorted({leaf.field for leaf in predicate.comparisons() if leaf.field in self.columns})
+        return ColumnarScan(self, np.flatnonzero(mask & live), exact, fields)
+
+    def _mask(self, predicate: Predicate, n: int, live: 'np.ndarray') -> Optional['np.ndarray']:
+        if isinstance(predicate, MatchAll):
+            return np.ones(n, dtype=bool)
+        if isinstance(predicate, Comparison):
+            column = self.columns.get(predicate.field)
+            if column is None or not column.usable(live):
+                return None
+            return column.compare(predicate, n)
+        if isinstance(predicate, (And, Or)):
+            masks = []
+            for child in predicate.children:
+                mask = self._mask(child, n, live)
+                if mask is None:
+                    return None
+                masks.append(mask)
+            combine = np.logical_and if isinstance(predicate, And) else np.logical_or
+            return combine.reduce(masks)
+        if isinstance(predicate, Not):
+            mask = self._mask(predicate.child, n, live)
+            return ~mask if mask is not None else None
+        return None
+
+    def aggregate(
+        self,
+        aggregates: List[Aggregate],
+        group_by: Optional[str],
+        predicate: Predicate
+    ) -> Optional[List[Dict[str, Any]]]:
+        """
+        Vectorized equivalent of aggregate.aggregate() over the rows
+        matching the predicate, or None if the fields involved aren't all
+        columns or hold values only the row path handles exactly.
+        """
+        if not self.enabled:
+            return None
+        fields = [agg.field for agg in aggregates if agg.field is not None]
+        if group_by is not None:
+            fields.append(group_by)
+        if any(field not in self.columns for field in fields):
+            return None
+        n = len(self.docs)
+        live = self._live[:n]
+        mask = self._mask(predicate, n, live)
+        if mask is None:
+            return None
+        selected = mask & live
+        if any(not self.columns[field].usable(selected) for field in fields):
+            return None
+        rows = np.flatnonzero(selected)
+
+        grouping = self._groups(group_by, rows)
+        if grouping is None:
+            return None
+        groups, ids = grouping
+
+        results = []
+        for agg in aggregates:
+            values = self._aggregate_one(agg, rows, ids, len(groups))
+            if values is None:
+                return None
+            results.append(values)
+        return [
+            {"group": group, "values": {agg.name: values[i] for agg, values in zip(aggregates, results)}}
+            for i, group in enumerate(groups)
+        ]
+
+    def _groups(self, group_by: Optional[str], rows: 'np.ndarray') -> Optional[Tuple[List[Any], 'np.ndarray']]:
+        """Group values in aggregate() order (NULL, numbers, strings) and each row's group."""
+        if group_by is None:
+            return [None], np.zeros(len(rows), dtype=np.int64)
+        column = self.columns[group_by]
+        numbers = column.numbers[rows]
+        codes = column.codes[rows]
+        nulls = column.nulls[rows]
+        # Booleans, NaNs and objects group in ways only the row path gets right
+        if (column.others[rows] | column.booleans[rows]).any():
+            return None
+        is_string = codes >= 0
+        is_number = ~is_string & ~nulls
+        if np.isnan(numbers[is_number]).any():
+            return None
+
+        groups: List[Any] = []
+        ids = np.empty(len(rows), dtype=np.int64)
+        if nulls.any():
+            ids[nulls] = 0
+            groups.append(None)
+
+        distinct, inverse = np.unique(numbers[is_number], return_inverse=True)
+        ids[is_number] = inverse + len(groups)
+        all_integers = np.bincount(inverse, weights=~column.integers[rows][is_number], minlength=len(distinct)) == 0
+        groups.extend(
+            int(value) if integral else float(value)
+            for value, integral in zip(distinct.tolist(), all_integers.tolist())
+        )
+
+        present = np.unique(codes[is_string]).tolist()
+        present.sort(key=column.strings.__getitem__)
+        position = np.zeros(len(column.strings), dtype=np.int64)
+        position[present] = np.arange(len(present))
+        ids[is_string] = position[codes[is_string]] + len(groups)
+        groups.extend(column.strings[code] for code in present)
+        return groups, ids
+
+    def _aggregate_one(self, agg: Aggregate, rows: 'np.ndarray', ids: 'np.ndarray', size: int) -> Optional[List[Any]]:
+        if agg.field is None:
+            return np.bincount(ids, minlength=size).tolist()
+
+        column = self.columns[agg.field]
+        nulls = column.nulls[rows]
+        if agg.function == 'COUNT':
+            return np.bincount(ids, weights=~nulls, minlength=size).astype(np.int64).tolist()
+
+        numbers = column.numbers[rows]
+        booleans = column.booleans[rows]
+        integers = column.integers[rows]
+        is_number = (column.codes[rows] < 0) & ~nulls & ~column.others[rows] & ~np.isnan(numbers)
+
+        if agg.function in ('SUM', 'AVG'):
+            valid = is_number & ~booleans
+            totals = np.bincount(ids, weights=np.where(valid, numbers, 0.0), minlength=size)
+            counts = np.bincount(ids, weights=valid, minlength=size)
+            floats = np.bincount(ids, weights=valid & ~integers, minlength=size)
+            if (np.abs(totals[floats == 0]) > MAX_EXACT_INT).any():
+                return None  # Integer sums this large are only exact in Python
+            values = []
+            for total, count, float_count in zip(totals.tolist(), counts.tolist(), floats.tolist()):
+                if not count:
+                    values.append(None)
+                elif agg.function == 'AVG':
+                    values.append(total / count)
+                else:
+                    values.append(total if float_count else int(total))
+            return values
+
+        # MIN and MAX: numbers before strings, as in a sorted index
+        if booleans.any():
+            return None
+        largest = agg.function == 'MAX'
+        pick = np.fmax if largest else np.fmin
+        extremes = np.full(size, np.nan)
+        pick.at(extremes, ids[is_number], numbers[is_number])
+        # Report an extreme held by an integer as an integer
+        is_integer = is_number & integers
+        integer_extremes = np.full(size, np.nan)
+        pick.at(integer_extremes, ids[is_integer], numbers[is_integer])
+
+        is_string = column.codes[rows] >= 0
+        codes = column.codes[rows][is_string]
+        ranks = column.string_ranks()
+        by_rank = np.argsort(ranks)
+        best_rank = np.full(size, -1 if largest else len(ranks), dtype=np.int64)
+        (np.maximum if largest else np.minimum).at(best_rank, ids[is_string], ranks[codes])
+        has_string = np.bincount(ids, weights=is_string, minlength=size) > 0
+
+        values = []
+        for i in range(size):
+            number = extremes[i]
+            if has_string[i] and (largest or np.isnan(number)):
+                values.append(column.strings[by_rank[best_rank[i]]])
+            elif not np.isnan(number):
+                values.append(int(number) if number == integer_extremes[i] else float(number))
+            else:
+                values.append(None)
+        return values
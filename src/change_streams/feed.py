@@ -0,0 +1,406 @@
+import asyncio
+import threading
+import time
+from bisect import bisect_right
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from .store import Document, KeyValueStore, OperationType
+
+
+class ChangeNotifier:
+    """
+    Lets asyncio tasks park until the store commits a transaction newer
+    than one they have already seen, or removes changes they may not have.
+
+    The store calls notify() from its log writer thread as transactions
+    commit, and after removals; waiters are woken on their event loop.
+    """
+
+    def __init__(self, store: 'KeyValueStore'):
+        self.store = store
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._committed: Optional[asyncio.Event] = None
+        store.add_listener(self.notify)
+
+    def notify(self, transaction_id: int) -> None:
+        """Store listener: wake everyone waiting for a newer transaction."""
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self) -> None:
+        # Swap in a fresh event so that later waiters block again
+        committed, self._committed = self._committed, asyncio.Event()
+        if committed is not None:
+            committed.set()
+
+    async def wait(self, transaction_id: int, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until a transaction newer than transaction_id has committed, or
+        removals raised a rollback watermark (which callers need to check).
+        Returns False if the timeout elapsed first.
+        """
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+            self._committed = asyncio.Event()
+        watermark = self.store.rollback_watermark()
+
+        def woken() -> bool:
+            return self.store.committed_transaction_id > transaction_id or self.store.rollback_watermark() > watermark
+
+        while not woken():
+            try:
+                await asyncio.wait_for(self._committed.wait(), timeout)
+            except asyncio.TimeoutError:
+                return woken()
+        return True
+
+
+class FilterGroup:
+    """
+    The changes matching one (collection, where) filter, evaluated once and
+    shared by every consumer reading with that filter.
+
+    The buffer holds every match with a transaction ID in (start, scanned].
+    It is capped at max_buffered entries by dropping the oldest, and starts
+    over whenever the store removes versions, since buffered ones may be
+    among them.
+    """
+
+    def __init__(self, store: 'KeyValueStore', collection: Optional[str], where: Optional[str], max_buffered: int):
+        self.store = store
+        self.collection = collection
+        self.where = where
+        self.max_buffered = max_buffered
+        self.last_used = time.monotonic()
+        self._lock = threading.Lock()
+        self._ids: List[int] = []
+        self._changes: List[Tuple['Document', 'OperationType']] = []
+        self._removed_versions = store.removed_versions
+        self.start = self.scanned = store.committed_transaction_id
+
+    def __len__(self) -> int:
+        return len(self._changes)
+
+    def changes_after(self, transaction_id: int, limit: int) -> Optional[List[Tuple['Document', 'OperationType']]]:
+        """
+        Up to limit buffered changes after transaction_id, or None if the
+        buffer doesn't reach back that far.
+        """
+        with self._lock:
+            self.last_used = time.monotonic()
+            self._refresh()
+            if transaction_id < self.start:
+                return None
+            i = bisect_right(self._ids, transaction_id)
+            return self._changes[i:i + limit]
+
+    def _refresh(self) -> None:
+        """Evaluate the filter against everything committed since the last refresh."""
+        if self.store.removed_versions != self._removed_versions:
+            self._removed_versions = self.store.removed_versions
+            self._ids, self._changes = [], []
+            self.start = self.scanned = self.store.committed_transaction_id
+            return
+
+        while self.scanned < self.store.committed_transaction_id:
+            seen_transaction_id = self.store.committed_transaction_id
+            batch = self.store.get_changes_after(
+                self.scanned, limit=self.max_buffered, where=self.where, collection=self.collection
+            )
+            for doc, operation in batch:
+                self._ids.append(doc.transaction_id)
+                self._changes.append((doc, operation))
+            if len(batch) < self.max_buffered:
+                # The store may have committed more since; matches up to the last one were read
+                self.scanned = max(seen_transaction_id, batch[-1][0].transaction_id if batch else 0)
+            else:
+                self.scanned = batch[-1][0].transaction_id
+
+            excess = len(self._ids) - self.max_buffered
+            if excess > 0:
+                self.start = self._ids[excess - 1]
+                del self._ids[:excess]
+                del self._changes[:excess]
+
+
+class ChangeFanOut:
+    """
+    Change feed reads shared between consumers with identical filters.
+
+    Each distinct (collection, where) pair gets a FilterGroup that evaluates
+    its predicate once per committed change, however many consumers poll
+    with it; consumers then read from the group's buffer by transaction ID.
+    Consumers whose cursor predates a group's buffer (typically replaying
+    old history) are served straight from the store. Groups nobody has read
+    for idle_ttl_s seconds are dropped.
+    """
+    IDLE_TTL_S = 300.0
+    MAX_BUFFERED = 10_000
+    MAX_GROUPS = 1024
+
+    def __init__(
+        self,
+        store: 'KeyValueStore',
+        idle_ttl_s: float = IDLE_TTL_S,
+        max_buffered: int = MAX_BUFFERED,
+        max_groups: int = MAX_GROUPS
+    ):
+        self.store = store
+        self.idle_ttl_s = idle_ttl_s
+        self.max_buffered = max_buffered
+        self.max_groups = max_groups
+        self._groups: Dict[Tuple[Optional[str], Optional[str]], FilterGroup] = {}
+        self._lock = threading.Lock()
+        self._last_expiry = time.monotonic()
+        self.shared_reads = 0
+        self.direct_reads = 0
+
+    def changes_after(
+        self,
+        transaction_id: int,
+        limit: int = 2,
+        where: Optional[str] = None,
+        collection: Optional[str] = None,
+        compact: bool = False
+    ) -> List[Tuple['Document', 'OperationType']]:
+        """Same as KeyValueStore.get_changes_after, served from a shared filter group when possible."""
+        if compact:
+            # Compaction depends on the window read, so it isn't shared
+            self.direct_reads += 1
+            return self.store.get_changes_after(
+                transaction_id, limit=limit, where=where, collection=collection, compact=True
+            )
+        group = self._group(collection, where or None)
+        changes = group.changes_after(transaction_id, limit) if group is not None else None
+        if changes is None:
+            self.direct_reads += 1
+            return self.store.get_changes_after(transaction_id, limit=limit, where=where, collection=collection)
+        self.shared_reads += 1
+        return changes
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "groups": len(self._groups),
+                "buffered_changes": sum(len(group) for group in self._groups.values()),
+                "shared_reads": self.shared_reads,
+                "direct_reads": self.direct_reads,
+            }
+
+    def _group(self, collection: Optional[str], where: Optional[str]) -> Optional[FilterGroup]:
+        if where:
+            self.store.query_parser.compile(where)  # Reject invalid clauses up front
+        with self._lock:
+            self._expire()
+            group = self._groups.get((collection, where))
+            if group is None and len(self._groups) < self.max_groups:
+                group = FilterGroup(self.store, collection, where, self.max_buffered)
+                self._groups[(collection, where)] = group
+            return group
+
+    def _expire(self) -> None:
+        """Drop idle groups (caller holds _lock); runs at most once a second."""
+        now = time.monotonic()
+        if now - self._last_expiry < 1.0:
+            return
+        self._last_expiry = now
+        for key, group in list(self._groups.items()):
+            if now - group.last_used > self.idle_ttl_s:
+                del self._groups[key]
+
+class SlowConsumerError(Exception):
+    """A subscriber stopped reading and a send timed out."""
+
+
+class Subscription:
+    """One filtered change feed within a session, with its own cursor and credit."""
+
+    def __init__(
+        self,
+        subscription_id: str,
+        collection: Optional[str],
+        where: Optional[str],
+        cursor: int,
+        credit: int
+    ):
+        self.id = subscription_id
+        self.collection = collection
+        self.where = where
+        self.cursor = cursor
+        self.credit = credit
+
+
+class SubscriptionSession:
+    """
+    Multiplexes many change feed subscriptions over one connection.
+
+    Clients send JSON messages:
+
+        {"op": "subscribe", "id": "s1", "collection": "users",
+         "where": "value.status = 'active'", "start": 0, "credit": 100}
+        {"op": "credit", "id": "s1", "credit": 50}
+        {"op": "unsubscribe", "id": "s1"}
+
+    and receive ``subscribed``, ``change``, ``rollback``, ``unsubscribed``
+    and ``error`` messages tagged with the subscription ID.
+
+    Flow control is credit based: a subscription is sent at most as many
+    changes as it has been granted credit for, and otherwise only its
+    cursor is kept, so the server never buffers on a consumer's behalf.
+    A consumer that stops reading altogether is disconnected once a send
+    times out.
+    """
+    MAX_SUBSCRIPTIONS = 64
+    MAX_CREDIT = 10_000
+    BATCH_SIZE = 100
+    SEND_TIMEOUT_S = 10.0
+
+    def __init__(
+        self,
+        store: 'KeyValueStore',
+        notifier: ChangeNotifier,
+        fanout: ChangeFanOut,
+        send: Callable[[Dict[str, Any]], Awaitable[None]],
+        receive: Callable[[], Awaitable[Dict[str, Any]]],
+        serialize: Callable[['Document', Any], Dict[str, Any]]
+    ):
+        self.store = store
+        self.notifier = notifier
+        self.fanout = fanout
+        self.serialize = serialize
+        self._send = send
+        self._receive = receive
+        self._subscriptions: Dict[str, Subscription] = {}
+        self._send_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+
+    async def run(self) -> None:
+        """Serve the connection until the client goes away (or is too slow)."""
+        receiver = asyncio.create_task(self._receive_loop())
+        try:
+            while not receiver.done():
+                if await self._pump():
+                    continue
+                await self._wait_for_work(receiver)
+            receiver.result()  # Surface disconnects and errors
+        finally:
+            receiver.cancel()
+
+    async def _wait_for_work(self, receiver: asyncio.Task) -> None:
+        """Sleep until a change commits, a control message arrives or the client leaves."""
+        woken = asyncio.create_task(self._wakeup.wait())
+        committed = asyncio.create_task(self.notifier.wait(self.store.committed_transaction_id))
+        try:
+            await asyncio.wait({woken, committed, receiver}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            woken.cancel()
+            committed.cancel()
+        self._wakeup.clear()
+
+    async def _pump(self) -> bool:
+        """Send what each subscription has credit for; returns whether anything was sent."""
+        progressed = False
+        for subscription in list(self._subscriptions.values()):
+            if subscription.credit <= 0:
+                continue
+            if subscription.cursor < self.store.rollback_watermark(subscription.collection):
+                del self._subscriptions[subscription.id]
+                await self._emit({
+                    "type": "rollback",
+                    "id": subscription.id,
+                    "max_transaction_id": self.store.committed_transaction_id
+                })
+                progressed = True
+                continue
+            if subscription.cursor >= self.store.committed_transaction_id:
+                continue
+
+            seen_transaction_id = self.store.committed_transaction_id
+            limit = min(subscription.credit, self.BATCH_SIZE)
+            changes = self.fanout.changes_after(
+                subscription.cursor,
+                limit=limit,
+                where=subscription.where,
+                collection=subscription.collection
+            )
+            for doc, operation in changes:
+                await self._emit({
+                    "type": "change",
+                    "id": subscription.id,
+                    "change": self.serialize(doc, operation)
+                })
+                subscription.cursor = doc.transaction_id
+                subscription.credit -= 1
+            if len(changes) < limit:
+                # Nothing else up to seen_transaction_id matched
+                subscription.cursor = max(subscription.cursor, seen_transaction_id)
+            progressed = progressed or bool(changes)
+        return progressed
+
+    async def _receive_loop(self) -> None:
+        while True:
+            message = await self._receive()
+            reply = self._handle(message)
+            if reply is not None:
+                await self._emit(reply)
+            self._wakeup.set()
+
+    def _handle(self, message: Any) -> Optional[Dict[str, Any]]:
+        """Apply one control message; returns the reply to send, if any."""
+        if not isinstance(message, dict):
+            return {"type": "error", "detail": "Messages must be JSON objects"}
+        op = message.get("op")
+        subscription_id = message.get("id")
+        if not isinstance(subscription_id, str):
+            return {"type": "error", "detail": "Missing subscription id"}
+
+        if op == "subscribe":
+            if subscription_id in self._subscriptions:
+                return {"type": "error", "id": subscription_id, "detail": "Subscription id already in use"}
+            if len(self._subscriptions) >= self.MAX_SUBSCRIPTIONS:
+                return {"type": "error", "id": subscription_id, "detail": "Too many subscriptions"}
+            where = message.get("where")
+            collection = message.get("collection")
+            for name, value in (("collection", collection), ("where", where)):
+                if value is not None and not isinstance(value, str):
+                    return {"type": "error", "id": subscription_id, "detail": f"{name} must be a string"}
+            try:
+                if where:
+                    self.store.query_parser.compile(where)
+                start = int(message.get("start", 0))
+                credit = self._credit(message)
+            except (TypeError, ValueError) as e:
+                return {"type": "error", "id": subscription_id, "detail": str(e)}
+            self._subscriptions[subscription_id] = Subscription(
+                subscription_id, collection, where, start, credit
+            )
+            return {"type": "subscribed", "id": subscription_id}
+
+        subscription = self._subscriptions.get(subscription_id)
+        if subscription is None:
+            return {"type": "error", "id": subscription_id, "detail": "Unknown subscription"}
+
+        if op == "credit":
+            try:
+                subscription.credit = min(self.MAX_CREDIT, subscription.credit + self._credit(message))
+            except (TypeError, ValueError) as e:
+                return {"type": "error", "id": subscription_id, "detail": str(e)}
+            return None
+        if op == "unsubscribe":
+            del self._subscriptions[subscription_id]
+            return {"type": "unsubscribed", "id": subscription_id}
+        return {"type": "error", "id": subscription_id, "detail": f"Unknown op: {op}"}
+
+    def _credit(self, message: Dict[str, Any]) -> int:
+        credit = int(message.get("credit", 0))
+        if credit < 0:
+            raise ValueError("Credit must not be negative")
+        return min(credit, self.MAX_CREDIT)
+
+    async def _emit(self, message: Dict[str, Any]) -> None:
+        async with self._send_lock:
+            try:
+                await asyncio.wait_for(self._send(message), self.SEND_TIMEOUT_S)
+            except asyncio.TimeoutError:
+                raise SlowConsumerError("Timed out sending to subscriber")
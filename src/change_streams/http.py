@@ -1,13 +1,41 @@
-from fastapi import FastAPI, Query, HTTPException, Path, Body, status
+import json
+import os
+import time
+
+from fastapi import FastAPI, Query, HTTPException, Path, Body, Header, Request, WebSocket, WebSocketDisconnect, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from fastapi.openapi.utils import get_openapi
 from enum import Enum
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 from pydantic import BaseModel, Field
 
-from .store import KeyValueStore
+from .feed import ChangeFanOut, ChangeNotifier, SlowConsumerError, SubscriptionSession
+from .query import parse_fields, project
+from .store import KeyValueStore, encode_cursor
+
+# Initialize the store; durability is tuned per deployment
+store = KeyValueStore(
+    storage_path=os.environ.get("CHANGE_STREAMS_STORAGE_PATH", "kvstore.json"),
+    fsync_policy=os.environ.get("CHANGE_STREAMS_FSYNC_POLICY", "always"),
+    fsync_interval_ms=float(os.environ.get("CHANGE_STREAMS_FSYNC_INTERVAL_MS", "100")),
+    snapshot_every=int(os.environ.get("CHANGE_STREAMS_SNAPSHOT_EVERY", "100000")),
+    snapshot_interval_s=float(os.environ.get("CHANGE_STREAMS_SNAPSHOT_INTERVAL_S", "300")),
+    scan_workers=int(os.environ["CHANGE_STREAMS_SCAN_WORKERS"]) if "CHANGE_STREAMS_SCAN_WORKERS" in os.environ else None,
+    parallel_scan_min_rows=int(os.environ.get("CHANGE_STREAMS_PARALLEL_SCAN_MIN_ROWS", "200000"))
+)
+notifier = ChangeNotifier(store)
+fanout = ChangeFanOut(store)
 
-# Initialize the store
-store = KeyValueStore()
+# Changes read from the store per batch when streaming
+STREAM_BATCH_SIZE = 100
+# Idle streams send a comment this often so proxies keep them open
+STREAM_HEARTBEAT_S = 15.0
+# Documents per chunk written by GET /snapshot
+SNAPSHOT_BATCH_SIZE = 1000
+# /consumers/{name} routes with these names would be matched by the
+# /{collection}/... routes of a collection called "consumers" instead
+RESERVED_CONSUMER_NAMES = {"documents", "aggregate", "indexes", "columns"}
 
 app = FastAPI(
     title="Change Streams API",
@@ -26,6 +54,7 @@ app = FastAPI(
     - List membership: `value.status IN ('active', 'pending')`
     - Null checks: `value.email IS NOT NULL`
     - Range checks: `value.age BETWEEN 25 AND 50`
+    - Boolean logic: `value.age > 25 AND (value.status = 'active' OR NOT value.vip = true)`
     """,
     version="1.0.0",
     contact={
@@ -39,6 +68,10 @@ class OperationType(str, Enum):
     UPDATE = "update"
     DELETE = "delete"
 
+class IndexKind(str, Enum):
+    HASH = "hash"
+    SORTED = "sorted"
+
 class DocumentResponse(BaseModel):
     key: str = Field(..., description="Unique identifier of the document within its collection")
     value: Any = Field(..., description="Document content (any valid JSON)")
@@ -63,11 +96,42 @@ class DocumentResponse(BaseModel):
             }
         }
 
+FIELDS_DESCRIPTION = "Comma-separated field paths to return instead of the whole value, e.g. value.name,value.address.city"
+
+def parse_projection(fields: Optional[str]) -> Optional[List[Tuple[str, ...]]]:
+    """Parse a fields= parameter, answering 400 if it is malformed."""
+    if fields is None:
+        return None
+    try:
+        return parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def document_response(doc, operation=None, paths: Optional[List[Tuple[str, ...]]] = None) -> DocumentResponse:
+    """Build a response for a document, keeping only the projected paths of its value."""
+    fields = doc.__dict__ if paths is None else {**doc.__dict__, "value": project(doc.value, paths)}
+    return DocumentResponse(**fields, operation=operation.value if operation is not None else None)
+
+class QueryExplanation(BaseModel):
+    plan: Dict[str, Any] = Field(..., description="Chosen access path (full scan, index lookup, intersection or union)")
+    estimated_rows: int = Field(..., description="Document versions the planner expected to examine")
+    rows_examined: int = Field(..., description="Document versions actually checked against the where clause")
+    rows_matched: int = Field(..., description="Document versions that matched")
+    elapsed_ms: float = Field(..., description="Time spent planning and executing the query")
+
 class DocumentList(BaseModel):
     documents: Dict[str, List[DocumentResponse] | DocumentResponse] = Field(
         ..., 
         description="Map of document keys to their versions or latest version"
     )
+    explain: Optional[QueryExplanation] = Field(
+        None,
+        description="Query plan and execution statistics, when requested with explain=true"
+    )
+    next_cursor: Optional[str] = Field(
+        None,
+        description="Pass as cursor to fetch the next page; absent on the last page"
+    )
 
 class ChangesResponse(BaseModel):
     changes: List[DocumentResponse]
@@ -76,6 +140,37 @@ class ChangesResponse(BaseModel):
         False,
         description="If true, the client needs to rollback and reload their data"
     )
+    resume_transaction_id: Optional[int] = Field(
+        None,
+        description="Transaction ID to pass as start on the next request (absent when rolling back)"
+    )
+
+class ConsumerResponse(BaseModel):
+    name: str = Field(..., description="Consumer name")
+    collection: Optional[str] = Field(None, description="Collection the consumer reads, or all")
+    where: Optional[str] = Field(None, description="Where clause filtering the consumer's changes")
+    offset: int = Field(..., description="Last acknowledged transaction ID")
+    updated_at: float = Field(..., description="When the offset last changed")
+    lag_transactions: int = Field(..., description="Transactions committed since the offset")
+    pending_changes: int = Field(..., description="Changes to the collection after the offset, before filtering")
+
+class AggregateGroup(BaseModel):
+    group: Any = Field(None, description="Value of the group_by field (null without group_by)")
+    values: Dict[str, Any] = Field(..., description="Aggregate results, keyed by expression, e.g. 'sum(value.total)'")
+
+class AggregateResponse(BaseModel):
+    groups: List[AggregateGroup]
+
+class IndexResponse(BaseModel):
+    field: str = Field(..., description="Indexed field path")
+    kind: str = Field(..., description="Index kind")
+    entries: int = Field(..., description="Number of document versions in the index")
+    distinct_values: int = Field(..., description="Number of distinct indexed values")
+
+class ColumnResponse(BaseModel):
+    field: str = Field(..., description="Field path kept as a column")
+    rows: Optional[int] = Field(None, description="Number of current documents in the column (null without NumPy)")
+    distinct_strings: Optional[int] = Field(None, description="Size of the column's string dictionary")
 
 class DocumentInput(BaseModel):
     value: Any = Field(..., description="Document content (any valid JSON)")
@@ -105,9 +200,10 @@ async def upsert_document(
     """Create or update a document in the specified collection."""
     try:
         doc = store.upsert(collection, key, document.value)
-        return DocumentResponse(**doc.__dict__)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+    await store.flush_async()
+    return DocumentResponse(**doc.__dict__)
 
 @app.get(
     "/{collection}/documents/{key}",
@@ -118,13 +214,15 @@ async def upsert_document(
 async def get_document(
     collection: str = Path(..., description="Collection name"),
     key: str = Path(..., description="Document key"),
-    version: Optional[int] = Query(None, description="Specific version to retrieve")
+    version: Optional[int] = Query(None, description="Specific version to retrieve"),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)
 ):
     """Retrieve a document by key, optionally specifying a version."""
+    paths = parse_projection(fields)
     doc = store.get(collection, key, version)
     if doc is None:
         raise HTTPException(status_code=404, detail="Document not found")
-    return DocumentResponse(**doc.__dict__)
+    return document_response(doc, paths=paths)
 
 @app.delete(
     "/{collection}/documents/{key}",
@@ -137,6 +235,7 @@ async def delete_document(
 ):
     """Delete a document from the specified collection."""
     if store.delete(collection, key):
+        await store.flush_async()
         return {"status": "deleted"}
     raise HTTPException(status_code=404, detail="Document not found")
 
@@ -153,17 +252,205 @@ async def list_documents(
         None, 
         description="SQL-like query to filter documents",
         example="value.age > 25 AND value.status = 'active'"
-    )
+    ),
+    explain: bool = Query(False, description="If true, include the query plan and execution statistics"),
+    limit: Optional[int] = Query(None, ge=1, le=10000, description="Maximum number of keys to return"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    order_by: Optional[str] = Query(
+        None,
+        description="Sort by a field instead of key, optionally DESC; limit then keeps the top results",
+        example="value.total DESC"
+    ),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)
 ):
-    """List documents in a collection with optional filtering."""
+    """
+    List documents in a collection with optional filtering.
+
+    With `explain=true` and a `where` clause, the response also reports the
+    plan chosen for the query, estimated and actual rows examined, and the
+    time spent, which helps decide which fields are worth indexing.
+
+    With `limit`, documents are returned in key order a page at a time;
+    pass the response's `next_cursor` as `cursor` to get the next page.
+    With `order_by` they are sorted by that field instead and `limit`
+    returns the top results, e.g. `order_by=value.total DESC&limit=20`.
+    """
+    paths = parse_projection(fields)
     try:
-        if where:
-            documents = store.query_documents(collection, where, latest_only)
+        explanation = None
+        # Queries may scan the whole collection, so they run off the event loop
+        if (where or order_by) and explain:
+            documents, explanation = await run_in_threadpool(
+                store.explain_query, collection, where, latest_only, limit, cursor, order_by
+            )
+        elif where or order_by:
+            documents = await run_in_threadpool(
+                store.query_documents, collection, where, latest_only, limit, cursor, order_by
+            )
         else:
-            documents = store.list_documents(collection, latest_only)
-        return DocumentList(documents=documents)
+            documents = store.list_documents(collection, latest_only, limit, cursor)
+        next_cursor = None
+        if limit is not None and not order_by and len(documents) == limit:
+            next_cursor = encode_cursor(next(reversed(documents)))
+        documents = {
+            key: document_response(docs, paths=paths) if not isinstance(docs, list)
+            else [document_response(doc, paths=paths) for doc in docs]
+            for key, docs in documents.items()
+        }
+        return DocumentList(documents=documents, explain=explanation, next_cursor=next_cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get(
+    "/{collection}/aggregate",
+    response_model=AggregateResponse,
+    tags=["Documents"],
+    summary="Aggregate documents in a collection",
+    responses={400: {"description": "Invalid aggregate, field or where clause"}}
+)
+async def aggregate_documents(
+    collection: str = Path(..., description="Collection name"),
+    select: List[str] = Query(
+        ["COUNT(*)"],
+        description="Aggregates to compute: COUNT(*), COUNT, SUM, MIN, MAX or AVG of a field",
+        example=["COUNT(*)", "SUM(value.total)"]
+    ),
+    group_by: Optional[str] = Query(None, description="Field to group by", example="value.status"),
+    where: Optional[str] = Query(
+        None,
+        description="SQL-like query to filter documents",
+        example="value.total > 100"
+    )
+):
+    """
+    Aggregate the latest version of each document server-side, e.g.
+    orders by status (`select=COUNT(*)&group_by=value.status`) or revenue
+    per product (`select=SUM(value.total)&group_by=value.product`).
+
+    SUM and AVG ignore non-numeric values; MIN and MAX order numbers
+    before strings and ignore NULLs, objects and arrays.
+    """
+    try:
+        groups = store.aggregate(collection, select, group_by, where)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    return AggregateResponse(groups=groups)
+
+@app.get(
+    "/{collection}/indexes",
+    response_model=List[IndexResponse],
+    tags=["Indexes"],
+    summary="List indexes on a collection"
+)
+async def list_indexes(
+    collection: str = Path(..., description="Collection name")
+):
+    """List the secondary indexes defined on a collection."""
+    return store.list_indexes(collection)
+
+@app.put(
+    "/{collection}/indexes/{field}",
+    tags=["Indexes"],
+    summary="Create an index",
+    responses={
+        200: {"description": "Index created"},
+        409: {"description": "Field is already indexed"}
+    }
+)
+async def create_index(
+    collection: str = Path(..., description="Collection name"),
+    field: str = Path(..., description="Field path to index", example="value.status"),
+    kind: IndexKind = Query(IndexKind.HASH, description="Index kind")
+):
+    """
+    Create a secondary index on a field path.
+
+    Queries on the collection whose where clause can be answered by the
+    index use it automatically. Hash indexes answer `=`, `IN` and
+    `IS NULL`; sorted indexes also answer `>`, `>=`, `<`, `<=` and `BETWEEN`.
+    """
+    try:
+        created = store.create_index(collection, field, kind.value)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not created:
+        raise HTTPException(status_code=409, detail="Field is already indexed")
+    await store.flush_async()
+    return {"status": "created"}
+
+@app.delete(
+    "/{collection}/indexes/{field}",
+    tags=["Indexes"],
+    summary="Drop an index"
+)
+async def drop_index(
+    collection: str = Path(..., description="Collection name"),
+    field: str = Path(..., description="Indexed field path")
+):
+    """Drop a secondary index from a collection."""
+    if store.drop_index(collection, field):
+        await store.flush_async()
+        return {"status": "dropped"}
+    raise HTTPException(status_code=404, detail="Index not found")
+
+@app.get(
+    "/{collection}/columns",
+    response_model=List[ColumnResponse],
+    tags=["Indexes"],
+    summary="List columns on a collection"
+)
+async def list_columns(
+    collection: str = Path(..., description="Collection name")
+):
+    """List the fields of a collection kept in columnar form."""
+    return store.list_columns(collection)
+
+@app.put(
+    "/{collection}/columns/{field}",
+    tags=["Indexes"],
+    summary="Create a column",
+    responses={
+        200: {"description": "Column created"},
+        400: {"description": "Invalid field path, or NumPy is not installed"},
+        409: {"description": "Field already has a column"}
+    }
+)
+async def create_column(
+    collection: str = Path(..., description="Collection name"),
+    field: str = Path(..., description="Field path to keep as a column", example="value.total")
+):
+    """
+    Keep a columnar (NumPy) copy of a field of the collection's current
+    documents.
+
+    `latest_only` queries and aggregates that would otherwise scan every
+    document evaluate comparisons and aggregates on columnar fields over
+    whole arrays instead, falling back to document-by-document evaluation
+    for the rest of the where clause. Requires the `columnar` extra.
+    """
+    try:
+        created = store.create_column(collection, field)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not created:
+        raise HTTPException(status_code=409, detail="Field already has a column")
+    await store.flush_async()
+    return {"status": "created"}
+
+@app.delete(
+    "/{collection}/columns/{field}",
+    tags=["Indexes"],
+    summary="Drop a column"
+)
+async def drop_column(
+    collection: str = Path(..., description="Collection name"),
+    field: str = Path(..., description="Field path kept as a column")
+):
+    """Drop a field's columnar copy."""
+    if store.drop_column(collection, field):
+        await store.flush_async()
+        return {"status": "dropped"}
+    raise HTTPException(status_code=404, detail="Column not found")
 
 @app.get(
     "/changes",
@@ -187,7 +474,8 @@ async def list_documents(
                             }
                         ],
                         "max_transaction_id": 42,
-                        "needs_rollback": False
+                        "needs_rollback": False,
+                        "resume_transaction_id": 42
                     }
                 }
             }
@@ -214,7 +502,11 @@ async def get_changes(
         description="SQL-like query to filter changes",
         example="value.status = 'active'"
     ),
-    collection: Optional[str] = Query(None, description="Optional collection to filter changes")
+    collection: Optional[str] = Query(None, description="Optional collection to filter changes"),
+    wait: bool = Query(False, description="If true, wait for matching changes instead of returning an empty list"),
+    timeout_ms: int = Query(30000, ge=0, le=300000, description="Longest time to wait when wait=true"),
+    compact: bool = Query(False, description="If true, return only the newest change to each key within the window read"),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)
 ):
     """
     Get changes feed with optional filtering by collection and query.
@@ -222,25 +514,358 @@ async def get_changes(
     If the client's start transaction ID is older than the oldest available
     tombstone, a rollback response will be returned indicating that the
     client needs to reload their data.
+
+    With `wait=true` the request is held open until a matching change
+    commits or `timeout_ms` elapses, so idle consumers don't need to poll.
+
+    With `compact=true` intermediate versions are skipped: the response
+    holds the newest change to each of up to `limit` keys, which is all a
+    consumer catching up on current state needs. Either way, continue from
+    `resume_transaction_id`.
     """
+    return await read_changes(start, limit, where, collection, wait, timeout_ms, compact, parse_projection(fields))
+
+async def read_changes(
+    start: int,
+    limit: int,
+    where: Optional[str],
+    collection: Optional[str],
+    wait: bool,
+    timeout_ms: int,
+    compact: bool = False,
+    paths: Optional[List[Tuple[str, ...]]] = None
+) -> ChangesResponse:
+    """Read (or long-poll for) changes after start; shared by the change feed endpoints."""
     # Check if client needs to rollback
-    if start < store.highest_removed_tombstone_id:
+    if start < store.rollback_watermark(collection):
         return ChangesResponse(
             changes=[],
-            max_transaction_id=store.current_transaction_id,
+            max_transaction_id=store.committed_transaction_id,
             needs_rollback=True
         )
 
-    changes = store.get_changes_after(start, limit=limit, where=where, collection=collection)
+    deadline = time.monotonic() + timeout_ms / 1000
+    scan_from = start
+    while True:
+        seen_transaction_id = store.committed_transaction_id
+        try:
+            changes = fanout.changes_after(
+                scan_from, limit=limit, where=where, collection=collection, compact=compact
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        remaining = deadline - time.monotonic()
+        if changes or not wait or remaining <= 0:
+            break
+        # Nothing up to seen_transaction_id matched; only rescan what's new
+        scan_from = seen_transaction_id
+        if not await notifier.wait(seen_transaction_id, remaining):
+            break
+        if start < store.rollback_watermark(collection):
+            return ChangesResponse(
+                changes=[],
+                max_transaction_id=store.committed_transaction_id,
+                needs_rollback=True
+            )
+
+    if len(changes) == limit:
+        resume_transaction_id = changes[-1][0].transaction_id
+    else:
+        # Nothing else up to seen_transaction_id matched
+        resume_transaction_id = max(seen_transaction_id, changes[-1][0].transaction_id if changes else start)
+
     return ChangesResponse(
-        changes=[
-            DocumentResponse(**doc.__dict__, operation=operation.value)
-            for doc, operation in changes
-        ],
-        max_transaction_id=store.current_transaction_id,
-        needs_rollback=False
+        changes=[document_response(doc, operation, paths) for doc, operation in changes],
+        max_transaction_id=store.committed_transaction_id,
+        needs_rollback=False,
+        resume_transaction_id=resume_transaction_id
+    )
+
+def consumer_response(consumer) -> ConsumerResponse:
+    return ConsumerResponse(**consumer.__dict__, **store.consumer_lag(consumer))
+
+def get_consumer_or_404(name: str):
+    consumer = store.get_consumer(name)
+    if consumer is None:
+        raise HTTPException(status_code=404, detail="Consumer not found")
+    return consumer
+
+@app.get(
+    "/consumers",
+    response_model=List[ConsumerResponse],
+    tags=["Consumers"],
+    summary="List consumers"
+)
+async def list_consumers():
+    """List named consumers with their offsets and lag."""
+    return [consumer_response(consumer) for consumer in store.list_consumers()]
+
+@app.put(
+    "/consumers/{name}",
+    response_model=ConsumerResponse,
+    status_code=status.HTTP_201_CREATED,
+    tags=["Consumers"],
+    summary="Create a consumer",
+    responses={
+        400: {"description": "Invalid name or where clause"},
+        409: {"description": "Consumer already exists"}
+    }
+)
+async def create_consumer(
+    name: str = Path(..., description="Consumer name"),
+    collection: Optional[str] = Query(None, description="Optional collection to read changes from"),
+    where: Optional[str] = Query(
+        None,
+        description="SQL-like query to filter changes",
+        example="value.status = 'active'"
+    ),
+    start: int = Query(0, description="Initial offset: the consumer reads changes after this transaction ID")
+):
+    """
+    Create a named consumer whose offset is stored (and persisted) by the
+    server, so consumer workers don't need to track their own position.
+    Names of collection endpoints (such as `documents`) are reserved.
+    """
+    if name in RESERVED_CONSUMER_NAMES:
+        raise HTTPException(status_code=400, detail=f"Consumer name is reserved: {name}")
+    try:
+        created = store.create_consumer(name, collection=collection, where=where, start=start)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not created:
+        raise HTTPException(status_code=409, detail="Consumer already exists")
+    await store.flush_async()
+    return consumer_response(store.get_consumer(name))
+
+@app.get(
+    "/consumers/{name}",
+    response_model=ConsumerResponse,
+    tags=["Consumers"],
+    summary="Get a consumer",
+    responses={404: {"description": "Consumer not found"}}
+)
+async def get_consumer(name: str = Path(..., description="Consumer name")):
+    """Get a consumer's offset and how far it is behind."""
+    return consumer_response(get_consumer_or_404(name))
+
+@app.delete(
+    "/consumers/{name}",
+    tags=["Consumers"],
+    summary="Delete a consumer",
+    responses={404: {"description": "Consumer not found"}}
+)
+async def delete_consumer(name: str = Path(..., description="Consumer name")):
+    """Delete a consumer and its offset."""
+    if store.delete_consumer(name):
+        await store.flush_async()
+        return {"status": "deleted"}
+    raise HTTPException(status_code=404, detail="Consumer not found")
+
+@app.get(
+    "/consumers/{name}/changes",
+    response_model=ChangesResponse,
+    tags=["Consumers"],
+    summary="Get a consumer's changes",
+    responses={404: {"description": "Consumer not found"}}
+)
+async def get_consumer_changes(
+    name: str = Path(..., description="Consumer name"),
+    limit: int = Query(2, ge=1, le=100, description="Maximum number of changes to return"),
+    wait: bool = Query(False, description="If true, wait for matching changes instead of returning an empty list"),
+    timeout_ms: int = Query(30000, ge=0, le=300000, description="Longest time to wait when wait=true"),
+    compact: bool = Query(False, description="If true, return only the newest change to each key within the window read"),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)
+):
+    """
+    Get the changes after the consumer's committed offset, filtered as
+    configured for the consumer. Reading doesn't move the offset:
+    acknowledge processed changes with `POST /consumers/{name}/ack`, or
+    they are returned again.
+    """
+    consumer = get_consumer_or_404(name)
+    return await read_changes(
+        consumer.offset, limit, consumer.where, consumer.collection, wait, timeout_ms, compact,
+        parse_projection(fields)
     )
 
+@app.post(
+    "/consumers/{name}/ack",
+    response_model=ConsumerResponse,
+    tags=["Consumers"],
+    summary="Acknowledge changes",
+    responses={
+        400: {"description": "Transaction ID is in the future"},
+        404: {"description": "Consumer not found"}
+    }
+)
+async def ack_consumer(
+    name: str = Path(..., description="Consumer name"),
+    transaction_id: int = Query(..., description="Every change up to this transaction ID has been processed")
+):
+    """Commit the consumer's offset. Offsets never move backwards."""
+    try:
+        consumer = store.ack_consumer(name, transaction_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if consumer is None:
+        raise HTTPException(status_code=404, detail="Consumer not found")
+    await store.flush_async()
+    return consumer_response(consumer)
+
+def format_sse(event: str, data: str, event_id: Optional[int] = None) -> str:
+    """Format one Server-Sent Events message."""
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {data}")
+    return "\n".join(lines) + "\n\n"
+
+@app.get(
+    "/changes/stream",
+    tags=["Changes"],
+    summary="Stream the change feed",
+    response_class=StreamingResponse,
+    responses={
+        200: {
+            "description": "Server-Sent Events stream of changes",
+            "content": {"text/event-stream": {}}
+        }
+    }
+)
+async def stream_changes(
+    request: Request,
+    start: int = Query(0, description="Replay changes after this transaction ID"),
+    where: Optional[str] = Query(
+        None,
+        description="SQL-like query to filter changes",
+        example="value.status = 'active'"
+    ),
+    collection: Optional[str] = Query(None, description="Optional collection to filter changes"),
+    last_event_id: Optional[int] = Header(None, description="Resume after this transaction ID (set by EventSource on reconnect)")
+):
+    """
+    Stream changes as Server-Sent Events.
+
+    Replays every matching change after `start` and then pushes new changes
+    as they commit. Each `change` event carries the document (as in
+    `GET /changes`) and uses its transaction ID as the event ID, so a
+    reconnecting EventSource resumes where it left off.
+
+    If the consumer is behind the oldest available tombstone, a single
+    `rollback` event is sent and the stream ends; the consumer needs to
+    reload its data and reconnect.
+    """
+    if last_event_id is not None:
+        start = max(start, last_event_id)
+    if where:
+        try:
+            store.query_parser.compile(where)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    async def events():
+        cursor = start
+        while not await request.is_disconnected():
+            if cursor < store.rollback_watermark(collection):
+                yield format_sse("rollback", json.dumps({
+                    "max_transaction_id": store.committed_transaction_id,
+                    "needs_rollback": True
+                }))
+                return
+
+            seen_transaction_id = store.committed_transaction_id
+            changes = fanout.changes_after(
+                cursor, limit=STREAM_BATCH_SIZE, where=where, collection=collection
+            )
+            for doc, operation in changes:
+                change = DocumentResponse(**doc.__dict__, operation=operation.value)
+                yield format_sse("change", change.model_dump_json(), doc.transaction_id)
+                cursor = doc.transaction_id
+            if len(changes) == STREAM_BATCH_SIZE:
+                continue
+
+            # Caught up: nothing else up to seen_transaction_id matched
+            cursor = max(cursor, seen_transaction_id)
+            if not await notifier.wait(seen_transaction_id, STREAM_HEARTBEAT_S):
+                yield ": heartbeat\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.websocket("/changes/ws")
+async def subscribe_changes(websocket: WebSocket):
+    """
+    Multiplexed change subscriptions over a WebSocket.
+
+    Each `subscribe` message opens a feed with its own collection, where
+    clause, start transaction ID and credit; `credit` messages grant more
+    changes and `unsubscribe` closes a feed. Changes arrive as
+    `{"type": "change", "id": ..., "change": {...}}` messages, at most one
+    per unit of credit. A client that stops reading is disconnected.
+    """
+    await websocket.accept()
+
+    def serialize(doc, operation):
+        return DocumentResponse(**doc.__dict__, operation=operation.value).model_dump(mode="json")
+
+    async def receive():
+        try:
+            return await websocket.receive_json()
+        except ValueError:
+            return None  # Not JSON; answered with an error message
+
+    session = SubscriptionSession(store, notifier, fanout, websocket.send_json, receive, serialize)
+    try:
+        await session.run()
+    except WebSocketDisconnect:
+        pass
+    except SlowConsumerError:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Slow consumer")
+
+@app.get(
+    "/snapshot",
+    tags=["Changes"],
+    summary="Stream a consistent snapshot",
+    response_class=StreamingResponse,
+    responses={
+        200: {
+            "description": "Newline-delimited JSON: one line per document, then the resume token",
+            "content": {"application/x-ndjson": {}}
+        }
+    }
+)
+async def stream_snapshot(
+    collection: Optional[str] = Query(None, description="Optional collection to snapshot")
+):
+    """
+    Stream the latest version of every live document as of one transaction.
+
+    Each line is a document with its `collection`; the last line is
+    `{"resume_transaction_id": N}`. Reading `GET /changes?start=N`
+    afterwards picks up exactly where the snapshot left off, which is how
+    a client recovers from `needs_rollback`. Writers are not blocked while
+    the snapshot streams.
+    """
+    transaction_id, latest = store.snapshot_latest(collection)
+    # Don't serve state that a crash could still take back
+    await store.flush_async()
+
+    async def lines():
+        batch = []
+        for name, documents in latest.items():
+            for doc in documents.values():
+                batch.append(json.dumps({"collection": name, **doc.__dict__}))
+                if len(batch) == SNAPSHOT_BATCH_SIZE:
+                    yield "\n".join(batch) + "\n"
+                    batch = []
+        batch.append(json.dumps({"resume_transaction_id": transaction_id}))
+        yield "\n".join(batch) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
 @app.post(
     "/{collection}/documents/{key}/evict",
     tags=["Documents"],
@@ -266,12 +891,63 @@ async def evict_document(
     Warning: Use with caution as this operation is irreversible.
     """
     if store.evict(collection, key):
+        await store.flush_async()
         return {
             "status": "evicted",
             "warning": "Document and all its history have been permanently removed"
         }
     raise HTTPException(status_code=404, detail="Document not found")
 
+@app.post(
+    "/garbage-collect",
+    tags=["Maintenance"],
+    summary="Remove old document versions"
+)
+async def garbage_collect(
+    max_versions: int = Query(1, ge=1, description="Versions to keep per document"),
+    max_age_seconds: Optional[float] = Query(None, ge=0, description="Also remove versions older than this"),
+    retain_for_consumers: bool = Query(False, description="Keep versions that named consumers haven't acknowledged yet"),
+    max_retained_bytes: Optional[int] = Query(None, ge=0, description="Cap on the size of values kept for consumers; the oldest are removed past it")
+):
+    """
+    Remove old versions of documents.
+
+    Removing a tombstone forces change feed consumers that haven't seen it
+    to reload. With `retain_for_consumers=true`, versions after the lowest
+    offset of the named consumers reading a collection are kept, so those
+    consumers don't need to.
+    """
+    removed = store.garbage_collect(
+        max_versions=max_versions,
+        max_age_seconds=max_age_seconds,
+        retain_for_consumers=retain_for_consumers,
+        max_retained_bytes=max_retained_bytes
+    )
+    await store.flush_async()
+    return {"removed_versions": removed}
+
+@app.get(
+    "/stats/log",
+    tags=["Maintenance"],
+    summary="Write path statistics"
+)
+async def log_stats():
+    """Group commit counters (batches, records, fsyncs) for the write-ahead log."""
+    return store.log_stats()
+
+@app.get(
+    "/stats/feed",
+    tags=["Maintenance"],
+    summary="Change feed fan-out statistics"
+)
+async def feed_stats():
+    """Shared filter groups and how many change feed reads they served."""
+    return fanout.stats()
+
+@app.on_event("shutdown")
+async def close_store():
+    store.close()
+
 def custom_openapi():
     if app.openapi_schema:
         return app.openapi_schema
@@ -0,0 +1,268 @@
+import math
+from bisect import bisect_left, bisect_right
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .query import Comparison, get_path, split_field
+
+if TYPE_CHECKING:
+    from .store import Document
+
+
+class HashIndex:
+    """
+    Equality index over one field path of a collection.
+
+    Every version of every key is indexed (tombstones under None), so the
+    index can answer the same questions as a scan over version histories.
+    Values that can't be hashed are left out; they never equal a literal.
+    """
+    kind = "hash"
+
+    # Operators this index can answer on its own
+    OPERATORS = ('=', 'IN', 'IS NULL')
+
+    def __init__(self, field: str):
+        self.field = field
+        self.path = split_field(field)
+        # field value -> transaction ID -> document version
+        self._entries: Dict[Any, Dict[int, 'Document']] = {}
+        self.size = 0
+
+    @property
+    def distinct_values(self) -> int:
+        return len(self._entries)
+
+    def add(self, doc: 'Document') -> None:
+        value = get_path(doc.value, self.path)
+        try:
+            self._entries.setdefault(value, {})[doc.transaction_id] = doc
+        except TypeError:
+            return
+        self.size += 1
+
+    def remove(self, doc: 'Document') -> None:
+        value = get_path(doc.value, self.path)
+        try:
+            versions = self._entries.get(value)
+        except TypeError:
+            return
+        if versions is None or versions.pop(doc.transaction_id, None) is None:
+            return
+        self.size -= 1
+        if not versions:
+            del self._entries[value]
+
+    def supports(self, predicate: Comparison) -> bool:
+        """Whether lookup() can answer the predicate."""
+        if predicate.field != self.field or predicate.operator not in self.OPERATORS:
+            return False
+        if predicate.operator == 'IN':
+            return isinstance(predicate.target, frozenset)
+        try:
+            hash(predicate.target)
+        except TypeError:
+            return False
+        return True
+
+    def lookup(self, predicate: Comparison) -> Iterator['Document']:
+        """Yield the document versions matching a supported predicate."""
+        for value in self._lookup_values(predicate):
+            yield from self._entries.get(value, {}).values()
+
+    def count(self, predicate: Comparison) -> int:
+        """Number of versions matching a supported predicate, without visiting them."""
+        return sum(len(self._entries.get(value, ())) for value in self._lookup_values(predicate))
+
+    def _lookup_values(self, predicate: Comparison) -> Iterable[Any]:
+        if predicate.operator == 'IN':
+            return predicate.target
+        if predicate.operator == 'IS NULL':
+            return (None,)
+        return (predicate.target,)
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "field": self.field,
+            "kind": self.kind,
+            "entries": self.size,
+            "distinct_values": self.distinct_values,
+        }
+
+
+def sort_rank(value: Any) -> Optional[int]:
+    """
+    Rank of a value's type in a sorted index: NULL, then numbers (booleans
+    included, as Python compares them as numbers), then strings. Values
+    that can't be ordered against a scalar literal (objects, arrays, NaN)
+    have no rank.
+    """
+    if value is None:
+        return 0
+    if isinstance(value, (bool, int)):
+        return 1
+    if isinstance(value, float):
+        return None if math.isnan(value) else 1
+    if isinstance(value, str):
+        return 2
+    return None
+
+
+class SortedIndex:
+    """
+    Ordered index over one field path of a collection.
+
+    Entries are kept in a sorted array of (type rank, value, transaction
+    ID), so equality and range predicates cost a binary search plus the
+    matching entries. Values of different types never satisfy a range
+    predicate together: a range only covers the rank of its bounds, which
+    matches a scan where comparing, say, a string with a number is not a
+    match. Unrankable values are left out; they never match a scalar literal.
+    """
+    kind = "sorted"
+
+    # Operators this index can answer on its own
+    OPERATORS = ('=', 'IN', 'IS NULL', '>', '>=', '<', '<=', 'BETWEEN')
+
+    def __init__(self, field: str):
+        self.field = field
+        self.path = split_field(field)
+        self._entries: List[Tuple[int, Any, int]] = []
+        self._docs: Dict[int, 'Document'] = {}
+        # field value -> number of versions holding it
+        self._counts: Dict[Any, int] = {}
+
+    @property
+    def size(self) -> int:
+        return len(self._entries)
+
+    @property
+    def distinct_values(self) -> int:
+        return len(self._counts)
+
+    def add(self, doc: 'Document') -> None:
+        value = get_path(doc.value, self.path)
+        rank = sort_rank(value)
+        if rank is None:
+            return
+        entry = (rank, value, doc.transaction_id)
+        if not self._entries or entry > self._entries[-1]:
+            self._entries.append(entry)
+        else:
+            self._entries.insert(bisect_left(self._entries, entry), entry)
+        self._docs[doc.transaction_id] = doc
+        self._counts[value] = self._counts.get(value, 0) + 1
+
+    def remove(self, doc: 'Document') -> None:
+        if self._docs.pop(doc.transaction_id, None) is None:
+            return
+        value = get_path(doc.value, self.path)
+        entry = (sort_rank(value), value, doc.transaction_id)
+        i = bisect_left(self._entries, entry)
+        if i < len(self._entries) and self._entries[i] == entry:
+            del self._entries[i]
+        self._counts[value] -= 1
+        if not self._counts[value]:
+            del self._counts[value]
+
+    def supports(self, predicate: Comparison) -> bool:
+        """Whether lookup() can answer the predicate."""
+        if predicate.field != self.field or predicate.operator not in self.OPERATORS:
+            return False
+        if predicate.operator == 'IN':
+            return isinstance(predicate.target, frozenset)
+        if predicate.operator == 'BETWEEN':
+            low, high = predicate.target
+            return sort_rank(low) is not None and sort_rank(low) == sort_rank(high)
+        return predicate.operator == 'IS NULL' or sort_rank(predicate.target) is not None
+
+    def lookup(self, predicate: Comparison) -> Iterator['Document']:
+        """Yield the document versions matching a supported predicate, in value order."""
+        for start, stop in self._ranges(predicate):
+            for _, _, transaction_id in self._entries[start:stop]:
+                yield self._docs[transaction_id]
+
+    def count(self, predicate: Comparison) -> int:
+        """Number of versions matching a supported predicate, without visiting them."""
+        return sum(stop - start for start, stop in self._ranges(predicate))
+
+    def ordered(self, descending: bool = False, after: Optional['Document'] = None) -> Iterator['Document']:
+        """
+        Yield every indexed version in value order (ties by transaction ID),
+        or only those that come after the given version, so that a walk can
+        pick up where it left off after the index changed.
+        """
+        if after is None:
+            start = len(self._entries) - 1 if descending else 0
+        else:
+            value = get_path(after.value, self.path)
+            entry = (sort_rank(value), value, after.transaction_id)
+            start = bisect_left(self._entries, entry) - 1 if descending else bisect_right(self._entries, entry)
+        entries = self._entries
+        step = -1 if descending else 1
+        i = start
+        while 0 <= i < len(entries):
+            yield self._docs[entries[i][2]]
+            i += step
+
+    def _ranges(self, predicate: Comparison) -> List[Tuple[int, int]]:
+        """Slices of the entry array that match the predicate."""
+        operator = predicate.operator
+        if operator == 'IN':
+            return sorted(self._equal_range(value) for value in predicate.target)
+        if operator == 'IS NULL':
+            return [self._equal_range(None)]
+        if operator == '=':
+            return [self._equal_range(predicate.target)]
+        if operator == 'BETWEEN':
+            low, high = predicate.target
+            return [(self._lower(low, inclusive=True), self._upper(high, inclusive=True))]
+
+        target = predicate.target
+        rank = sort_rank(target)
+        if rank == 0:
+            return []  # NULL is not ordered against anything
+        rank_start = bisect_left(self._entries, (rank,))
+        rank_stop = bisect_left(self._entries, (rank + 1,))
+        if operator in ('>', '>='):
+            return [(self._lower(target, inclusive=operator == '>='), rank_stop)]
+        return [(rank_start, self._upper(target, inclusive=operator == '<='))]
+
+    def _equal_range(self, value: Any) -> Tuple[int, int]:
+        if sort_rank(value) is None:
+            return (0, 0)
+        return (self._lower(value, inclusive=True), self._upper(value, inclusive=True))
+
+    def _lower(self, value: Any, inclusive: bool) -> int:
+        rank = sort_rank(value)
+        if inclusive:
+            return bisect_left(self._entries, (rank, value, -math.inf))
+        return bisect_right(self._entries, (rank, value, math.inf))
+
+    def _upper(self, value: Any, inclusive: bool) -> int:
+        rank = sort_rank(value)
+        if inclusive:
+            return bisect_right(self._entries, (rank, value, math.inf))
+        return bisect_left(self._entries, (rank, value, -math.inf))
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "field": self.field,
+            "kind": self.kind,
+            "entries": self.size,
+            "distinct_values": self.distinct_values,
+        }
+
+
+Index = HashIndex | SortedIndex
+
+INDEX_KINDS = {
+    HashIndex.kind: HashIndex,
+    SortedIndex.kind: SortedIndex,
+}
+
+
+def create_index(field: str, kind: str = HashIndex.kind) -> Index:
+    """Create an empty index of the given kind."""
+    if kind not in INDEX_KINDS:
+        raise ValueError(f"Unknown index kind: {kind}")
+    return INDEX_KINDS[kind](field)
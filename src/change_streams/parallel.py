@@ -0,0 +1,237 @@
+import multiprocessing
+import threading
+import zlib
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from .changelog import ChangeLog
+from .planner import QueryPlan
+from .query import MatchAll, QueryParser
+
+if TYPE_CHECKING:
+    from .store import Document
+
+
+def shard_of(key: str, shards: int) -> int:
+    """The worker holding a key's versions."""
+    return zlib.crc32(key.encode('utf-8')) % shards
+
+
+def _serve(connection) -> None:
+    """
+    Worker process: keep a copy of this worker's shard of each collection
+    it has been sent, and scan it on request. Replies to a scan with the
+    (key, transaction ID) of every match and the number of rows checked.
+    """
+    parser = QueryParser()
+    collections: Dict[str, Dict[str, List['Document']]] = {}
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            return
+        op = message[0]
+        if op == 'reset':
+            collections.pop(message[1], None)
+        elif op == 'apply':
+            _, collection, docs = message
+            documents = collections.setdefault(collection, {})
+            for doc in docs:
+                documents.setdefault(doc.key, []).append(doc)
+        elif op == 'scan':
+            _, collection, where_clause, latest_only = message
+            try:
+                predicate = parser.compile(where_clause) if where_clause else MatchAll()
+                matches = []
+                scanned = 0
+                for versions in collections.get(collection, {}).values():
+                    candidates = versions[-1:] if latest_only else versions
+                    for doc in candidates:
+                        if latest_only and doc.value is None:
+                            continue
+                        scanned += 1
+                        if predicate.matches(doc):
+                            matches.append((doc.key, doc.transaction_id))
+                connection.send(('matches', matches, scanned))
+            except Exception as e:
+                connection.send(('error', repr(e)))
+        elif op == 'close':
+            return
+
+
+class PendingScan:
+    """
+    A scan prepared under the store lock: the changes each worker still
+    needs, and the transaction ID its copy will be current to. run() ships
+    them and waits for the workers without needing the lock.
+    """
+
+    def __init__(self, scanner: 'ParallelScanner', collection: str, where_clause: Optional[str], latest_only: bool,
+                 reset: bool, changes: List['Document'], transaction_id: int, removed_versions: int, total_rows: int):
+        self.scanner = scanner
+        self.collection = collection
+        self.where_clause = where_clause
+        self.latest_only = latest_only
+        self.reset = reset
+        self.changes = changes
+        self.transaction_id = transaction_id
+        self.removed_versions = removed_versions
+        self.total_rows = total_rows
+        self.matches: Optional[List[Tuple[str, int]]] = None
+        self.scanned = 0
+
+    def run(self) -> None:
+        """Bring the workers up to date and scan; leaves matches None on failure."""
+        self.scanner.run(self)
+
+
+class ParallelScanner:
+    """
+    Runs large full scans across persistent worker processes.
+
+    Each worker keeps a copy of one hash shard of every collection scanned
+    in parallel, brought up to date from the collection's change log before
+    each scan (and rebuilt after versions are removed from it). Workers send back
+    only the keys and transaction IDs of their matches, which the store
+    maps to its own documents. Hash shards stay balanced as keys are added,
+    where key ranges would need moving between workers.
+
+    Workers are spawned on first use rather than forked, as the store runs
+    background threads. With a single worker scans stay serial.
+    """
+
+    def __init__(self, workers: Optional[int] = None, min_rows: int = 200_000):
+        self.workers = workers if workers is not None else multiprocessing.cpu_count()
+        self.min_rows = min_rows
+        self.enabled = self.workers > 1
+        self._connections: List[Any] = []
+        self._processes: List[multiprocessing.Process] = []
+        # Transaction ID each collection's shards are current to, and the
+        # number of versions removed from the collection when they were built
+        self._synced: Dict[str, int] = {}
+        self._removed_versions: Dict[str, int] = {}
+        # Workers answer one scan at a time
+        self._lock = threading.Lock()
+
+    def prepare(
+        self,
+        collection: str,
+        changes: Optional[ChangeLog],
+        where_clause: Optional[str],
+        latest_only: bool,
+        total_rows: int,
+        transaction_id: int,
+        removed_versions: int
+    ) -> Optional[PendingScan]:
+        """
+        Collect what the workers need to scan a collection as of
+        transaction_id, or None if the scan should run serially.
+        removed_versions counts the versions ever removed from the
+        collection. Must be called with the store locked.
+        """
+        if not self.enabled or total_rows < self.min_rows:
+            return None
+        # Removed versions can't be replayed, so a collection's shards start over after GC and evictions in it
+        reset = removed_versions != self._removed_versions.get(collection) or collection not in self._synced
+        after = 0 if reset else self._synced[collection]
+        docs = [doc for _, doc in changes.after(after)] if changes is not None else []
+        return PendingScan(
+            self, collection, where_clause, latest_only, reset, docs, transaction_id, removed_versions, total_rows
+        )
+
+    def run(self, scan: PendingScan) -> None:
+        with self._lock:
+            if not self.enabled:
+                return
+            try:
+                self._start()
+                if scan.removed_versions != self._removed_versions.get(scan.collection):
+                    if not scan.reset:
+                        return  # Prepared against shards another scan has since rebuilt
+                    self._synced.pop(scan.collection, None)
+                    self._removed_versions[scan.collection] = scan.removed_versions
+                if scan.reset:
+                    for connection in self._connections:
+                        connection.send(('reset', scan.collection))
+                    after = 0
+                elif scan.collection in self._synced:
+                    after = self._synced[scan.collection]
+                else:
+                    return
+                # Another scan may have brought the shards further along already
+                shards: List[List['Document']] = [[] for _ in self._connections]
+                for doc in scan.changes:
+                    if after < doc.transaction_id <= scan.transaction_id:
+                        shards[shard_of(doc.key, len(shards))].append(doc)
+                for connection, docs in zip(self._connections, shards):
+                    if docs:
+                        connection.send(('apply', scan.collection, docs))
+                self._synced[scan.collection] = max(after, scan.transaction_id)
+
+                for connection in self._connections:
+                    connection.send(('scan', scan.collection, scan.where_clause, scan.latest_only))
+                matches = []
+                scanned = 0
+                for connection in self._connections:
+                    reply = connection.recv()
+                    if reply[0] != 'matches':
+                        raise RuntimeError(reply[1])
+                    matches.extend(reply[1])
+                    scanned += reply[2]
+            except (OSError, EOFError, RuntimeError) as e:
+                print(f"Parallel scan failed, scanning serially from now on: {e}")
+                self._stop()
+                self.enabled = False
+                return
+            scan.matches = matches
+            scan.scanned = scanned
+
+    def _start(self) -> None:
+        if self._processes:
+            return
+        context = multiprocessing.get_context('spawn')
+        for _ in range(self.workers):
+            parent, child = context.Pipe()
+            process = context.Process(target=_serve, args=(child,), name="scan-worker", daemon=True)
+            process.start()
+            child.close()
+            self._connections.append(parent)
+            self._processes.append(process)
+
+    def _stop(self) -> None:
+        for connection in self._connections:
+            try:
+                connection.send(('close',))
+            except OSError:
+                pass
+            connection.close()
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self._connections = []
+        self._processes = []
+        self._synced.clear()
+        self._removed_versions.clear()
+
+    def close(self) -> None:
+        """Stop the worker processes."""
+        with self._lock:
+            self._stop()
+
+
+class ParallelScan(QueryPlan):
+    """A full scan already run by a ParallelScanner; its candidates all match."""
+    kind = "parallel_scan"
+    exact = True
+
+    def __init__(self, matches: List['Document'], total_rows: int, workers: int, rows_examined: int):
+        self.matches = matches
+        self.estimated_rows = total_rows
+        self.workers = workers
+        self.rows_examined = rows_examined
+
+    def candidates(self) -> List['Document']:
+        return self.matches
+
+    def describe(self) -> Dict[str, Any]:
+        return {"type": self.kind, "workers": self.workers, "estimated_rows": self.estimated_rows}
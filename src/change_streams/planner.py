@@ -0,0 +1,250 @@
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from .index import Index, SortedIndex
+from .query import And, Comparison, Or, Predicate
+
+if TYPE_CHECKING:
+    from .store import Document
+
+
+# Relative cost of fetching one index entry versus evaluating the full
+# predicate against a document (which costs predicate.cost)
+INDEX_FETCH_COST = 0.2
+# Relative cost of pushing one match through the heap that orders results
+ORDER_ROW_COST = 0.5
+
+
+class QueryPlan:
+    """
+    An access path producing candidate document versions for a predicate.
+
+    Candidates are a superset of the matches; the query executor
+    re-checks them against the full predicate unless the plan is exact.
+    """
+    kind = "plan"
+    estimated_rows = 0
+    cost = 0.0
+    # Whether candidates come out in the requested order
+    ordered = False
+    # Whether every candidate is known to match, so needn't be re-checked
+    exact = False
+    # Rows the plan itself checked against the predicate, if it did (otherwise
+    # the executor counts the candidates it checks)
+    rows_examined: Optional[int] = None
+
+    def candidates(self) -> Iterable['Document']:
+        raise NotImplementedError
+
+    def describe(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+
+class FullScan(QueryPlan):
+    """Visit every row of the collection (all versions, or the latest-version view)."""
+    kind = "full_scan"
+
+    def __init__(self, rows: Callable[[], Iterable['Document']], total_rows: int, predicate: Predicate):
+        self.rows = rows
+        self.estimated_rows = total_rows
+        self.cost = total_rows * predicate.cost
+
+    def candidates(self) -> Iterable['Document']:
+        return self.rows()
+
+    def describe(self) -> Dict[str, Any]:
+        return {"type": self.kind, "estimated_rows": self.estimated_rows}
+
+
+class IndexLookup(QueryPlan):
+    """Fetch the versions one index holds for one comparison."""
+    kind = "index_lookup"
+
+    def __init__(self, index: Index, comparison: Comparison):
+        self.index = index
+        self.comparison = comparison
+        self.estimated_rows = index.count(comparison)
+        self.cost = self.estimated_rows * INDEX_FETCH_COST
+
+    def candidates(self) -> Iterable['Document']:
+        return self.index.lookup(self.comparison)
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "type": self.kind,
+            "index": self.index.field,
+            "index_kind": self.index.kind,
+            "operator": self.comparison.operator,
+            "estimated_rows": self.estimated_rows,
+        }
+
+
+class IndexIntersection(QueryPlan):
+    """Versions produced by every child plan (for AND)."""
+    kind = "index_intersection"
+
+    def __init__(self, plans: List[QueryPlan], total_rows: int):
+        self.plans = sorted(plans, key=lambda plan: plan.estimated_rows)
+        # Assume the conjuncts are independent
+        estimate = float(self.plans[0].estimated_rows)
+        for plan in self.plans[1:]:
+            estimate *= plan.estimated_rows / max(total_rows, 1)
+        self.estimated_rows = int(round(estimate))
+        self.cost = sum(plan.cost for plan in self.plans)
+
+    def candidates(self) -> Iterable['Document']:
+        matched = {doc.transaction_id: doc for doc in self.plans[0].candidates()}
+        for plan in self.plans[1:]:
+            if not matched:
+                break
+            keep = {doc.transaction_id for doc in plan.candidates()}
+            matched = {tx: doc for tx, doc in matched.items() if tx in keep}
+        return matched.values()
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "type": self.kind,
+            "estimated_rows": self.estimated_rows,
+            "inputs": [plan.describe() for plan in self.plans],
+        }
+
+
+class IndexUnion(QueryPlan):
+    """Versions produced by any child plan (for OR)."""
+    kind = "index_union"
+
+    def __init__(self, plans: List[QueryPlan], total_rows: int):
+        self.plans = plans
+        self.estimated_rows = min(total_rows, sum(plan.estimated_rows for plan in plans))
+        self.cost = sum(plan.cost for plan in plans)
+
+    def candidates(self) -> Iterable['Document']:
+        matched = {}
+        for plan in self.plans:
+            for doc in plan.candidates():
+                matched[doc.transaction_id] = doc
+        return matched.values()
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "type": self.kind,
+            "estimated_rows": self.estimated_rows,
+            "inputs": [plan.describe() for plan in self.plans],
+        }
+
+
+class IndexOrderScan(QueryPlan):
+    """
+    Walk a sorted index in value order until enough rows match, for
+    ORDER BY ... LIMIT. Values the index leaves out (objects, arrays, NaN)
+    sort last, so if the walk runs dry the fallback plan is used instead.
+    """
+    kind = "index_order_scan"
+    ordered = True
+
+    def __init__(self, index: SortedIndex, descending: bool, limit: int, predicate: Predicate, fallback: QueryPlan):
+        self.index = index
+        self.descending = descending
+        self.fallback = fallback
+        self.estimated_rows = min(index.size, int(limit / max(predicate.selectivity, 1e-3)))
+        self.cost = self.estimated_rows * INDEX_FETCH_COST
+
+    def candidates(self) -> Iterable['Document']:
+        return self.index.ordered(self.descending)
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "type": self.kind,
+            "index": self.index.field,
+            "descending": self.descending,
+            "estimated_rows": self.estimated_rows,
+        }
+
+
+class QueryPlanner:
+    """
+    Chooses between a full scan, a single index lookup, and index
+    intersections/unions for a predicate over one collection.
+
+    Index estimates are exact match counts taken from the indexes
+    themselves (hash bucket sizes, sorted index ranges); combinations
+    assume independent predicates. Plans are compared on the cost of
+    fetching candidates plus re-checking each against the predicate.
+    """
+
+    def __init__(self, indexes: Dict[str, Index]):
+        self.indexes = indexes
+
+    def plan(
+        self,
+        predicate: Predicate,
+        rows: Callable[[], Iterable['Document']],
+        total_rows: int,
+        order_by: Optional[Tuple[str, bool]] = None,
+        limit: Optional[int] = None
+    ) -> QueryPlan:
+        """
+        Plan a query over ``total_rows`` rows, which ``rows()`` yields for a
+        full scan. Index plans may produce rows outside that set (other
+        versions) for the executor to filter out.
+
+        ``order_by`` is a (field, descending) pair; with a limit, walking a
+        sorted index on that field is considered against ordering the
+        matches of the best unordered plan.
+        """
+        scan = FullScan(rows, total_rows, predicate)
+        best = scan
+        access = self._access_path(predicate, total_rows)
+        if access is not None and self._total_cost(access, predicate) < scan.cost:
+            best = access
+        if order_by is None or limit is None:
+            return best
+
+        field, descending = order_by
+        index = self.indexes.get(field)
+        if not isinstance(index, SortedIndex):
+            return best
+        walk = IndexOrderScan(index, descending, limit, predicate, best)
+        sort_cost = best.estimated_rows * predicate.selectivity * ORDER_ROW_COST
+        if self._total_cost(walk, predicate) < self._total_cost(best, predicate) + sort_cost:
+            return walk
+        return best
+
+    def _total_cost(self, plan: QueryPlan, predicate: Predicate) -> float:
+        if isinstance(plan, FullScan):
+            return plan.cost
+        return plan.cost + plan.estimated_rows * predicate.cost
+
+    def _access_path(self, predicate: Predicate, total_rows: int) -> Optional[QueryPlan]:
+        """The cheapest index-based plan yielding a superset of matches, if any."""
+        if isinstance(predicate, Comparison):
+            index = self.indexes.get(predicate.field)
+            if index is not None and index.supports(predicate):
+                return IndexLookup(index, predicate)
+            return None
+
+        if isinstance(predicate, And):
+            paths = [
+                path for path in
+                (self._access_path(child, total_rows) for child in predicate.children)
+                if path is not None
+            ]
+            if not paths:
+                return None
+            paths.sort(key=lambda path: path.estimated_rows)
+            best = paths[0]
+            # Intersect further inputs only while that lowers the total cost
+            for path in paths[1:]:
+                inputs = best.plans + [path] if isinstance(best, IndexIntersection) else [best, path]
+                candidate = IndexIntersection(inputs, total_rows)
+                if self._total_cost(candidate, predicate) < self._total_cost(best, predicate):
+                    best = candidate
+            return best
+
+        if isinstance(predicate, Or):
+            paths = [self._access_path(child, total_rows) for child in predicate.children]
+            if any(path is None for path in paths):
+                return None  # One disjunct needs a scan anyway
+            return IndexUnion(paths, total_rows)
+
+        # NOT can't be answered from an index
+        return None
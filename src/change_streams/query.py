@@ -0,0 +1,450 @@
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, List, Tuple
+
+
+def split_field(field: str) -> Tuple[str, ...]:
+    """Split a dotted field such as 'value.address.city' into its path within the value."""
+    return tuple(field.split('.')[1:])  # Skip 'value' prefix
+
+
+def get_path(value: Any, path: Tuple[str, ...]) -> Any:
+    """Follow a pre-split field path into a document value; missing fields are None."""
+    for part in path:
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def parse_fields(fields: str) -> List[Tuple[str, ...]]:
+    """
+    Parse a comma-separated projection such as 'value.name,value.address.city'
+    into paths within the value. 'value' on its own selects the whole value.
+    """
+    paths = []
+    for field in fields.split(','):
+        field = field.strip()
+        if not re.fullmatch(r"\w+(?:\.\w+)*", field):
+            raise ValueError(f"Invalid field path: {field}")
+        paths.append(split_field(field))
+    return paths
+
+
+def project(value: Any, paths: List[Tuple[str, ...]]) -> Any:
+    """
+    Copy only the given paths out of a document value, keeping their
+    nesting. Paths missing from the value are left out; tombstones (None)
+    stay None.
+    """
+    if value is None or () in paths:
+        return value
+    result: dict = {}
+    included: List[Tuple[str, ...]] = []
+    for path in sorted(set(paths), key=len):
+        # A shorter path already copied this whole subtree
+        if any(path[:len(prefix)] == prefix for prefix in included):
+            continue
+        source = value
+        for part in path:
+            if not isinstance(source, dict) or part not in source:
+                break
+            source = source[part]
+        else:
+            target = result
+            for part in path[:-1]:
+                target = target.setdefault(part, {})
+            target[path[-1]] = source
+            included.append(path)
+    return result
+
+
+class QueryParser:
+    """
+    Parser for the SQL-like where clause language.
+
+    Clauses are comparisons combined with AND, OR, NOT and parentheses:
+
+        value.age > 25 AND (value.status = 'active' OR value.vip = true)
+
+    NOT binds tighter than AND, which binds tighter than OR.
+    """
+    # Number of compiled where clauses kept by compile()
+    CACHE_SIZE = 256
+
+    # Basic SQL-like operators and their Python equivalents
+    OPERATORS = {
+        '=': lambda x, y: x == y,
+        '!=': lambda x, y: x != y,
+        '>': lambda x, y: x > y,
+        '>=': lambda x, y: x >= y,
+        '<': lambda x, y: x < y,
+        '<=': lambda x, y: x <= y,
+        'IN': lambda x, y: x in y,
+        'NOT IN': lambda x, y: x not in y,
+        'IS NULL': lambda x, _: x is None,
+        'IS NOT NULL': lambda x, _: x is not None,
+        'BETWEEN': lambda x, y: y[0] <= x <= y[1]
+    }
+
+    KEYWORDS = ('AND', 'OR', 'NOT', 'IN', 'IS', 'NULL', 'BETWEEN', 'TRUE', 'FALSE')
+
+    TOKEN_PATTERN = re.compile(r"""
+        \s*(?:
+            (?P<string>'(?:[^']|'')*'|"(?:[^"]|"")*")
+          | (?P<number>-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?(?![\w.]))
+          | (?P<word>\w+(?:\.\w+)*)
+          | (?P<operator>!=|<>|>=|<=|=|>|<)
+          | (?P<punct>[(),])
+        )""", re.VERBOSE)
+
+    def __init__(self, cache_size: int = CACHE_SIZE):
+        self.cache_size = cache_size
+        self._cache: OrderedDict[str, Predicate] = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def parse_value(self, value_str: str) -> Any:
+        """Parse an unquoted literal into the appropriate Python type."""
+        upper = value_str.upper()
+        if upper == 'NULL':
+            return None
+        if upper in ('TRUE', 'FALSE'):
+            return upper == 'TRUE'
+
+        # Handle numbers
+        try:
+            if '.' in value_str or 'e' in value_str.lower():
+                return float(value_str)
+            return int(value_str)
+        except ValueError:
+            # Bare words are strings
+            return value_str
+
+    def parse(self, query: str) -> 'Predicate':
+        """Parse a where clause into an expression tree."""
+        tokens = self._tokenize(query)
+        parser = _ExpressionParser(self, tokens, query)
+        expression = parser.parse_or()
+        if not parser.at_end():
+            raise ValueError(f"Invalid query syntax: {query}")
+        return expression.optimized()
+
+    def parse_query(self, query: str) -> tuple[str, str, Any]:
+        """Parse a single comparison into (field, operator, value) components."""
+        expression = self.parse(query)
+        if not isinstance(expression, Comparison):
+            raise ValueError(f"Not a single comparison: {query}")
+        target = expression.target
+        if isinstance(target, frozenset):
+            target = list(target)
+        return (expression.field, expression.operator, target)
+
+    def parse_order_by(self, order_by: str) -> Tuple[str, bool]:
+        """Parse an ordering such as 'value.total DESC' into (field, descending)."""
+        match = re.fullmatch(r"\s*(\w+(?:\.\w+)*)(?:\s+(ASC|DESC))?\s*", order_by, re.IGNORECASE)
+        if not match:
+            raise ValueError(f"Invalid order by: {order_by}")
+        return match.group(1), (match.group(2) or '').upper() == 'DESC'
+
+    def compile(self, query: str) -> 'Predicate':
+        """
+        Compile a where clause into a reusable predicate.
+        Compiled predicates are kept in an LRU cache keyed by clause text.
+        """
+        with self._cache_lock:
+            predicate = self._cache.get(query)
+            if predicate is not None:
+                self._cache.move_to_end(query)
+                return predicate
+
+        predicate = self.parse(query)
+
+        with self._cache_lock:
+            self._cache[query] = predicate
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return predicate
+
+    def _tokenize(self, query: str) -> List[Tuple[str, Any]]:
+        """Split a clause into (kind, value) tokens; literals are already converted."""
+        tokens = []
+        position = 0
+        query = query.rstrip()
+        while position < len(query):
+            match = self.TOKEN_PATTERN.match(query, position)
+            if not match or match.end() == position:
+                raise ValueError(f"Invalid query syntax: {query}")
+            position = match.end()
+            kind = match.lastgroup
+            text = match.group(kind)
+            if kind == 'string':
+                quote = text[0]
+                tokens.append(('literal', text[1:-1].replace(quote * 2, quote)))
+            elif kind == 'number':
+                tokens.append(('literal', self.parse_value(text)))
+            elif kind == 'word' and text.upper() in self.KEYWORDS:
+                tokens.append(('keyword', text.upper()))
+            else:
+                tokens.append((kind, text))
+        return tokens
+
+
+class _ExpressionParser:
+    """Recursive descent over the tokens of one where clause."""
+
+    def __init__(self, query_parser: QueryParser, tokens: List[Tuple[str, Any]], query: str):
+        self.query_parser = query_parser
+        self.tokens = tokens
+        self.query = query
+        self.position = 0
+
+    def at_end(self) -> bool:
+        return self.position >= len(self.tokens)
+
+    def parse_or(self) -> 'Predicate':
+        children = [self.parse_and()]
+        while self._accept('keyword', 'OR'):
+            children.append(self.parse_and())
+        return children[0] if len(children) == 1 else Or(children)
+
+    def parse_and(self) -> 'Predicate':
+        children = [self.parse_not()]
+        while self._accept('keyword', 'AND'):
+            children.append(self.parse_not())
+        return children[0] if len(children) == 1 else And(children)
+
+    def parse_not(self) -> 'Predicate':
+        if self._accept('keyword', 'NOT'):
+            return Not(self.parse_not())
+        if self._accept('punct', '('):
+            expression = self.parse_or()
+            self._expect('punct', ')')
+            return expression
+        return self.parse_comparison()
+
+    def parse_comparison(self) -> 'Predicate':
+        field = self._expect('word')
+
+        operator = self._accept('operator')
+        if operator is not None:
+            operator = '!=' if operator == '<>' else operator
+            return Comparison(field, operator, self._literal())
+
+        if self._accept('keyword', 'IS'):
+            negated = self._accept('keyword', 'NOT') is not None
+            self._expect('keyword', 'NULL')
+            return Comparison(field, 'IS NOT NULL' if negated else 'IS NULL', None)
+
+        negated = self._accept('keyword', 'NOT') is not None
+        if self._accept('keyword', 'IN'):
+            self._expect('punct', '(')
+            values = [self._literal()]
+            while self._accept('punct', ','):
+                values.append(self._literal())
+            self._expect('punct', ')')
+            return Comparison(field, 'NOT IN' if negated else 'IN', values)
+
+        if self._accept('keyword', 'BETWEEN'):
+            low = self._literal()
+            self._expect('keyword', 'AND')
+            high = self._literal()
+            comparison = Comparison(field, 'BETWEEN', [low, high])
+            return Not(comparison) if negated else comparison
+
+        raise self._error()
+
+    def _literal(self) -> Any:
+        kind, value = self._next()
+        if kind == 'literal':
+            return value
+        if kind == 'keyword' and value in ('NULL', 'TRUE', 'FALSE'):
+            return self.query_parser.parse_value(value)
+        if kind == 'word':
+            return value  # Unquoted strings, e.g. value.status = active
+        raise self._error()
+
+    def _next(self) -> Tuple[str, Any]:
+        if self.at_end():
+            raise self._error()
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def _accept(self, kind: str, value: Any = None) -> Any:
+        if self.at_end():
+            return None
+        token_kind, token_value = self.tokens[self.position]
+        if token_kind != kind or (value is not None and token_value != value):
+            return None
+        self.position += 1
+        return token_value
+
+    def _expect(self, kind: str, value: Any = None) -> Any:
+        token_value = self._accept(kind, value)
+        if token_value is None:
+            raise self._error()
+        return token_value
+
+    def _error(self) -> ValueError:
+        return ValueError(f"Invalid query syntax: {self.query}")
+
+
+class Predicate:
+    """
+    A compiled where clause expression.
+
+    Every node estimates its evaluation cost and selectivity (the fraction
+    of documents expected to match) so that AND and OR can evaluate their
+    children in the order most likely to short-circuit early.
+    """
+    cost = 1.0
+    selectivity = 0.5
+
+    def matches(self, doc: Any) -> bool:
+        raise NotImplementedError
+
+    def comparisons(self) -> List['Comparison']:
+        """Leaf comparisons in this expression."""
+        raise NotImplementedError
+
+    def optimized(self) -> 'Predicate':
+        """Return an equivalent expression with flattened, reordered children."""
+        return self
+
+
+class MatchAll(Predicate):
+    """The predicate of a query without a where clause."""
+    cost = 0.0
+    selectivity = 1.0
+
+    def matches(self, doc: Any) -> bool:
+        return True
+
+    def comparisons(self) -> List['Comparison']:
+        return []
+
+
+class Comparison(Predicate):
+    """
+    A single comparison compiled for repeated evaluation: the field path is
+    pre-split, the operator bound and the literal parsed once.
+    """
+    # Rough fraction of documents each operator is expected to match
+    SELECTIVITY = {
+        '=': 0.05,
+        'IS NULL': 0.1,
+        'IN': 0.05,  # Per listed value
+        'BETWEEN': 0.25,
+        '>': 0.33,
+        '>=': 0.33,
+        '<': 0.33,
+        '<=': 0.33,
+        '!=': 0.95,
+        'NOT IN': 0.9,
+        'IS NOT NULL': 0.9,
+    }
+
+    def __init__(self, field: str, operator: str, target: Any):
+        self.field = field
+        self.operator = operator
+        self.path = split_field(field)
+        self._operation = QueryParser.OPERATORS[operator]
+        if operator in ('IN', 'NOT IN'):
+            try:
+                target = frozenset(target)
+            except TypeError:
+                pass
+        self.target = target
+
+        self.cost = 1.0 + 0.25 * len(self.path)
+        self.selectivity = self.SELECTIVITY[operator]
+        if operator == 'IN':
+            self.selectivity = min(1.0, self.selectivity * len(target))
+
+    def field_value(self, value: Any) -> Any:
+        """Get the comparison's field from a document value."""
+        return get_path(value, self.path)
+
+    def matches(self, doc: Any) -> bool:
+        """Evaluate the comparison against a document; incomparable types don't match."""
+        try:
+            return bool(self._operation(self.field_value(doc.value), self.target))
+        except TypeError:
+            # Unhashable values are never members of a literal set
+            return self.operator == 'NOT IN'
+
+    def comparisons(self) -> List['Comparison']:
+        return [self]
+
+
+class And(Predicate):
+    def __init__(self, children: List[Predicate]):
+        self.children = children
+        self.cost = sum(child.cost for child in children)
+        self.selectivity = 1.0
+        for child in children:
+            self.selectivity *= child.selectivity
+
+    def matches(self, doc: Any) -> bool:
+        for child in self.children:
+            if not child.matches(doc):
+                return False
+        return True
+
+    def comparisons(self) -> List[Comparison]:
+        return [leaf for child in self.children for leaf in child.comparisons()]
+
+    def optimized(self) -> Predicate:
+        children = []
+        for child in (child.optimized() for child in self.children):
+            children.extend(child.children if isinstance(child, And) else [child])
+        # Cheap conjuncts that are likely to fail go first
+        children.sort(key=lambda child: child.cost / max(1.0 - child.selectivity, 1e-3))
+        return And(children)
+
+
+class Or(Predicate):
+    def __init__(self, children: List[Predicate]):
+        self.children = children
+        self.cost = sum(child.cost for child in children)
+        self.selectivity = 1.0
+        for child in children:
+            self.selectivity *= 1.0 - child.selectivity
+        self.selectivity = 1.0 - self.selectivity
+
+    def matches(self, doc: Any) -> bool:
+        for child in self.children:
+            if child.matches(doc):
+                return True
+        return False
+
+    def comparisons(self) -> List[Comparison]:
+        return [leaf for child in self.children for leaf in child.comparisons()]
+
+    def optimized(self) -> Predicate:
+        children = []
+        for child in (child.optimized() for child in self.children):
+            children.extend(child.children if isinstance(child, Or) else [child])
+        # Cheap disjuncts that are likely to succeed go first
+        children.sort(key=lambda child: child.cost / max(child.selectivity, 1e-3))
+        return Or(children)
+
+
+class Not(Predicate):
+    def __init__(self, child: Predicate):
+        self.child = child
+        self.cost = child.cost
+        self.selectivity = 1.0 - child.selectivity
+
+    def matches(self, doc: Any) -> bool:
+        return not self.child.matches(doc)
+
+    def comparisons(self) -> List[Comparison]:
+        return self.child.comparisons()
+
+    def optimized(self) -> Predicate:
+        child = self.child.optimized()
+        if isinstance(child, Not):
+            return child.child
+        return Not(child)
@@ -1,11 +1,26 @@
+import base64
+import binascii
+import heapq
 import json
 import time
 import os
-from typing import Any, Dict, List, Optional, Tuple
+import threading
+from bisect import bisect_left, bisect_right, insort
+from itertools import islice, takewhile
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 from dataclasses import dataclass
 from enum import Enum
 import re
 
+from .aggregate import Aggregate, aggregate
+from .changelog import ChangeLog
+from .columnar import HAS_NUMPY, ColumnStore
+from .index import HashIndex, Index, SortedIndex, create_index, sort_rank
+from .parallel import ParallelScan, ParallelScanner, PendingScan
+from .planner import FullScan, IndexOrderScan, QueryPlan, QueryPlanner
+from .query import MatchAll, Predicate, QueryParser, get_path, split_field
+from .wal import FsyncPolicy, GroupCommitWriter, WriteAheadLog, sync_directory
+
 class OperationType(str, Enum):
     INSERT = "insert"
     UPDATE = "update"
@@ -19,86 +34,127 @@ class Document:
     timestamp: float
     transaction_id: int
 
-class QueryParser:
-    # Basic SQL-like operators and their Python equivalents
-    OPERATORS = {
-        '=': lambda x, y: x == y,
-        '!=': lambda x, y: x != y,
-        '>': lambda x, y: x > y,
-        '>=': lambda x, y: x >= y,
-        '<': lambda x, y: x < y,
-        '<=': lambda x, y: x <= y,
-        'IN': lambda x, y: x in y,
-        'NOT IN': lambda x, y: x not in y,
-        'IS NULL': lambda x, _: x is None,
-        'IS NOT NULL': lambda x, _: x is not None,
-        'BETWEEN': lambda x, y: y[0] <= x <= y[1]
-    }
-
-    def parse_value(self, value_str: str) -> Any:
-        """Parse string value into appropriate Python type."""
-        # Handle NULL
-        if value_str.upper() == 'NULL':
-            return None
-        
-        # Handle lists (for IN operator)
-        if value_str.startswith('(') and value_str.endswith(')'):
-            values = [v.strip().strip("'\"") for v in value_str[1:-1].split(',')]
-            return values
-            
-        # Handle numbers
-        try:
-            if '.' in value_str:
-                return float(value_str)
-            return int(value_str)
-        except ValueError:
-            # Handle strings (remove quotes)
-            return value_str.strip("'\"")
-
-    def parse_query(self, query: str) -> tuple[str, str, Any]:
-        """Parse SQL-like query into components."""
-        # Basic pattern for SQL-like syntax
-        patterns = [
-            # BETWEEN pattern
-            r"(\w+(?:\.\w+)*)\s+(BETWEEN)\s+(\d+)\s+AND\s+(\d+)",
-            # IN/NOT IN pattern
-            r"(\w+(?:\.\w+)*)\s+((?:NOT\s+)?IN)\s+(\([^)]+\))",
-            # IS NULL/IS NOT NULL pattern
-            r"(\w+(?:\.\w+)*)\s+(IS(?:\s+NOT)?\s+NULL)",
-            # Basic comparison pattern
-            r"(\w+(?:\.\w+)*)\s*([=!<>]+)\s*([^=!<>]+)"
-        ]
-        
-        for pattern in patterns:
-            match = re.match(pattern, query.strip(), re.IGNORECASE)
-            if match:
-                groups = match.groups()
-                if len(groups) == 4 and groups[1].upper() == 'BETWEEN':
-                    return (groups[0], 'BETWEEN', [int(groups[2]), int(groups[3])])
-                field, operator, value = groups
-                return (field, operator.upper(), self.parse_value(value))
-                
-        raise ValueError(f"Invalid query syntax: {query}")
+@dataclass
+class Consumer:
+    name: str
+    collection: Optional[str]
+    where: Optional[str]
+    offset: int  # Last acknowledged transaction ID
+    updated_at: float
+
+def encode_cursor(key: str) -> str:
+    """Opaque pagination cursor resuming after the given key."""
+    return base64.urlsafe_b64encode(json.dumps([key]).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor: str) -> str:
+    """The key a cursor from encode_cursor resumes after."""
+    try:
+        key, = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (binascii.Error, UnicodeError, ValueError, TypeError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    if not isinstance(key, str):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return key
 
 class KeyValueStore:
-    def __init__(self, storage_path: str = "kvstore.json"):
+    # Snapshots keep collections under 'collections' since this format
+    SNAPSHOT_FORMAT = 2
+    # Rows copied out per lock hold by query scans that may stop early
+    CAPTURE_BATCH = 1000
+    # Top-level keys of older snapshots that hold store metadata rather than collections
+    METADATA_KEYS = (
+        'last_transaction_id', 'highest_removed_tombstone_id', 'removed_tombstone_ids',
+        'last_lsn', 'indexes', 'columns', 'consumers'
+    )
+
+    def __init__(
+        self,
+        storage_path: str = "kvstore.json",
+        log_path: Optional[str] = None,
+        fsync_policy: FsyncPolicy = FsyncPolicy.ALWAYS,
+        fsync_interval_ms: float = 100.0,
+        snapshot_every: int = 100_000,
+        snapshot_interval_s: Optional[float] = 300.0,
+        scan_workers: Optional[int] = None,
+        parallel_scan_min_rows: int = 200_000
+    ):
+        """
+        Args:
+            snapshot_every: Take a background snapshot once this many log
+                records have accumulated since the last one (0 disables).
+            snapshot_interval_s: Also take one at least this often if anything
+                changed (None or 0 disables).
+            scan_workers: Worker processes for full query scans (None for one
+                per CPU, 1 to always scan serially).
+            parallel_scan_min_rows: Scan serially below this many rows.
+        """
         self.storage_path = storage_path
+        self.log_path = log_path or f"{storage_path}.log"
         self.store: Dict[str, Dict[str, List[Document]]] = {}
         self.current_transaction_id = 0
+        # Rollback watermarks: the newest removed change overall and per collection
         self.highest_removed_tombstone_id = 0
+        self.removed_tombstone_ids: Dict[str, int] = {}
+        self.snapshot_every = snapshot_every
+        self.query_parser = QueryParser()
+        self._scanner = ParallelScanner(scan_workers, parallel_scan_min_rows)
+        # Changes ordered by transaction ID, globally and per collection
+        self._changes = ChangeLog()
+        self._collection_changes: Dict[str, ChangeLog] = {}
+        # Number of versions ever removed, so cached change feeds can notice GC and evictions
+        self.removed_versions = 0
+        # The same per collection, for the parallel scanner's copies of each collection
+        self._collection_removed_versions: Dict[str, int] = {}
+        # Called with the newest committed transaction ID whenever it advances
+        self._listeners: List[Callable[[int], None]] = []
+        # Materialized current state: collection -> key -> latest non-tombstone version
+        self._latest: Dict[str, Dict[str, Document]] = {}
+        # Keys of each collection in sorted order, for paging
+        self._sorted_keys: Dict[str, List[str]] = {}
+        # Secondary indexes: collection -> field path -> index
+        self._indexes: Dict[str, Dict[str, Index]] = {}
+        # Columnar copies of selected fields of the latest-version view
+        self._columns: Dict[str, ColumnStore] = {}
+        # Named consumers and their acknowledged offsets
+        self._consumers: Dict[str, Consumer] = {}
+        # A zero interval would have the snapshot thread spin rather than wait
+        self.snapshot_interval_s = snapshot_interval_s if snapshot_interval_s and snapshot_interval_s > 0 else None
+        self._lsn = 0
+        self._snapshot_lsn = 0
+        # Guards in-memory state against the background snapshot thread
+        self._lock = threading.RLock()
+        self._snapshot_lock = threading.Lock()
+        self._snapshot_due = threading.Event()
+        self._closed = threading.Event()
+        self._wal = WriteAheadLog(self.log_path)
+        self._writer = GroupCommitWriter(self._wal, fsync_policy, fsync_interval_ms, on_commit=self._notify)
         self._load_from_disk()
+        self._writer.start(self._lsn, self.current_transaction_id)
+        self._snapshotter = None
+        if snapshot_every or self.snapshot_interval_s:
+            self._snapshotter = threading.Thread(
+                target=self._snapshot_loop, name="snapshotter", daemon=True
+            )
+            self._snapshotter.start()
 
     def _load_from_disk(self) -> None:
-        """Load the store from disk if it exists."""
+        """
+        Load the latest snapshot from disk and replay the log on top of it.
+        Raises RuntimeError if the snapshot exists but can't be read.
+        """
+        snapshot_lsn = 0
         if os.path.exists(self.storage_path):
             try:
                 with open(self.storage_path, 'r') as f:
                     data = json.load(f)
-                    # Filter out the last_transaction_id from the document data
-                    doc_data = {
-                        k: v for k, v in data.items() 
-                        if k != 'last_transaction_id'
-                    }
+                    if data.get('format') == self.SNAPSHOT_FORMAT:
+                        doc_data = data['collections']
+                    else:
+                        # Older snapshots keep collections next to the store metadata
+                        doc_data = {
+                            k: v for k, v in data.items()
+                            if k not in self.METADATA_KEYS
+                        }
                     self.store = {
                         k: {
                             sub_k: [Document(**doc) for doc in v]
@@ -106,28 +162,403 @@ class KeyValueStore:
                         }
                         for k, sub_data in doc_data.items()
                     }
-                    # Load the last transaction ID separately
+                    # Load the metadata separately
                     self.current_transaction_id = data.get('last_transaction_id', 0)
+                    self.highest_removed_tombstone_id = data.get('highest_removed_tombstone_id', 0)
+                    self.removed_tombstone_ids = data.get('removed_tombstone_ids')
+                    if self.removed_tombstone_ids is None:
+                        # Older snapshots only have the global watermark
+                        self.removed_tombstone_ids = {
+                            collection: self.highest_removed_tombstone_id
+                            for collection in self.store
+                        } if self.highest_removed_tombstone_id else {}
+                    snapshot_lsn = data.get('last_lsn', 0)
+                    self._indexes = {
+                        collection: {
+                            field: create_index(field, kind)
+                            for field, kind in fields.items()
+                        }
+                        for collection, fields in data.get('indexes', {}).items()
+                    }
+                    self._columns = {
+                        collection: ColumnStore(fields)
+                        for collection, fields in data.get('columns', {}).items()
+                    }
+                    self._consumers = {
+                        name: Consumer(**consumer)
+                        for name, consumer in data.get('consumers', {}).items()
+                    }
             except Exception as e:
-                print(f"Error loading from disk: {e}")
-                self.store = {}
-                self.current_transaction_id = 0
+                # The log behind the snapshot is gone, so starting from the log alone would lose data
+                raise RuntimeError(f"Error loading snapshot {self.storage_path}: {e}") from e
+        self._rebuild_derived_state()
+
+        self._lsn = self._snapshot_lsn = snapshot_lsn
+        for record in self._wal.replay():
+            # Records already folded into the snapshot are skipped
+            if record['lsn'] <= snapshot_lsn:
+                continue
+            self._apply_record(record)
+            self._lsn = record['lsn']
 
-    def _save_to_disk(self) -> None:
-        """Persist the store to disk."""
+    def _rebuild_derived_state(self) -> None:
+        """Rebuild the change logs, latest-version view, columns and indexes from the store."""
+        changes = sorted(
+            (
+                (doc.transaction_id, collection, doc)
+                for collection, documents in self.store.items()
+                for versions in documents.values()
+                for doc in versions
+            ),
+            key=lambda change: change[0]
+        )
+        self._changes = ChangeLog()
+        self._collection_changes = {}
+        for _, collection, doc in changes:
+            self._changes.append(collection, doc)
+            self._collection_changes.setdefault(collection, ChangeLog()).append(collection, doc)
+        self._latest = {}
+        self._columns = {collection: ColumnStore(columns.fields) for collection, columns in self._columns.items()}
+        for collection, documents in self.store.items():
+            for key in documents:
+                self._refresh_latest(collection, key)
+        self._sorted_keys = {collection: sorted(documents) for collection, documents in self.store.items()}
+        for collection, indexes in self._indexes.items():
+            for index in indexes.values():
+                self._populate_index(collection, index)
+
+    def _capture_snapshot(self) -> Dict[str, Any]:
+        """
+        Take a point-in-time copy of the store for serialization.
+        Documents are never mutated once written, so copying the version
+        lists is enough to make the copy independent of later writes.
+        """
+        with self._lock:
+            data: Dict[str, Any] = {'format': self.SNAPSHOT_FORMAT}
+            # Nested, so that collections can't be confused with (or named after) the metadata
+            data['collections'] = {
+                k: {sub_k: list(v) for sub_k, v in sub_data.items()}
+                for k, sub_data in self.store.items()
+            }
+            data['last_transaction_id'] = self.current_transaction_id
+            data['highest_removed_tombstone_id'] = self.highest_removed_tombstone_id
+            data['removed_tombstone_ids'] = dict(self.removed_tombstone_ids)
+            data['last_lsn'] = self._lsn
+            data['indexes'] = {
+                collection: {field: index.kind for field, index in indexes.items()}
+                for collection, indexes in self._indexes.items()
+            }
+            data['columns'] = {
+                collection: list(columns.fields)
+                for collection, columns in self._columns.items()
+            }
+            # Consumers are replaced rather than mutated, so a shallow copy will do
+            data['consumers'] = dict(self._consumers)
+        return data
+
+    def _save_to_disk(self, data: Dict[str, Any]) -> bool:
+        """Write a snapshot captured by _capture_snapshot to disk."""
+        tmp_path = f"{self.storage_path}.tmp"
         try:
-            with open(self.storage_path, 'w') as f:
-                data = {
-                    k: {
-                        sub_k: [doc.__dict__ for doc in v]
-                        for sub_k, v in sub_data.items()
-                    }
-                    for k, sub_data in self.store.items()
-                }
-                data['last_transaction_id'] = self.current_transaction_id
-                json.dump(data, f)
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f, default=lambda doc: doc.__dict__)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.storage_path)
+            # The log segments behind the snapshot are deleted next, so the rename must survive a crash
+            sync_directory(self.storage_path)
+            return True
         except Exception as e:
             print(f"Error saving to disk: {e}")
+            return False
+
+    def checkpoint(self) -> bool:
+        """
+        Snapshot the store and compact the log behind it.
+
+        The active log file is sealed first, so every record in it is
+        covered by the snapshot taken afterwards and the sealed segment can
+        be deleted once the snapshot is on disk. Writers are only blocked
+        while the in-memory copy is taken, not while it is serialized.
+        Returns False (leaving the log intact) if the snapshot could not be written.
+        """
+        with self._snapshot_lock:
+            self._writer.seal()
+            data = self._capture_snapshot()
+            if not self._save_to_disk(data):
+                return False
+            self._snapshot_lsn = data['last_lsn']
+            self._wal.discard_segments(self._snapshot_lsn)
+            return True
+
+    def _snapshot_loop(self) -> None:
+        """Take snapshots in the background as the log grows or time passes."""
+        while not self._closed.is_set():
+            self._snapshot_due.wait(self.snapshot_interval_s)
+            self._snapshot_due.clear()
+            if self._closed.is_set():
+                return
+            if self._lsn > self._snapshot_lsn:
+                self.checkpoint()
+
+    def close(self) -> None:
+        """Stop background snapshots, commit any queued log records and close the log."""
+        self._closed.set()
+        self._snapshot_due.set()
+        if self._snapshotter is not None:
+            self._snapshotter.join()
+            self._snapshotter = None
+        self._writer.close()
+        self._scanner.close()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Block until every mutation made so far is committed to the log
+        according to the fsync policy. Returns False on timeout.
+        """
+        return self._writer.wait(self._lsn, timeout)
+
+    async def flush_async(self) -> None:
+        """Await commit of every mutation made so far without blocking the event loop."""
+        await self._writer.wait_async(self._lsn)
+
+    @property
+    def committed_transaction_id(self) -> int:
+        """
+        Newest transaction committed to the log under the fsync policy.
+        Change feeds stop here, so a change is never handed out before it
+        would survive a crash (and have its transaction ID reused).
+        """
+        return self._writer.committed_transaction_id
+
+    def log_stats(self) -> Dict[str, Any]:
+        """Group commit counters for the write path."""
+        return self._writer.stats()
+
+    def _log(self, op: str, **fields: Any) -> None:
+        """
+        Queue a mutation record for the log ahead of applying it.
+        The record is written by the group commit writer; use flush() or
+        flush_async() before acknowledging the mutation.
+        """
+        self._lsn += 1
+        # Document records commit the transaction they carry
+        self._writer.submit(self._lsn, {'lsn': self._lsn, 'op': op, **fields}, fields.get('transaction_id'))
+        if self.snapshot_every and self._lsn - self._snapshot_lsn >= self.snapshot_every:
+            self._snapshot_due.set()
+
+    def _log_document(self, collection: str, doc: Document) -> None:
+        self._log(
+            'delete' if doc.value is None else 'upsert',
+            collection=collection,
+            key=doc.key,
+            transaction_id=doc.transaction_id,
+            version=doc.version,
+            timestamp=doc.timestamp,
+            value=doc.value
+        )
+
+    def _apply_record(self, record: Dict[str, Any]) -> None:
+        """Apply a replayed log record to the in-memory store."""
+        op = record['op']
+        if op in ('upsert', 'delete'):
+            doc = Document(
+                key=record['key'],
+                value=record['value'],
+                version=record['version'],
+                timestamp=record['timestamp'],
+                transaction_id=record['transaction_id']
+            )
+            self._apply_document(record['collection'], doc)
+            self.current_transaction_id = max(self.current_transaction_id, doc.transaction_id)
+        elif op == 'evict':
+            self._apply_evict(record['collection'], record['key'])
+        elif op == 'gc':
+            self._apply_removals(record['removed'])
+        elif op == 'create_index':
+            self._apply_create_index(record['collection'], record['field'], record['kind'])
+        elif op == 'drop_index':
+            self._apply_drop_index(record['collection'], record['field'])
+        elif op == 'create_column':
+            self._apply_create_column(record['collection'], record['field'])
+        elif op == 'drop_column':
+            self._apply_drop_column(record['collection'], record['field'])
+        elif op == 'consumer':
+            consumer = Consumer(**{k: v for k, v in record.items() if k not in ('lsn', 'op')})
+            self._consumers[consumer.name] = consumer
+        elif op == 'delete_consumer':
+            self._consumers.pop(record['name'], None)
+
+    def _apply_document(self, collection: str, doc: Document) -> None:
+        """Append a new version (or tombstone) to a key's history."""
+        documents = self.store.setdefault(collection, {})
+        if doc.key not in documents:
+            insort(self._sorted_keys.setdefault(collection, []), doc.key)
+        documents.setdefault(doc.key, []).append(doc)
+        self._refresh_latest(collection, doc.key)
+        self._changes.append(collection, doc)
+        self._collection_changes.setdefault(collection, ChangeLog()).append(collection, doc)
+        for index in self._indexes.get(collection, {}).values():
+            index.add(doc)
+
+    def _refresh_latest(self, collection: str, key: str) -> None:
+        """Point the latest-version view at the key's newest live version, if any."""
+        versions = self.store.get(collection, {}).get(key)
+        columns = self._columns.get(collection)
+        if versions and versions[-1].value is not None:
+            self._latest.setdefault(collection, {})[key] = versions[-1]
+            if columns is not None:
+                columns.set_latest(key, versions[-1])
+            return
+        if columns is not None:
+            columns.set_latest(key, None)
+        latest = self._latest.get(collection)
+        if latest is not None:
+            latest.pop(key, None)
+            if not latest:
+                del self._latest[collection]
+
+    def _forget_document(self, collection: str, doc: Document) -> None:
+        """Drop a removed version from the change logs and indexes."""
+        self.removed_versions += 1
+        self._collection_removed_versions[collection] = self._collection_removed_versions.get(collection, 0) + 1
+        self._changes.remove(doc.transaction_id)
+        collection_changes = self._collection_changes.get(collection)
+        if collection_changes is not None:
+            collection_changes.remove(doc.transaction_id)
+            if not collection_changes:
+                del self._collection_changes[collection]
+        for index in self._indexes.get(collection, {}).values():
+            index.remove(doc)
+
+    def _populate_index(self, collection: str, index: Index) -> None:
+        for versions in self.store.get(collection, {}).values():
+            for doc in versions:
+                index.add(doc)
+
+    def _apply_create_index(self, collection: str, field: str, kind: str) -> None:
+        index = create_index(field, kind)
+        self._populate_index(collection, index)
+        self._indexes.setdefault(collection, {})[field] = index
+
+    def _apply_drop_index(self, collection: str, field: str) -> None:
+        indexes = self._indexes.get(collection, {})
+        indexes.pop(field, None)
+        if not indexes:
+            self._indexes.pop(collection, None)
+
+    def _apply_create_column(self, collection: str, field: str) -> None:
+        columns = self._columns.get(collection)
+        if columns is not None:
+            columns.add_column(field)
+            return
+        columns = self._columns[collection] = ColumnStore([field])
+        for key, doc in self._latest.get(collection, {}).items():
+            columns.set_latest(key, doc)
+
+    def _apply_drop_column(self, collection: str, field: str) -> None:
+        columns = self._columns.get(collection)
+        if columns is None or field not in columns.fields:
+            return
+        columns.drop_column(field)
+        if not columns.fields:
+            del self._columns[collection]
+
+    def _apply_evict(self, collection: str, key: str) -> None:
+        """Drop a key and all its history."""
+        # Get the last transaction ID before removal
+        last_tx_id = self.store[collection][key][-1].transaction_id
+        self._raise_rollback_watermark(collection, last_tx_id)
+        
+        # Remove the document completely
+        for doc in self.store[collection].pop(key):
+            self._forget_document(collection, doc)
+        self._refresh_latest(collection, key)
+        self._forget_key(collection, key)
+        
+        # Remove empty collections
+        if not self.store[collection]:
+            del self.store[collection]
+
+    def _raise_rollback_watermark(self, collection: str, transaction_id: int) -> None:
+        """Record that a change consumers may not have seen was removed."""
+        if transaction_id > self.removed_tombstone_ids.get(collection, 0):
+            self.removed_tombstone_ids[collection] = transaction_id
+        if transaction_id > self.highest_removed_tombstone_id:
+            self.highest_removed_tombstone_id = transaction_id
+
+    def rollback_watermark(self, collection: Optional[str] = None) -> int:
+        """
+        Consumers of a collection's changes (all changes if None) whose
+        position is older than this must reload, as changes they haven't
+        seen were removed.
+        """
+        if collection is None:
+            return self.highest_removed_tombstone_id
+        return self.removed_tombstone_ids.get(collection, 0)
+
+    def _apply_removals(self, removed: List[Tuple[str, str, List[int]]]) -> None:
+        """Drop the given (collection, key, transaction IDs) versions."""
+        for collection, key, transaction_ids in removed:
+            versions = self.store.get(collection, {}).get(key)
+            if versions is None:
+                continue
+            doomed = set(transaction_ids)
+            to_keep = []
+            for doc in versions:
+                if doc.transaction_id not in doomed:
+                    to_keep.append(doc)
+                    continue
+                self._forget_document(collection, doc)
+                if doc.value is None:  # This is a tombstone
+                    self._raise_rollback_watermark(collection, doc.transaction_id)
+            if to_keep:
+                self.store[collection][key] = to_keep
+            else:
+                del self.store[collection][key]
+                self._forget_key(collection, key)
+                if not self.store[collection]:
+                    del self.store[collection]
+            self._refresh_latest(collection, key)
+
+    def _forget_key(self, collection: str, key: str) -> None:
+        """Drop a key that no longer has any versions from the sorted key list."""
+        keys = self._sorted_keys.get(collection)
+        if keys is None:
+            return
+        i = bisect_left(keys, key)
+        if i < len(keys) and keys[i] == key:
+            del keys[i]
+        if not keys:
+            del self._sorted_keys[collection]
+
+    def _keys_after(self, collection: str, after_key: Optional[str]) -> Iterator[str]:
+        """A collection's keys in sorted order, starting after after_key."""
+        keys = self._sorted_keys.get(collection, [])
+        i = 0 if after_key is None else bisect_right(keys, after_key)
+        while i < len(keys):
+            yield keys[i]
+            i += 1
+
+    def add_listener(self, listener: Callable[[int], None]) -> None:
+        """
+        Register a callback invoked with the newest committed transaction ID
+        whenever it advances (from the log writer thread), and whenever
+        removals raise a rollback watermark.
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[int], None]) -> None:
+        self._listeners.remove(listener)
+
+    def _notify(self, transaction_id: int) -> None:
+        for listener in self._listeners:
+            listener(transaction_id)
+
+    def _notify_rollback(self, watermark: int) -> None:
+        """Wake listeners if removals raised a rollback watermark above the given one."""
+        if self.highest_removed_tombstone_id > watermark:
+            self._notify(self.committed_transaction_id)
 
     def _get_next_transaction_id(self) -> int:
         """Get the next transaction ID in a thread-safe way."""
@@ -136,21 +567,19 @@ class KeyValueStore:
 
     def upsert(self, collection: str, key: str, value: Any) -> Document:
         """Insert or update a document in a collection."""
-        if collection not in self.store:
-            self.store[collection] = {}
-        if key not in self.store[collection]:
-            self.store[collection][key] = []
-        
-        version = len(self.store[collection][key]) + 1
-        doc = Document(
-            key=key,
-            value=value,
-            version=version,
-            timestamp=time.time(),
-            transaction_id=self._get_next_transaction_id()
-        )
-        self.store[collection][key].append(doc)
-        self._save_to_disk()
+        with self._lock:
+            # Continue from the newest version, as GC shortens the history
+            versions = self.store.get(collection, {}).get(key)
+            version = versions[-1].version + 1 if versions else 1
+            doc = Document(
+                key=key,
+                value=value,
+                version=version,
+                timestamp=time.time(),
+                transaction_id=self._get_next_transaction_id()
+            )
+            self._log_document(collection, doc)
+            self._apply_document(collection, doc)
         return doc
 
     def _infer_operation(self, doc: Document) -> OperationType:
@@ -171,178 +600,756 @@ class KeyValueStore:
         transaction_id: int, 
         limit: int = 2,
         where: Optional[str] = None,
-        collection: Optional[str] = None
+        collection: Optional[str] = None,
+        compact: bool = False
     ) -> List[Tuple[Document, OperationType]]:
-        """Get changes, optionally filtered by collection."""
+        """
+        Get changes, optionally filtered by collection.
+        Reads the transaction-ordered change log from the first transaction
+        after transaction_id and stops as soon as limit changes are found,
+        or at the last committed transaction.
+
+        With compact, only the newest change to each (collection, key) is
+        returned. The window read is then the longest run of changes
+        touching at most limit keys, so the last change returned is still
+        the point to resume from.
+        """
+        changes_log = self._changes if collection is None else self._collection_changes.get(collection)
+        if changes_log is None:
+            return []
+
+        predicate = self.query_parser.compile(where) if where else None
+        committed = self.committed_transaction_id
+        entries = takewhile(lambda entry: entry[1].transaction_id <= committed, changes_log.after(transaction_id))
+
+        if compact:
+            return self._compacted_changes(entries, limit, predicate)
+
         changes = []
-        
-        collections = [collection] if collection else self.store.keys()
-        
-        for col in collections:
-            if col not in self.store:
+        for _, doc in entries:
+            if len(changes) >= limit:
+                break
+            if predicate is not None and not predicate.matches(doc):
                 continue
-            for versions in self.store[col].values():
-                for doc in versions:
-                    if doc.transaction_id > transaction_id:
-                        if where:
-                            field, operator, target = self.query_parser.parse_query(where)
-                            operation = self.query_parser.OPERATORS[operator]
-                            if not operation(self._get_field_value(doc, field), target):
-                                continue
-                        changes.append((doc, self._infer_operation(doc)))
-        
-        changes.sort(key=lambda x: x[0].transaction_id)
-        return changes[:limit]
+            changes.append((doc, self._infer_operation(doc)))
+        return changes
+
+    def _compacted_changes(
+        self,
+        entries: Iterable[Tuple[str, Document]],
+        limit: int,
+        predicate: Optional[Predicate]
+    ) -> List[Tuple[Document, OperationType]]:
+        newest: Dict[Tuple[str, str], Document] = {}
+        for change_collection, doc in entries:
+            if predicate is not None and not predicate.matches(doc):
+                continue
+            identity = (change_collection, doc.key)
+            if identity not in newest and len(newest) >= limit:
+                break
+            # Re-inserting keeps the dict ordered by each key's newest change
+            newest.pop(identity, None)
+            newest[identity] = doc
+        return [(doc, self._infer_operation(doc)) for doc in newest.values()]
 
     def delete(self, collection: str, key: str) -> bool:
         """Delete a document from a collection."""
-        if collection in self.store and key in self.store[collection]:
-            # Create tombstone
-            version = len(self.store[collection][key]) + 1
-            tombstone = Document(
-                key=key,
-                value=None,
-                version=version,
-                timestamp=time.time(),
-                transaction_id=self._get_next_transaction_id()
-            )
-            self.store[collection][key].append(tombstone)
-            self._save_to_disk()
-            return True
+        with self._lock:
+            if collection in self.store and key in self.store[collection]:
+                # Create tombstone
+                version = self.store[collection][key][-1].version + 1
+                tombstone = Document(
+                    key=key,
+                    value=None,
+                    version=version,
+                    timestamp=time.time(),
+                    transaction_id=self._get_next_transaction_id()
+                )
+                self._log_document(collection, tombstone)
+                self._apply_document(collection, tombstone)
+                return True
         return False
 
     def get(self, collection: str, key: str, version: Optional[int] = None) -> Optional[Document]:
         """Retrieve a document from a collection."""
+        if version is None:
+            return self._latest.get(collection, {}).get(key)
+
         if collection not in self.store or key not in self.store[collection]:
             return None
         
-        versions = self.store[collection][key]
-        if not versions:
-            return None
-            
-        if version is None:
-            latest = versions[-1]
-            return None if latest.value is None else latest
-            
-        for doc in versions:
+        for doc in self.store[collection][key]:
             if doc.version == version:
                 return None if doc.value is None else doc
         return None
 
-    def garbage_collect(self, max_versions: int = 1, max_age_seconds: Optional[float] = None) -> int:
+    def garbage_collect(
+        self,
+        max_versions: int = 1,
+        max_age_seconds: Optional[float] = None,
+        retain_for_consumers: bool = False,
+        max_retained_bytes: Optional[int] = None
+    ) -> int:
         """
         Remove old versions of documents.
         Keeps at most max_versions of each document.
         If max_age_seconds is specified, removes versions older than that.
+
+        With retain_for_consumers, versions that some named consumer reading
+        their collection hasn't acknowledged yet are kept, so removing them
+        (tombstones in particular) doesn't force that consumer to reload.
+        max_retained_bytes caps the size of the values kept this way; past
+        it the oldest are removed anyway.
+
         Returns the number of versions removed.
         """
-        removed_count = 0
         current_time = time.time()
+        candidates = []
 
-        for key in self.store:
-            versions = self.store[key]
-            
-            # Sort by version (should already be sorted, but just to be safe)
-            versions.sort(key=lambda x: x.version)
-            
-            removed_versions = []
-            # Keep only the newest max_versions
-            if len(versions) > max_versions:
-                removed_versions.extend(versions[:-max_versions])
-                self.store[key] = versions[-max_versions:]
-            
-            # Remove versions older than max_age_seconds
-            if max_age_seconds is not None:
-                to_keep = []
-                for doc in self.store[key]:
-                    if (current_time - doc.timestamp) <= max_age_seconds:
-                        to_keep.append(doc)
-                    else:
-                        removed_versions.append(doc)
-                self.store[key] = to_keep
+        with self._lock:
+            for collection, documents in self.store.items():
+                for key, versions in documents.items():
+                    # Versions are kept in commit order, so the newest are last
 
-            removed_count += len(removed_versions)
-            
-            # Update highest removed tombstone transaction ID
-            for doc in removed_versions:
-                if doc.value is None:  # This is a tombstone
-                    self.highest_removed_tombstone_id = max(
-                        getattr(self, 'highest_removed_tombstone_id', 0),
-                        doc.transaction_id
-                    )
-                
-        self._save_to_disk()
-        return removed_count
+                    # Keep only the newest max_versions
+                    if len(versions) > max_versions:
+                        candidates.extend((collection, doc) for doc in versions[:-max_versions])
+                        versions = versions[-max_versions:]
+
+                    # Remove versions older than max_age_seconds
+                    if max_age_seconds is not None:
+                        candidates.extend(
+                            (collection, doc) for doc in versions
+                            if (current_time - doc.timestamp) > max_age_seconds
+                        )
+
+            if retain_for_consumers:
+                candidates = self._release_unretained(candidates, max_retained_bytes)
+
+            removed_by_key: Dict[Tuple[str, str], List[int]] = {}
+            for collection, doc in candidates:
+                removed_by_key.setdefault((collection, doc.key), []).append(doc.transaction_id)
+            removed = [
+                (collection, key, transaction_ids)
+                for (collection, key), transaction_ids in removed_by_key.items()
+            ]
+
+            if removed:
+                watermark = self.highest_removed_tombstone_id
+                self._log('gc', removed=removed)
+                self._apply_removals(removed)
+                self._notify_rollback(watermark)
+        return sum(len(transaction_ids) for _, _, transaction_ids in removed)
+
+    def _release_unretained(
+        self,
+        candidates: List[Tuple[str, Document]],
+        max_retained_bytes: Optional[int]
+    ) -> List[Tuple[str, Document]]:
+        """
+        Filter GC candidates down to those no consumer still needs, plus
+        the oldest needed ones beyond max_retained_bytes.
+        """
+        watermarks: Dict[str, Optional[int]] = {}
+        released = []
+        retained = []
+        for collection, doc in candidates:
+            if collection not in watermarks:
+                watermarks[collection] = self.min_consumer_offset(collection)
+            watermark = watermarks[collection]
+            if watermark is not None and doc.transaction_id > watermark:
+                retained.append((collection, doc))
+            else:
+                released.append((collection, doc))
 
-    def list_documents(self, latest_only: bool = False) -> Dict[str, List[Document] | Document]:
+        if max_retained_bytes is not None:
+            retained.sort(key=lambda candidate: candidate[1].transaction_id)
+            sizes = [len(json.dumps(doc.value)) for _, doc in retained]
+            total = sum(sizes)
+            evicted = 0
+            while total > max_retained_bytes:
+                total -= sizes[evicted]
+                evicted += 1
+            released.extend(retained[:evicted])
+        return released
+
+    def list_documents(
+        self,
+        collection: str,
+        latest_only: bool = False,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None
+    ) -> Dict[str, List[Document] | Document]:
         """
-        List all documents in the store.
+        List all documents in a collection.
         
         Args:
-            latest_only: If True, returns only the latest version of each document.
-                        If False, returns all versions.
+            latest_only: If True, returns only the latest version of each live
+                        (not deleted) document. If False, returns all versions.
+            limit: Return at most this many keys, in key order.
+            cursor: Continue after the last key of a previous page (see
+                    encode_cursor). Paged results are in key order.
         
         Returns:
             If latest_only is True: Dict[str, Document] mapping keys to their latest versions
             If latest_only is False: Dict[str, List[Document]] mapping keys to all their versions
         """
+        source = self._latest.get(collection, {}) if latest_only else self.store.get(collection, {})
+        if limit is None and cursor is None:
+            return dict(source)
+
+        after_key = decode_cursor(cursor) if cursor is not None else None
+        results = {}
+        for key in self._keys_after(collection, after_key):
+            if limit is not None and len(results) >= limit:
+                break
+            documents = source.get(key)
+            if documents is not None:
+                results[key] = documents
+        return results
+
+    def snapshot_latest(self, collection: Optional[str] = None) -> Tuple[int, Dict[str, Dict[str, Document]]]:
+        """
+        The latest live version of every document (in one collection, or
+        all of them) as of a single transaction ID, returned with that ID.
+
+        Only the key -> document maps are copied while holding the lock;
+        documents are immutable, so the copy can be read at leisure while
+        writers carry on. That transaction may not be committed yet: call
+        flush() or flush_async() before handing the snapshot out.
+        """
+        with self._lock:
+            if collection is None:
+                latest = {name: dict(documents) for name, documents in self._latest.items()}
+            else:
+                latest = {collection: dict(self._latest.get(collection, {}))}
+            return self.current_transaction_id, latest
+
+    def query_documents(
+        self,
+        collection: str,
+        where_clause: Optional[str],
+        latest_only: bool = False,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+        order_by: Optional[str] = None
+    ) -> Dict[str, List[Document] | Document]:
+        """
+        Query documents in a collection using SQL-like syntax.
+
+        With latest_only, the where clause is evaluated against the current
+        (latest, non-deleted) version of each key only. limit and cursor
+        page through matching keys in key order, as in list_documents.
+
+        order_by (e.g. 'value.total DESC') returns matches sorted by a field
+        instead, with limit keeping only the first limit versions; NULLs
+        come first in ascending order and objects, arrays and NaN last.
+        """
+        results, _ = self._run_query(collection, where_clause, latest_only, limit, cursor, order_by)
+        return results
+
+    def explain_query(
+        self,
+        collection: str,
+        where_clause: Optional[str],
+        latest_only: bool = False,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+        order_by: Optional[str] = None
+    ) -> Tuple[Dict[str, List[Document] | Document], Dict[str, Any]]:
+        """
+        Run a query and report how it was executed: the chosen plan, the
+        estimated and actual number of versions examined, and the time spent.
+        """
+        return self._run_query(collection, where_clause, latest_only, limit, cursor, order_by)
+
+    def _run_query(
+        self,
+        collection: str,
+        where_clause: Optional[str],
+        latest_only: bool,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+        order_by: Optional[str] = None
+    ) -> Tuple[Dict[str, List[Document] | Document], Dict[str, Any]]:
+        started = time.perf_counter()
+        predicate = self.query_parser.compile(where_clause) if where_clause else MatchAll()
+        order = self.query_parser.parse_order_by(order_by) if order_by else None
+        if order is not None and cursor is not None:
+            raise ValueError("A cursor can't be combined with order_by")
+        paged = order is None and (limit is not None or cursor is not None)
+        after_key = decode_cursor(cursor) if cursor is not None else None
+
+        # The lock is only held to plan and to capture candidates; documents
+        # are immutable, so the predicate is evaluated without it
+        self._lock.acquire()
+        try:
+            plan = self._plan_query(collection, predicate, latest_only, paged, after_key, order, limit)
+            if isinstance(plan, FullScan) and not paged:
+                scan = self._scanner.prepare(
+                    collection, self._collection_changes.get(collection), where_clause, latest_only,
+                    plan.estimated_rows, self.current_transaction_id,
+                    self._collection_removed_versions.get(collection, 0)
+                )
+                if scan is not None:
+                    self._lock.release()
+                    try:
+                        scan.run()
+                    finally:
+                        self._lock.acquire()
+                    plan = self._finish_parallel_scan(collection, scan, predicate, latest_only)
+                    if plan is None:
+                        plan = self._plan_query(collection, predicate, latest_only, paged, after_key, order, limit)
+            if isinstance(plan, FullScan) and paged:
+                candidates = self._walk_keys(collection, latest_only, after_key)
+            elif isinstance(plan, IndexOrderScan):
+                candidates = self._walk_index(collection, plan.index, plan.descending, latest_only)
+            else:
+                candidates = self._capture(collection, plan, latest_only, after_key)
+        finally:
+            self._lock.release()
+        return self._execute_query(
+            collection, plan, candidates, predicate, latest_only, paged, after_key, order, limit, started
+        )
+
+    def _plan_query(
+        self,
+        collection: str,
+        predicate: Predicate,
+        latest_only: bool,
+        paged: bool,
+        after_key: Optional[str],
+        order: Optional[Tuple[str, bool]],
+        limit: Optional[int]
+    ) -> QueryPlan:
+        planner = QueryPlanner(self._indexes.get(collection, {}))
+
+        def rows() -> Iterable[Document]:
+            # Looked up on each call, as an ordered walk may fall back to a scan after releasing the lock
+            latest = self._latest.get(collection, {})
+            documents = self.store.get(collection, {})
+            if paged:
+                # Scans walk keys in order from the cursor and can stop at the limit
+                keys = self._keys_after(collection, after_key)
+                if latest_only:
+                    return (latest[key] for key in keys if key in latest)
+                return (doc for key in keys for doc in documents[key])
+            if latest_only:
+                return latest.values()
+            return (doc for versions in documents.values() for doc in versions)
+
         if latest_only:
-            return {
-                key: versions[-1] if versions else None
-                for key, versions in self.store.items()
-            }
+            total_rows = len(self._latest.get(collection, {}))
         else:
-            return self.store.copy()
-
-    def _get_field_value(self, doc: Document, field_path: str) -> Any:
-        """Get value from document using dot notation."""
-        value = doc.value
-        for part in field_path.split('.')[1:]:  # Skip 'value' prefix
-            if not isinstance(value, dict) or part not in value:
-                return None
-            value = value[part]
-        return value
+            collection_changes = self._collection_changes.get(collection)
+            total_rows = len(collection_changes) if collection_changes is not None else 0
+        plan = planner.plan(predicate, rows, total_rows, order, limit)
+        if isinstance(plan, FullScan) and latest_only and not paged:
+            # Rather than scanning every row, narrow them down with columns where possible
+            columns = self._columns.get(collection)
+            columnar = columns.scan(predicate) if columns is not None else None
+            if columnar is not None:
+                plan = columnar
+        return plan
 
-    def query_documents(self, where_clause: str, latest_only: bool = False) -> Dict[str, List[Document] | Document]:
+    def _capture(
+        self,
+        collection: str,
+        plan: QueryPlan,
+        latest_only: bool,
+        after_key: Optional[str]
+    ) -> List[Document]:
         """
-        Query documents using SQL-like syntax.
+        Copy out a plan's candidates that are current (with latest_only) and
+        after the cursor, for checking against the predicate once the lock
+        is released.
         """
-        field, operator, target = self.query_parser.parse_query(where_clause)
-        operation = self.query_parser.OPERATORS[operator]
-        
-        results = {}
-        for key, versions in self.store.items():
-            matching_docs = [
-                doc for doc in versions
-                if operation(self._get_field_value(doc, field), target)
+        with self._lock:
+            if isinstance(plan, FullScan):
+                return list(plan.candidates())  # Scans only visit such rows
+            latest = self._latest.get(collection, {})
+            return [
+                doc for doc in plan.candidates()
+                # Indexes cover every version; only current ones count here
+                if not (latest_only and latest.get(doc.key) is not doc)
+                and not (after_key is not None and doc.key <= after_key)
             ]
-            
-            if matching_docs:
+
+    def _walk_keys(self, collection: str, latest_only: bool, after_key: Optional[str]) -> Iterator[Document]:
+        """
+        A collection's versions (or latest versions) in key order after
+        after_key, copied out a batch of keys at a time so that paged scans
+        can stop early without holding the lock while they check each one.
+        """
+        while True:
+            with self._lock:
+                keys = list(islice(self._keys_after(collection, after_key), self.CAPTURE_BATCH))
                 if latest_only:
-                    results[key] = matching_docs[-1]
+                    latest = self._latest.get(collection, {})
+                    batch = [latest[key] for key in keys if key in latest]
                 else:
-                    results[key] = matching_docs
-        
-        return results
+                    documents = self.store.get(collection, {})
+                    batch = [doc for key in keys for doc in documents.get(key, ())]
+            yield from batch
+            if len(keys) < self.CAPTURE_BATCH:
+                return
+            after_key = keys[-1]
+
+    def _walk_index(
+        self,
+        collection: str,
+        index: SortedIndex,
+        descending: bool,
+        latest_only: bool
+    ) -> Iterator[Document]:
+        """
+        Versions in a sorted index's order, copied out a batch at a time so
+        that ordered walks can stop early without holding the lock while
+        they check each one.
+        """
+        after = None
+        while True:
+            with self._lock:
+                walked = list(islice(index.ordered(descending, after), self.CAPTURE_BATCH))
+                latest = self._latest.get(collection, {})
+                batch = [doc for doc in walked if not latest_only or latest.get(doc.key) is doc]
+            yield from batch
+            if len(walked) < self.CAPTURE_BATCH:
+                return
+            after = walked[-1]
+
+    def _finish_parallel_scan(
+        self,
+        collection: str,
+        scan: PendingScan,
+        predicate: Predicate,
+        latest_only: bool
+    ) -> Optional[ParallelScan]:
+        """
+        Map the workers' matches back to documents. Keys changed since the
+        workers' copy was taken are checked again here; None if the workers
+        failed or versions were removed from the collection meanwhile.
+        """
+        if scan.matches is None or scan.removed_versions != self._collection_removed_versions.get(collection, 0):
+            return None
+        documents = self.store.get(collection, {})
+        collection_changes = self._collection_changes.get(collection)
+        changed = set()
+        if collection_changes is not None:
+            changed = {doc.key for _, doc in collection_changes.after(scan.transaction_id)}
+
+        matched_ids: Dict[str, Set[int]] = {}
+        for key, transaction_id in scan.matches:
+            if key not in changed:
+                matched_ids.setdefault(key, set()).add(transaction_id)
+        matches = [
+            doc
+            for key, transaction_ids in matched_ids.items()
+            for doc in documents.get(key, ())
+            if doc.transaction_id in transaction_ids
+        ]
+        examined = scan.scanned
+        for key in changed:
+            versions = documents.get(key, [])
+            if latest_only:
+                versions = [doc for doc in versions[-1:] if doc.value is not None]
+            examined += len(versions)
+            matches.extend(doc for doc in versions if predicate.matches(doc))
+        return ParallelScan(matches, scan.total_rows, self._scanner.workers, examined)
+
+    def _execute_query(
+        self,
+        collection: str,
+        plan: QueryPlan,
+        candidates: Iterable[Document],
+        predicate: Predicate,
+        latest_only: bool,
+        paged: bool,
+        after_key: Optional[str],
+        order: Optional[Tuple[str, bool]],
+        limit: Optional[int],
+        started: float
+    ) -> Tuple[Dict[str, List[Document] | Document], Dict[str, Any]]:
+        """Check captured candidates against the predicate and assemble the results, without the lock."""
+        scan = isinstance(plan, FullScan)
+
+        examined = 0
+        matched = 0
+
+        def matching(candidates: Iterable[Document]) -> Iterator[Document]:
+            nonlocal examined, matched
+            for doc in candidates:
+                examined += 1
+                if plan.exact or predicate.matches(doc):
+                    matched += 1
+                    yield doc
+
+        def fallback() -> List[Document]:
+            return self._capture(collection, plan.fallback, latest_only, after_key)
+
+        if order is not None:
+            matches = self._ordered_matches(plan, candidates, fallback, matching, order, limit)
+        else:
+            matches = []
+            matched_keys = 0
+            for doc in matching(candidates):
+                if scan and paged and (not matches or matches[-1].key != doc.key):
+                    if limit is not None and matched_keys >= limit:
+                        break
+                    matched_keys += 1
+                matches.append(doc)
+            if not scan:
+                if paged:
+                    matches.sort(key=lambda doc: (doc.key, doc.transaction_id))
+                else:
+                    matches.sort(key=lambda doc: doc.transaction_id)
+
+        results = {}
+        for doc in matches:
+            if latest_only:
+                results[doc.key] = doc
+            else:
+                results.setdefault(doc.key, []).append(doc)
+        if paged and limit is not None and len(results) > limit:
+            results = dict(islice(results.items(), limit))
+
+        stats = {
+            "plan": plan.describe(),
+            "estimated_rows": plan.estimated_rows,
+            "rows_examined": examined if plan.rows_examined is None else plan.rows_examined,
+            "rows_matched": matched,
+            "elapsed_ms": (time.perf_counter() - started) * 1000,
+        }
+        return results, stats
+
+    def _ordered_matches(
+        self,
+        plan: QueryPlan,
+        candidates: Iterable[Document],
+        fallback: Callable[[], List[Document]],
+        matching: Callable[[Iterable[Document]], Iterator[Document]],
+        order: Tuple[str, bool],
+        limit: Optional[int]
+    ) -> List[Document]:
+        """
+        Matches sorted by a field: read off an ordered index walk, or kept
+        in a heap of at most limit entries.
+        """
+        field, descending = order
+        if plan.ordered:
+            matches = list(islice(matching(candidates), limit))
+            if len(matches) == limit:
+                return matches
+            candidates = fallback()  # Unindexable values sort last; find them the slow way
+
+        path = split_field(field)
+        unranked = -1 if descending else 3
+
+        def sort_key(doc: Document) -> Tuple[int, Any, int]:
+            value = get_path(doc.value, path)
+            rank = sort_rank(value)
+            if rank is None:
+                return (unranked, 0, doc.transaction_id)
+            return (rank, value, doc.transaction_id)
+
+        candidates = matching(candidates)
+        if limit is None:
+            return sorted(candidates, key=sort_key, reverse=descending)
+        if descending:
+            return heapq.nlargest(limit, candidates, key=sort_key)
+        return heapq.nsmallest(limit, candidates, key=sort_key)
+
+    def aggregate(
+        self,
+        collection: str,
+        aggregates: List[str],
+        group_by: Optional[str] = None,
+        where_clause: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Compute aggregates such as 'COUNT(*)' or 'SUM(value.total)' over the
+        latest version of each live document, optionally filtered and
+        grouped by a field, in a single pass. The where clause can use an
+        index like any query.
+        """
+        if not aggregates:
+            raise ValueError("At least one aggregate is required")
+        parsed = [Aggregate.parse(text) for text in aggregates]
+        if group_by is not None and not re.fullmatch(r"\w+(?:\.\w+)*", group_by):
+            raise ValueError(f"Invalid field path: {group_by}")
+        predicate = self.query_parser.compile(where_clause) if where_clause else MatchAll()
+
+        latest = self._latest.get(collection, {})
+        plan = QueryPlanner(self._indexes.get(collection, {})).plan(predicate, latest.values, len(latest))
+        columns = self._columns.get(collection)
+        if isinstance(plan, FullScan) and columns is not None:
+            results = columns.aggregate(parsed, group_by, predicate)
+            if results is not None:
+                return results
+        docs = (
+            doc for doc in plan.candidates()
+            # Indexes cover every version; only current ones count here
+            if latest.get(doc.key) is doc and predicate.matches(doc)
+        )
+        return aggregate(docs, parsed, group_by)
+
+    def create_index(self, collection: str, field: str, kind: str = HashIndex.kind) -> bool:
+        """
+        Create a secondary index on a field path (e.g. 'value.status').
+        Queries on the collection use it automatically. Returns False if the
+        field is already indexed.
+        """
+        if not re.fullmatch(r"\w+(?:\.\w+)*", field):
+            raise ValueError(f"Invalid field path: {field}")
+        create_index(field, kind)  # Validate the kind before logging it
+        with self._lock:
+            if field in self._indexes.get(collection, {}):
+                return False
+            self._log('create_index', collection=collection, field=field, kind=kind)
+            self._apply_create_index(collection, field, kind)
+        return True
+
+    def drop_index(self, collection: str, field: str) -> bool:
+        """Drop a secondary index. Returns False if there was none."""
+        with self._lock:
+            if field not in self._indexes.get(collection, {}):
+                return False
+            self._log('drop_index', collection=collection, field=field)
+            self._apply_drop_index(collection, field)
+        return True
+
+    def list_indexes(self, collection: str) -> List[Dict[str, Any]]:
+        """Describe the indexes defined on a collection."""
+        return [index.describe() for index in self._indexes.get(collection, {}).values()]
+
+    def create_column(self, collection: str, field: str) -> bool:
+        """
+        Keep a columnar copy of a field of the collection's current
+        documents, which latest-version queries and aggregates over it then
+        evaluate with NumPy. Returns False if the field already has one.
+        """
+        if not re.fullmatch(r"\w+(?:\.\w+)*", field):
+            raise ValueError(f"Invalid field path: {field}")
+        if not HAS_NUMPY:
+            raise ValueError("Columns need NumPy; install the 'columnar' extra")
+        with self._lock:
+            columns = self._columns.get(collection)
+            if columns is not None and field in columns.fields:
+                return False
+            self._log('create_column', collection=collection, field=field)
+            self._apply_create_column(collection, field)
+        return True
+
+    def drop_column(self, collection: str, field: str) -> bool:
+        """Drop a field's columnar copy. Returns False if there was none."""
+        with self._lock:
+            columns = self._columns.get(collection)
+            if columns is None or field not in columns.fields:
+                return False
+            self._log('drop_column', collection=collection, field=field)
+            self._apply_drop_column(collection, field)
+        return True
+
+    def list_columns(self, collection: str) -> List[Dict[str, Any]]:
+        """Describe the columns kept for a collection."""
+        columns = self._columns.get(collection)
+        return columns.describe() if columns is not None else []
+
+    def create_consumer(
+        self,
+        name: str,
+        collection: Optional[str] = None,
+        where: Optional[str] = None,
+        start: int = 0
+    ) -> bool:
+        """
+        Register a named consumer that reads changes after ``start``,
+        optionally filtered by collection and where clause. Its offset is
+        kept by the store and advanced with ack_consumer(). Returns False
+        if the name is taken.
+        """
+        if not re.fullmatch(r"\w[\w.-]*", name):
+            raise ValueError(f"Invalid consumer name: {name}")
+        if where:
+            self.query_parser.compile(where)  # Validate before logging it
+        with self._lock:
+            if name in self._consumers:
+                return False
+            self._put_consumer(Consumer(name, collection, where or None, start, time.time()))
+        return True
+
+    def ack_consumer(self, name: str, transaction_id: int) -> Optional[Consumer]:
+        """
+        Commit a consumer's offset: every change up to transaction_id has
+        been processed. Offsets never move backwards. Returns None if there
+        is no such consumer.
+        """
+        with self._lock:
+            consumer = self._consumers.get(name)
+            if consumer is None:
+                return None
+            if transaction_id > self.committed_transaction_id:
+                raise ValueError(f"Transaction {transaction_id} has not been committed yet")
+            if transaction_id > consumer.offset:
+                consumer = Consumer(
+                    consumer.name, consumer.collection, consumer.where, transaction_id, time.time()
+                )
+                self._put_consumer(consumer)
+            return consumer
+
+    def _put_consumer(self, consumer: Consumer) -> None:
+        self._log('consumer', **consumer.__dict__)
+        self._consumers[consumer.name] = consumer
+
+    def delete_consumer(self, name: str) -> bool:
+        """Forget a consumer and its offset. Returns False if there was none."""
+        with self._lock:
+            if name not in self._consumers:
+                return False
+            self._log('delete_consumer', name=name)
+            del self._consumers[name]
+        return True
+
+    def get_consumer(self, name: str) -> Optional[Consumer]:
+        return self._consumers.get(name)
+
+    def list_consumers(self) -> List[Consumer]:
+        return sorted(self._consumers.values(), key=lambda consumer: consumer.name)
+
+    def consumer_lag(self, consumer: Consumer) -> Dict[str, int]:
+        """
+        How far a consumer is behind: transactions committed since its
+        offset, and changes to its collection (before the where filter)
+        still to be read.
+        """
+        changes_log = self._changes if consumer.collection is None else self._collection_changes.get(consumer.collection)
+        return {
+            "lag_transactions": max(0, self.current_transaction_id - consumer.offset),
+            "pending_changes": changes_log.count_after(consumer.offset) if changes_log is not None else 0,
+        }
+
+    def min_consumer_offset(self, collection: Optional[str] = None) -> Optional[int]:
+        """
+        Lowest offset among consumers that read the given collection (all
+        consumers if None), i.e. the oldest change some consumer still
+        needs. None if there are no such consumers.
+        """
+        offsets = [
+            consumer.offset for consumer in self._consumers.values()
+            if collection is None or consumer.collection in (None, collection)
+        ]
+        return min(offsets, default=None)
 
     def evict(self, collection: str, key: str) -> bool:
         """
         Completely remove a document from the store.
         Unlike delete, this removes all history and doesn't create a tombstone.
         """
-        if collection in self.store and key in self.store[collection]:
-            # Get the last transaction ID before removal
-            last_tx_id = self.store[collection][key][-1].transaction_id
-            if last_tx_id > self.highest_removed_tombstone_id:
-                self.highest_removed_tombstone_id = last_tx_id
-            
-            # Remove the document completely
-            del self.store[collection][key]
-            
-            # Remove empty collections
-            if not self.store[collection]:
-                del self.store[collection]
-                
-            self._save_to_disk()
-            return True
-        return False
\ No newline at end of file
+        with self._lock:
+            if collection in self.store and key in self.store[collection]:
+                watermark = self.highest_removed_tombstone_id
+                self._log('evict', collection=collection, key=key)
+                self._apply_evict(collection, key)
+                self._notify_rollback(watermark)
+                return True
+        return False
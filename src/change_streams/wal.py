@@ -0,0 +1,391 @@
+import asyncio
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from enum import Enum
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+
+class FsyncPolicy(str, Enum):
+    ALWAYS = "always"      # fsync every batch before acknowledging it
+    INTERVAL = "interval"  # fsync at most every interval_ms
+    NONE = "none"          # leave flushing to the operating system
+
+
+def sync_directory(path: str) -> None:
+    """
+    Make renames, creations and deletions of entries in the directory
+    holding ``path`` durable. Not possible (or needed) on every platform.
+    """
+    try:
+        fd = os.open(os.path.dirname(path) or '.', os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class WriteAheadLog:
+    """
+    Append-only log of store mutations.
+
+    Each record is framed as a 4-byte payload length and a 4-byte CRC32
+    followed by the JSON payload, so a torn write at the tail of the file
+    can be detected and discarded on replay.
+
+    Records are appended to the active file at ``path``. Sealing moves the
+    active file aside as ``<path>.<last lsn>`` so that it can be deleted
+    once a snapshot covering it has been written.
+    """
+    HEADER = struct.Struct('>II')
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def open(self) -> None:
+        """Open the log for appending."""
+        if self._file is None:
+            created = not os.path.exists(self.path)
+            self._file = open(self.path, 'ab')
+            if created:
+                # Records synced to a new file are lost with it unless its entry is durable too
+                sync_directory(self.path)
+
+    def close(self) -> None:
+        """Close the log file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def append(self, record: Dict[str, Any]) -> None:
+        """Append a single framed record to the log."""
+        self.append_many([record])
+
+    def append_many(self, records: List[Dict[str, Any]]) -> None:
+        """Append a batch of framed records with a single write."""
+        frames = []
+        for record in records:
+            payload = json.dumps(record, separators=(',', ':')).encode('utf-8')
+            frames.append(self.HEADER.pack(len(payload), zlib.crc32(payload)))
+            frames.append(payload)
+        self._file.write(b''.join(frames))
+        self._file.flush()
+
+    def sync(self) -> None:
+        """Force everything written so far onto stable storage."""
+        os.fsync(self._file.fileno())
+
+    def segments(self) -> List[Tuple[int, str]]:
+        """Sealed segments as (last LSN, path), oldest first."""
+        directory = os.path.dirname(self.path) or '.'
+        prefix = os.path.basename(self.path) + '.'
+        segments = []
+        for name in os.listdir(directory):
+            suffix = name[len(prefix):]
+            if name.startswith(prefix) and suffix.isdigit():
+                segments.append((int(suffix), os.path.join(directory, name)))
+        return sorted(segments)
+
+    def seal(self, last_lsn: int) -> Optional[str]:
+        """
+        Move the active file aside as a sealed segment ending at ``last_lsn``
+        and start a fresh one. Does nothing if the active file is empty.
+        """
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return None
+        reopen = self._file is not None
+        self.close()
+        sealed_path = f"{self.path}.{last_lsn:020d}"
+        os.replace(self.path, sealed_path)
+        sync_directory(self.path)
+        if reopen:
+            self.open()
+        return sealed_path
+
+    def discard_segments(self, upto_lsn: int) -> int:
+        """Delete sealed segments whose records are all at or below ``upto_lsn``."""
+        discarded = 0
+        for last_lsn, path in self.segments():
+            if last_lsn <= upto_lsn:
+                os.remove(path)
+                discarded += 1
+        if discarded:
+            sync_directory(self.path)
+        return discarded
+
+    def replay(self) -> Iterator[Dict[str, Any]]:
+        """
+        Yield every intact record in the sealed segments and then the active
+        file, in append order.
+
+        Reading a file stops at the first truncated or corrupt frame, and the
+        file is cut back to the end of the last good record so that later
+        appends are not hidden behind garbage.
+        """
+        for _, path in self.segments():
+            yield from self._replay_file(path)
+        yield from self._replay_file(self.path)
+
+    def _replay_file(self, path: str) -> Iterator[Dict[str, Any]]:
+        if not os.path.exists(path):
+            return
+        good_offset = 0
+        with open(path, 'rb') as f:
+            while True:
+                record = self._read_record(f)
+                if record is None:
+                    break
+                good_offset = f.tell()
+                yield record
+            f.seek(0, os.SEEK_END)
+            torn = f.tell() != good_offset
+        if torn:
+            with open(path, 'r+b') as f:
+                f.truncate(good_offset)
+
+    def _read_record(self, f) -> Optional[Dict[str, Any]]:
+        header = f.read(self.HEADER.size)
+        if len(header) < self.HEADER.size:
+            return None
+        length, checksum = self.HEADER.unpack(header)
+        payload = f.read(length)
+        if len(payload) < length or zlib.crc32(payload) != checksum:
+            return None
+        try:
+            return json.loads(payload)
+        except ValueError:
+            return None
+
+
+class GroupCommitWriter:
+    """
+    Background writer that batches log records from concurrent mutations.
+
+    Mutations submit records without blocking; a single thread drains
+    everything queued since its last pass into one write (and, depending on
+    the fsync policy, one fsync). Callers that need to acknowledge a
+    mutation wait for its LSN to be committed: fsynced under the ``always``
+    policy, handed to the operating system otherwise.
+
+    Records may carry the transaction ID they create; ``on_commit`` is
+    called from the writer thread with the newest committed transaction ID
+    whenever it advances.
+    """
+
+    def __init__(
+        self,
+        wal: WriteAheadLog,
+        policy: FsyncPolicy = FsyncPolicy.ALWAYS,
+        interval_ms: float = 100.0,
+        on_commit: Optional[Callable[[int], None]] = None
+    ):
+        self.wal = wal
+        self.policy = FsyncPolicy(policy)
+        self.interval = interval_ms / 1000.0
+        self.on_commit = on_commit
+        self._cond = threading.Condition()
+        self._io_lock = threading.Lock()
+        self._pending: List[Tuple[int, Dict[str, Any], Optional[int]]] = []
+        self._async_waiters: List[Tuple[int, asyncio.AbstractEventLoop, asyncio.Future]] = []
+        self._submitted_lsn = 0
+        self._written_lsn = 0
+        self._durable_lsn = 0
+        # Newest transaction ID among the records written and fsynced so far
+        self._written_transaction_id = 0
+        self._durable_transaction_id = 0
+        self._last_sync = time.monotonic()
+        self._error: Optional[BaseException] = None
+        self._closing = False
+        self._thread: Optional[threading.Thread] = None
+        self.batches = 0
+        self.records = 0
+        self.fsyncs = 0
+
+    def start(self, lsn: int = 0, transaction_id: int = 0) -> None:
+        """
+        Start the writer thread; ``lsn`` and ``transaction_id`` are the last
+        LSN and transaction ID already on disk.
+        """
+        self._submitted_lsn = self._written_lsn = self._durable_lsn = lsn
+        self._written_transaction_id = self._durable_transaction_id = transaction_id
+        self.wal.open()
+        self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        """Drain and fsync any queued records, then stop the writer."""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._io_lock:
+            if self._written_lsn > self._durable_lsn and self._error is None:
+                self.wal.sync()
+                self._durable_lsn = self._written_lsn
+                self._durable_transaction_id = self._written_transaction_id
+            self.wal.close()
+
+    def submit(self, lsn: int, record: Dict[str, Any], transaction_id: Optional[int] = None) -> None:
+        """Queue a record (creating transaction_id, if given) for the next batch."""
+        with self._cond:
+            if self._error is not None:
+                raise OSError(f"Log writer failed: {self._error}") from self._error
+            self._pending.append((lsn, record, transaction_id))
+            self._submitted_lsn = lsn
+            self._cond.notify_all()
+
+    @property
+    def committed_lsn(self) -> int:
+        """Highest LSN that may be acknowledged under the current policy."""
+        if self.policy == FsyncPolicy.ALWAYS:
+            return self._durable_lsn
+        return self._written_lsn
+
+    @property
+    def committed_transaction_id(self) -> int:
+        """Newest transaction ID whose record is committed under the current policy."""
+        if self.policy == FsyncPolicy.ALWAYS:
+            return self._durable_transaction_id
+        return self._written_transaction_id
+
+    def wait(self, lsn: Optional[int] = None, timeout: Optional[float] = None) -> bool:
+        """
+        Block until ``lsn`` (default: everything submitted so far) is committed.
+        Returns False if the timeout elapsed first.
+        """
+        with self._cond:
+            if lsn is None:
+                lsn = self._submitted_lsn
+            committed = self._cond.wait_for(
+                lambda: self._error is not None or self.committed_lsn >= lsn,
+                timeout
+            )
+            if self._error is not None:
+                raise OSError(f"Log writer failed: {self._error}") from self._error
+            return committed
+
+    async def wait_async(self, lsn: Optional[int] = None) -> None:
+        """Await commit of ``lsn`` (default: everything submitted so far)."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._cond:
+            if lsn is None:
+                lsn = self._submitted_lsn
+            if self._error is not None:
+                raise OSError(f"Log writer failed: {self._error}") from self._error
+            if self.committed_lsn >= lsn:
+                return
+            self._async_waiters.append((lsn, loop, future))
+        await future
+
+    def seal(self) -> int:
+        """
+        Seal the active log file at the last written LSN and return that LSN.
+        Records still queued land in the fresh active file.
+        """
+        with self._io_lock:
+            with self._cond:
+                lsn = self._written_lsn
+            self.wal.seal(lsn)
+            return lsn
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters for comparing fsync policies."""
+        return {
+            "policy": self.policy.value,
+            "batches": self.batches,
+            "records": self.records,
+            "fsyncs": self.fsyncs,
+            "written_lsn": self._written_lsn,
+            "durable_lsn": self._durable_lsn,
+            "committed_transaction_id": self.committed_transaction_id,
+        }
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending and not self._closing:
+                    if self.policy == FsyncPolicy.INTERVAL and self._written_lsn > self._durable_lsn:
+                        remaining = self.interval - (time.monotonic() - self._last_sync)
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    else:
+                        self._cond.wait()
+                batch, self._pending = self._pending, []
+                if not batch and self._closing:
+                    return
+
+            try:
+                with self._io_lock:
+                    if batch:
+                        self.wal.append_many([record for _, record, _ in batch])
+                    synced = self._should_sync()
+                    if synced:
+                        self.wal.sync()
+                        self._last_sync = time.monotonic()
+            except BaseException as e:
+                with self._cond:
+                    self._error = e
+                    self._cond.notify_all()
+                    self._wake_async_waiters()
+                return
+
+            with self._cond:
+                committed_transaction_id = self.committed_transaction_id
+                if batch:
+                    self.batches += 1
+                    self.records += len(batch)
+                    self._written_lsn = batch[-1][0]
+                    self._written_transaction_id = max(
+                        [self._written_transaction_id]
+                        + [transaction_id for _, _, transaction_id in batch if transaction_id is not None]
+                    )
+                if synced:
+                    self.fsyncs += 1
+                    self._durable_lsn = self._written_lsn
+                    self._durable_transaction_id = self._written_transaction_id
+                self._cond.notify_all()
+                self._wake_async_waiters()
+                advanced = self.committed_transaction_id > committed_transaction_id
+            if advanced and self.on_commit is not None:
+                self.on_commit(self.committed_transaction_id)
+
+    def _should_sync(self) -> bool:
+        if self.policy == FsyncPolicy.ALWAYS:
+            return True
+        if self.policy == FsyncPolicy.INTERVAL:
+            return time.monotonic() - self._last_sync >= self.interval
+        return False
+
+    def _wake_async_waiters(self) -> None:
+        """Resolve awaiting futures whose LSN is now committed (caller holds _cond)."""
+        committed = self.committed_lsn
+        still_waiting = []
+        for lsn, loop, future in self._async_waiters:
+            if self._error is not None:
+                loop.call_soon_threadsafe(_resolve_future, future, self._error)
+            elif lsn <= committed:
+                loop.call_soon_threadsafe(_resolve_future, future, None)
+            else:
+                still_waiting.append((lsn, loop, future))
+        self._async_waiters = still_waiting
+
+
+def _resolve_future(future: asyncio.Future, error: Optional[BaseException]) -> None:
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(OSError(f"Log writer failed: {error}"))
+    else:
+        future.set_result(None)
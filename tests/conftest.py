@@ -0,0 +1,48 @@
+import importlib
+import os
+import tempfile
+
+import pytest
+
+# The HTTP module opens a store when it is imported; keep that one out of the working tree
+os.environ.setdefault("CHANGE_STREAMS_STORAGE_PATH", os.path.join(tempfile.mkdtemp(), "kvstore.json"))
+os.environ.setdefault("CHANGE_STREAMS_FSYNC_POLICY", "none")
+os.environ.setdefault("CHANGE_STREAMS_SNAPSHOT_EVERY", "0")
+os.environ.setdefault("CHANGE_STREAMS_SNAPSHOT_INTERVAL_S", "0")
+
+from change_streams.store import KeyValueStore  # noqa: E402
+
+
+@pytest.fixture
+def make_store(tmp_path):
+    """Open stores on one path in tmp_path; reopening one replays what the last left behind."""
+    stores = []
+
+    def make(**options):
+        options = {"fsync_policy": "none", "snapshot_every": 0, "snapshot_interval_s": None, **options}
+        store = KeyValueStore(str(tmp_path / "kvstore.json"), **options)
+        stores.append(store)
+        return store
+
+    yield make
+    for store in stores:
+        store.close()
+
+
+@pytest.fixture
+def store(make_store):
+    return make_store()
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """A test client for a fresh copy of the HTTP app with its own store."""
+    from fastapi.testclient import TestClient
+
+    import change_streams.http
+
+    monkeypatch.setenv("CHANGE_STREAMS_STORAGE_PATH", str(tmp_path / "api.json"))
+    http = importlib.reload(change_streams.http)
+    with TestClient(http.app) as client:
+        client.store = http.store
+        yield client
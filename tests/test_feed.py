@@ -0,0 +1,48 @@
+from change_streams.feed import ChangeFanOut
+
+
+def keys(changes):
+    return [doc.key for doc, _ in changes]
+
+
+def write_orders(store, count):
+    for i in range(count):
+        store.upsert("orders", f"o{i}", {"status": "shipped" if i % 2 else "placed"})
+    assert store.flush(timeout=5)
+
+
+def test_identical_filters_share_one_buffer(store):
+    fanout = ChangeFanOut(store)
+    where = "value.status = 'shipped'"
+    fanout.changes_after(0, limit=10, where=where, collection="orders")
+    write_orders(store, 10)
+
+    first = fanout.changes_after(0, limit=3, where=where, collection="orders")
+    second = fanout.changes_after(4, limit=10, where=where, collection="orders")
+    assert keys(first) == ["o1", "o3", "o5"]
+    assert keys(second) == ["o5", "o7", "o9"]
+    assert second == store.get_changes_after(4, limit=10, where=where, collection="orders")
+    assert fanout.stats() == {"groups": 1, "buffered_changes": 5, "shared_reads": 3, "direct_reads": 0}
+
+
+def test_readers_behind_the_buffer_read_the_store(store):
+    write_orders(store, 4)
+    fanout = ChangeFanOut(store, max_buffered=2)
+    # The group starts at the current transaction, so older history comes from the store
+    assert keys(fanout.changes_after(0, limit=10)) == ["o0", "o1", "o2", "o3"]
+    write_orders(store, 10)
+    # Only the newest two changes are buffered
+    assert keys(fanout.changes_after(12, limit=10)) == ["o8", "o9"]
+    assert keys(fanout.changes_after(10, limit=10)) == ["o6", "o7", "o8", "o9"]
+    assert fanout.stats()["shared_reads"] == 1
+    assert fanout.stats()["direct_reads"] == 2
+
+
+def test_buffers_start_over_after_removals(store):
+    fanout = ChangeFanOut(store)
+    fanout.changes_after(0)
+    write_orders(store, 4)
+    assert keys(fanout.changes_after(0, limit=10)) == ["o0", "o1", "o2", "o3"]
+    store.evict("orders", "o1")
+    assert keys(fanout.changes_after(0, limit=10)) == ["o0", "o2", "o3"]
+    assert fanout.stats()["buffered_changes"] == 0
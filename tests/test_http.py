@@ -0,0 +1,306 @@
+import json
+import sys
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def orders(client):
+    for i in range(10):
+        status = "shipped" if i % 2 else "placed"
+        response = client.put(f"/orders/documents/o{i}", json={"value": {"status": status, "total": i * 10}})
+        assert response.status_code == 200
+    return client
+
+
+def test_list_documents(orders):
+    response = orders.get("/orders/documents")
+    assert response.status_code == 200
+    documents = response.json()["documents"]
+    assert sorted(documents) == [f"o{i}" for i in range(10)]
+    assert documents["o3"][0]["value"] == {"status": "shipped", "total": 30}
+
+
+def test_list_latest_only(orders):
+    orders.put("/orders/documents/o1", json={"value": {"status": "delivered", "total": 10}})
+    orders.delete("/orders/documents/o2")
+    documents = orders.get("/orders/documents", params={"latest_only": True}).json()["documents"]
+    assert "o2" not in documents
+    assert documents["o1"]["value"]["status"] == "delivered"
+    assert documents["o1"]["version"] == 2
+
+
+def test_where_with_explain(orders):
+    response = orders.get("/orders/documents", params={"where": "value.total >= 50", "explain": True})
+    assert response.status_code == 200
+    body = response.json()
+    assert sorted(body["documents"]) == ["o5", "o6", "o7", "o8", "o9"]
+    assert body["explain"]["plan"]["type"] == "full_scan"
+    assert body["explain"]["rows_matched"] == 5
+
+
+def test_index_served_query(orders):
+    assert orders.put("/orders/indexes/value.status").status_code == 200
+    response = orders.get(
+        "/orders/documents",
+        params={"where": "value.status = 'shipped'", "latest_only": True, "explain": True}
+    )
+    body = response.json()
+    assert body["explain"]["plan"]["type"] == "index_lookup"
+    assert sorted(body["documents"]) == ["o1", "o3", "o5", "o7", "o9"]
+
+
+def test_pagination(orders):
+    seen = []
+    cursor = None
+    while True:
+        params = {"limit": 3, "latest_only": True}
+        if cursor is not None:
+            params["cursor"] = cursor
+        body = orders.get("/orders/documents", params=params).json()
+        seen.extend(body["documents"])
+        cursor = body["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == sorted(f"o{i}" for i in range(10))
+
+
+def test_order_by(orders):
+    response = orders.get(
+        "/orders/documents",
+        params={"order_by": "value.total DESC", "limit": 3, "latest_only": True}
+    )
+    body = response.json()
+    assert list(body["documents"]) == ["o9", "o8", "o7"]
+    assert body["next_cursor"] is None
+
+
+def test_fields_projection(orders):
+    body = orders.get("/orders/documents", params={"latest_only": True, "fields": "value.total"}).json()
+    assert body["documents"]["o4"]["value"] == {"total": 40}
+
+
+def test_invalid_where(orders):
+    assert orders.get("/orders/documents", params={"where": "value.total >>"}).status_code == 400
+
+
+def test_websocket_rejects_invalid_filters(client):
+    with client.websocket_connect("/changes/ws") as ws:
+        ws.send_json({"op": "subscribe", "id": "a", "where": 5})
+        assert ws.receive_json() == {"type": "error", "id": "a", "detail": "where must be a string"}
+        ws.send_json({"op": "subscribe", "id": "b", "collection": ["x"]})
+        assert ws.receive_json() == {"type": "error", "id": "b", "detail": "collection must be a string"}
+
+        # The session survives and still serves valid subscriptions
+        ws.send_json({"op": "subscribe", "id": "c", "collection": "orders", "credit": 1})
+        assert ws.receive_json() == {"type": "subscribed", "id": "c"}
+        client.put("/orders/documents/o1", json={"value": {"total": 1}})
+        message = ws.receive_json()
+        assert message["type"] == "change" and message["change"]["key"] == "o1"
+
+
+def test_consumer_names_of_collection_routes_are_reserved(client):
+    assert client.put("/consumers/indexes").status_code == 400
+    assert client.put("/consumers/indexer").status_code == 201
+    assert client.get("/consumers/indexer").json()["name"] == "indexer"
+
+
+def test_changes_feed(orders):
+    body = orders.get("/changes", params={"limit": 4}).json()
+    assert [change["key"] for change in body["changes"]] == ["o0", "o1", "o2", "o3"]
+    assert body["changes"][0]["operation"] == "insert"
+    assert body["resume_transaction_id"] == 4
+
+    orders.put("/orders/documents/o0", json={"value": {"status": "shipped", "total": 0}})
+    body = orders.get(
+        "/changes", params={"start": body["resume_transaction_id"], "limit": 100, "where": "value.status = 'shipped'"}
+    ).json()
+    assert [change["key"] for change in body["changes"]] == ["o5", "o7", "o9", "o0"]
+    assert body["changes"][-1]["operation"] == "update"
+    assert body["resume_transaction_id"] == body["max_transaction_id"] == 11
+
+
+def test_changes_feed_rollback(orders):
+    assert orders.post("/orders/documents/o1/evict").status_code == 200
+    assert orders.get("/changes", params={"start": 0}).json()["needs_rollback"] is True
+    assert orders.get("/changes", params={"start": 2, "collection": "orders"}).json()["needs_rollback"] is False
+
+
+def test_consumer_changes(orders):
+    assert orders.put("/consumers/shipping", params={"where": "value.status = 'shipped'"}).status_code == 201
+    body = orders.get("/consumers/shipping/changes", params={"limit": 2}).json()
+    assert [change["key"] for change in body["changes"]] == ["o1", "o3"]
+    acked = orders.post("/consumers/shipping/ack", params={"transaction_id": body["resume_transaction_id"]})
+    assert acked.status_code == 200
+    body = orders.get("/consumers/shipping/changes", params={"limit": 10}).json()
+    assert [change["key"] for change in body["changes"]] == ["o5", "o7", "o9"]
+
+
+def long_poll(client, **params):
+    """Start GET /changes?wait=true in a thread; returns a function joining it for the response."""
+    result = {}
+    thread = threading.Thread(
+        target=lambda: result.update(response=client.get("/changes", params={"wait": True, **params}))
+    )
+    thread.start()
+    time.sleep(0.2)  # Let the request park
+
+    def response():
+        thread.join(timeout=10)
+        return result["response"].json()
+
+    return response
+
+
+def test_long_poll_returns_when_a_change_commits(orders):
+    started = time.monotonic()
+    response = long_poll(orders, start=10, timeout_ms=10000)
+    orders.put("/orders/documents/o10", json={"value": {"status": "placed", "total": 100}})
+    body = response()
+    assert [change["key"] for change in body["changes"]] == ["o10"]
+    assert time.monotonic() - started < 5
+
+
+def test_long_poll_times_out(orders):
+    body = orders.get("/changes", params={"start": 10, "wait": True, "timeout_ms": 100}).json()
+    assert body["changes"] == []
+    assert body["resume_transaction_id"] == 10
+
+
+def test_long_poll_returns_when_a_rollback_is_needed(orders):
+    started = time.monotonic()
+    # Nothing after 5 matches, so the request waits; evicting o9 removes a change it hasn't seen
+    response = long_poll(orders, start=5, collection="orders", where="value.status = 'lost'", timeout_ms=10000)
+    assert orders.post("/orders/documents/o9/evict").status_code == 200
+    assert response()["needs_rollback"] is True
+    assert time.monotonic() - started < 5
+
+
+
+class Connected:
+    async def is_disconnected(self):
+        return False
+
+
+def stream_events(client, count, **params):
+    """
+    Start reading the first count events of GET /changes/stream straight
+    off the endpoint, on the app's event loop, as the test client waits for
+    whole responses. Returns a future of the parsed events.
+    """
+    http = sys.modules["change_streams.http"]
+    params = {"start": 0, "where": None, "collection": None, "last_event_id": None, **params}
+
+    async def read():
+        response = await http.stream_changes(Connected(), **params)
+        events = []
+        try:
+            async for message in response.body_iterator:
+                if message.startswith(":"):
+                    continue  # Heartbeat
+                events.append(dict(line.split(": ", 1) for line in message.strip().split("\n")))
+                if len(events) == count:
+                    return events
+        finally:
+            await response.body_iterator.aclose()
+
+    return client.portal.start_task_soon(read)
+
+
+def test_stream_replays_then_pushes_changes(orders):
+    events = stream_events(orders, 6, where="value.status = 'shipped'")
+    time.sleep(0.2)  # Let the stream catch up and wait
+    orders.put("/orders/documents/o0", json={"value": {"status": "shipped", "total": 0}})
+    events = events.result(timeout=10)
+    assert [event["event"] for event in events] == ["change"] * 6
+    assert [json.loads(event["data"])["key"] for event in events] == ["o1", "o3", "o5", "o7", "o9", "o0"]
+    assert [int(event["id"]) for event in events] == [2, 4, 6, 8, 10, 11]
+
+
+def test_stream_resumes_after_last_event_id(orders):
+    events = stream_events(orders, 2, last_event_id=7).result(timeout=10)
+    assert [int(event["id"]) for event in events] == [8, 9]
+
+
+def test_stream_ends_with_a_rollback_event(orders):
+    assert orders.post("/orders/documents/o1/evict").status_code == 200
+    response = orders.get("/changes/stream", params={"start": 0})
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert response.text.startswith("event: rollback\n")
+    assert json.loads(response.text.split("data: ", 1)[1])["needs_rollback"] is True
+
+
+def test_websocket_sends_changes_as_credit_allows(orders):
+    with orders.websocket_connect("/changes/ws") as ws:
+        ws.send_json({"op": "subscribe", "id": "all", "collection": "orders", "credit": 2})
+        assert ws.receive_json() == {"type": "subscribed", "id": "all"}
+        assert [ws.receive_json()["change"]["key"] for _ in range(2)] == ["o0", "o1"]
+
+        # Out of credit, so nothing more arrives for "all" until it is granted
+        ws.send_json({"op": "subscribe", "id": "shipped", "where": "value.status = 'shipped'", "start": 8, "credit": 5})
+        assert ws.receive_json() == {"type": "subscribed", "id": "shipped"}
+        message = ws.receive_json()
+        assert (message["id"], message["change"]["key"]) == ("shipped", "o9")
+        ws.send_json({"op": "credit", "id": "all", "credit": 1})
+        message = ws.receive_json()
+        assert (message["id"], message["change"]["key"]) == ("all", "o2")
+
+        ws.send_json({"op": "unsubscribe", "id": "all"})
+        assert ws.receive_json() == {"type": "unsubscribed", "id": "all"}
+        ws.send_json({"op": "credit", "id": "all", "credit": 1})
+        assert ws.receive_json() == {"type": "error", "id": "all", "detail": "Unknown subscription"}
+
+
+def test_compacted_changes(orders):
+    orders.put("/orders/documents/o1", json={"value": {"status": "delivered", "total": 10}})
+    orders.put("/orders/documents/o1", json={"value": {"status": "returned", "total": 10}})
+    orders.delete("/orders/documents/o2")
+
+    body = orders.get("/changes", params={"start": 10, "limit": 10, "compact": True}).json()
+    assert [(change["key"], change["transaction_id"]) for change in body["changes"]] == [("o1", 12), ("o2", 13)]
+    assert body["changes"][1]["operation"] == "delete"
+    assert body["resume_transaction_id"] == 13
+
+    # A window touching one key stops before the next key's change; resume from its last change
+    body = orders.get("/changes", params={"start": 10, "limit": 1, "compact": True}).json()
+    assert [change["value"]["status"] for change in body["changes"]] == ["returned"]
+    assert body["resume_transaction_id"] == 12
+    body = orders.get("/changes", params={"start": 12, "limit": 1, "compact": True}).json()
+    assert [change["key"] for change in body["changes"]] == ["o2"]
+
+
+def read_snapshot(client, **params):
+    response = client.get("/snapshot", params=params)
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    return lines[:-1], lines[-1]["resume_transaction_id"]
+
+
+def test_snapshot_then_changes(orders):
+    orders.delete("/orders/documents/o2")
+    orders.put("/users/documents/u1", json={"value": {"name": "Ann"}})
+
+    documents, resume = read_snapshot(orders)
+    assert resume == 12
+    assert sorted((doc["collection"], doc["key"]) for doc in documents) == (
+        [("orders", f"o{i}") for i in range(10) if i != 2] + [("users", "u1")]
+    )
+    documents, resume = read_snapshot(orders, collection="users")
+    assert [doc["value"] for doc in documents] == [{"name": "Ann"}]
+
+    orders.put("/orders/documents/o3", json={"value": {"status": "delivered", "total": 30}})
+    body = orders.get("/changes", params={"start": resume, "limit": 10}).json()
+    assert [change["key"] for change in body["changes"]] == ["o3"]
+
+
+def test_snapshot_is_unaffected_by_later_writes(orders):
+    store = orders.store
+    transaction_id, latest = store.snapshot_latest("orders")
+    store.upsert("orders", "o0", {"status": "delivered"})
+    store.delete("orders", "o1")
+    store.upsert("orders", "o10", {"status": "placed"})
+    assert transaction_id == 10
+    assert sorted(latest["orders"]) == [f"o{i}" for i in range(10)]
+    assert latest["orders"]["o0"].value == {"status": "placed", "total": 0}
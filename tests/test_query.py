@@ -0,0 +1,207 @@
+import random
+import threading
+
+import pytest
+
+from change_streams.store import KeyValueStore, encode_cursor
+
+WHERE_CLAUSES = [
+    "value.status = 'active'",
+    "value.age > 40",
+    "value.age BETWEEN 20 AND 30 AND value.status != 'deleted'",
+    "value.status IN ('active', 'pending') OR value.age <= 18",
+    "NOT (value.age >= 50) AND value.city IS NOT NULL",
+    "value.score < 0.5",
+]
+
+
+def populate(*stores):
+    rng = random.Random(42)
+    for _ in range(600):
+        key = f"u{rng.randrange(200)}"
+        if rng.random() < 0.1:
+            for store in stores:
+                store.delete("users", key)
+            continue
+        value = {
+            "status": rng.choice(["active", "pending", "deleted", None]),
+            "age": rng.choice([rng.randint(10, 70), None, "unknown"]),
+            "score": rng.random(),
+        }
+        if rng.random() < 0.8:
+            value["city"] = rng.choice(["Paris", "Tokyo"])
+        for store in stores:
+            store.upsert("users", key, value)
+
+
+def transaction_ids(results):
+    return {
+        key: [doc.transaction_id for doc in (docs if isinstance(docs, list) else [docs])]
+        for key, docs in results.items()
+    }
+
+
+@pytest.fixture
+def reference(tmp_path):
+    store = KeyValueStore(str(tmp_path / "reference.json"), fsync_policy="none", snapshot_every=0,
+                          snapshot_interval_s=None, scan_workers=1)
+    yield store
+    store.close()
+
+
+def assert_same_results(store, reference, plan_type, latest_only_values=(True, False)):
+    """Compare every where clause against the reference; returns whether plan_type was used."""
+    used = False
+    for where in WHERE_CLAUSES:
+        for latest_only in latest_only_values:
+            results, stats = store.explain_query("users", where, latest_only=latest_only)
+            expected = reference.query_documents("users", where, latest_only=latest_only)
+            assert transaction_ids(results) == transaction_ids(expected), where
+            if stats["plan"]["type"] == plan_type:
+                used = True
+    return used
+
+
+def test_index_plans_match_full_scan(make_store, reference):
+    store = make_store(scan_workers=1)
+    store.create_index("users", "value.status")
+    store.create_index("users", "value.age", kind="sorted")
+    populate(store, reference)
+    assert assert_same_results(store, reference, "index_lookup")
+
+    for order_by in ("value.age", "value.age DESC"):
+        results = store.query_documents("users", "value.status = 'active'", True, limit=5, order_by=order_by)
+        expected = reference.query_documents("users", "value.status = 'active'", True, limit=5, order_by=order_by)
+        assert list(transaction_ids(results).items()) == list(transaction_ids(expected).items())
+
+
+def test_aggregates_over_latest_versions(store):
+    for key, value in [
+        ("o1", {"status": "placed", "total": 10}),
+        ("o2", {"status": "shipped", "total": 25.5}),
+        ("o3", {"status": "shipped", "total": "n/a"}),
+        ("o4", {"status": "shipped"}),
+        ("o5", {"status": "placed", "total": 30}),
+        ("o6", {"total": 5}),
+        ("o7", {"status": "placed", "total": 7}),
+        ("o7", {"status": "placed", "total": 8}),
+    ]:
+        store.upsert("orders", key, value)
+    store.delete("orders", "o5")
+
+    select = ["COUNT(*)", "COUNT(value.total)", "SUM(value.total)", "MIN(value.total)", "MAX(value.total)",
+              "avg(value.total)"]
+    assert store.aggregate("orders", select, "value.status") == [
+        {"group": None, "values": {"count(*)": 1, "count(value.total)": 1, "sum(value.total)": 5,
+                                   "min(value.total)": 5, "max(value.total)": 5, "avg(value.total)": 5.0}},
+        {"group": "placed", "values": {"count(*)": 2, "count(value.total)": 2, "sum(value.total)": 18,
+                                       "min(value.total)": 8, "max(value.total)": 10, "avg(value.total)": 9.0}},
+        {"group": "shipped", "values": {"count(*)": 3, "count(value.total)": 2, "sum(value.total)": 25.5,
+                                        "min(value.total)": 25.5, "max(value.total)": "n/a",
+                                        "avg(value.total)": 25.5}},
+    ]
+
+    # Index-served where clauses only count current versions
+    store.create_index("orders", "value.total", kind="sorted")
+    assert store.aggregate("orders", ["COUNT(*)"], where_clause="value.total >= 7") == [
+        {"group": None, "values": {"count(*)": 3}}
+    ]
+    assert store.aggregate("empty", ["COUNT(*)", "SUM(value.total)"]) == [
+        {"group": None, "values": {"count(*)": 0, "sum(value.total)": None}}
+    ]
+    with pytest.raises(ValueError):
+        store.aggregate("orders", ["MEDIAN(value.total)"])
+
+
+def test_columnar_scans_match_full_scan(make_store, reference):
+    pytest.importorskip("numpy")
+    store = make_store(scan_workers=1)
+    for field in ("value.status", "value.age", "value.score"):
+        store.create_column("users", field)
+    populate(store, reference)
+    assert assert_same_results(store, reference, "columnar_scan", latest_only_values=(True,))
+
+    select = ["COUNT(*)", "SUM(value.age)", "MIN(value.score)", "MAX(value.age)"]
+    assert store.aggregate("users", select, "value.status") == reference.aggregate("users", select, "value.status")
+
+
+def test_parallel_scans_match_full_scan(make_store, reference):
+    store = make_store(scan_workers=2, parallel_scan_min_rows=1)
+    populate(store, reference)
+    assert assert_same_results(store, reference, "parallel_scan")
+
+    # Workers catch up on later writes and start over after removals
+    populate(store, reference)
+    store.garbage_collect(max_versions=2)
+    reference.garbage_collect(max_versions=2)
+    assert assert_same_results(store, reference, "parallel_scan")
+
+
+def test_parallel_shards_survive_removals_in_other_collections(make_store, reference):
+    store = make_store(scan_workers=2, parallel_scan_min_rows=1)
+    populate(store, reference)
+    prepared = []
+    prepare = store._scanner.prepare
+
+    def record(*args):
+        scan = prepare(*args)
+        prepared.append(scan.reset)
+        return scan
+
+    store._scanner.prepare = record
+    assert assert_same_results(store, reference, "parallel_scan", latest_only_values=(True,))
+    store.upsert("other", "k", {})
+    store.evict("other", "k")
+    assert assert_same_results(store, reference, "parallel_scan", latest_only_values=(True,))
+    store.evict("users", "u1")
+    reference.evict("users", "u1")
+    assert assert_same_results(store, reference, "parallel_scan", latest_only_values=(True,))
+    # Only the first scan and the one after the eviction from users rebuild the shards
+    count = len(WHERE_CLAUSES)
+    assert prepared == [True] + [False] * (2 * count - 1) + [True] + [False] * (count - 1)
+
+
+def test_scans_copied_out_in_batches_match_full_scan(make_store, reference, monkeypatch):
+    monkeypatch.setattr(KeyValueStore, "CAPTURE_BATCH", 7)
+    store = make_store(scan_workers=1)
+    store.create_index("users", "value.age", kind="sorted")
+    populate(store, reference)
+    for where in WHERE_CLAUSES:
+        for latest_only in (True, False):
+            pages = {}
+            cursor = None
+            while True:
+                page = store.query_documents("users", where, latest_only, limit=9, cursor=cursor)
+                pages.update(page)
+                if len(page) < 9:
+                    break
+                cursor = encode_cursor(next(reversed(page)))
+            expected = reference.query_documents("users", where, latest_only)
+            assert transaction_ids(pages) == transaction_ids(expected), where
+
+    for order_by in ("value.age", "value.age DESC"):
+        results, stats = store.explain_query("users", None, True, limit=50, order_by=order_by)
+        expected = reference.query_documents("users", None, True, limit=50, order_by=order_by)
+        assert stats["plan"]["type"] == "index_order_scan"
+        assert list(transaction_ids(results).items()) == list(transaction_ids(expected).items())
+
+
+def test_writes_proceed_while_queries_check_rows(store, monkeypatch):
+    store.create_index("users", "value.age", kind="sorted")
+    populate(store)
+    execute = store._execute_query
+    writes = []
+
+    def execute_after_write(*args):
+        writer = threading.Thread(target=store.upsert, args=("users", f"w{len(writes)}", {"age": 1}))
+        writer.start()
+        writer.join(timeout=5)
+        writes.append(not writer.is_alive())
+        return execute(*args)
+
+    monkeypatch.setattr(store, "_execute_query", execute_after_write)
+    store.query_documents("users", "value.status = 'active'")
+    store.query_documents("users", "value.status = 'active'", latest_only=True, limit=5)
+    store.query_documents("users", "value.age > 40")
+    store.query_documents("users", None, latest_only=True, limit=5, order_by="value.age")
+    assert writes == [True] * 4
@@ -0,0 +1,178 @@
+import json
+import os
+import time
+
+import pytest
+
+
+def test_replays_log_after_restart(make_store):
+    store = make_store()
+    store.upsert("users", "u1", {"name": "Ann"})
+    store.upsert("users", "u1", {"name": "Anne"})
+    store.upsert("users", "u2", {"name": "Bob"})
+    store.delete("users", "u2")
+    store.create_index("users", "value.name")
+    store.close()
+
+    reopened = make_store()
+    assert [doc.value for doc in reopened.store["users"]["u1"]] == [{"name": "Ann"}, {"name": "Anne"}]
+    assert reopened.get("users", "u2") is None
+    assert reopened.store["users"]["u2"][-1].value is None
+    assert reopened.current_transaction_id == 4
+    assert [index["field"] for index in reopened.list_indexes("users")] == ["value.name"]
+
+
+def test_torn_log_tail_is_discarded(make_store, tmp_path):
+    store = make_store()
+    store.upsert("users", "u1", {"name": "Ann"})
+    store.upsert("users", "u2", {"name": "Bob"})
+    store.close()
+    log_path = tmp_path / "kvstore.json.log"
+    log_path.write_bytes(log_path.read_bytes()[:-3])
+
+    reopened = make_store()
+    assert reopened.get("users", "u1").value == {"name": "Ann"}
+    assert reopened.get("users", "u2") is None
+
+
+def test_upsert_after_gc_keeps_newest_version(make_store):
+    store = make_store()
+    for n in range(3):
+        store.upsert("c", "k", {"n": n})
+    store.garbage_collect(max_versions=1)
+    store.upsert("c", "k", {"n": 3})
+    assert store.get("c", "k").version == 4
+    store.garbage_collect(max_versions=1)
+    assert store.get("c", "k").value == {"n": 3}
+    store.close()
+
+    assert make_store().get("c", "k").value == {"n": 3}
+
+
+def test_unreadable_snapshot_is_an_error(make_store, tmp_path):
+    store = make_store()
+    store.upsert("users", "u1", {"name": "Ann"})
+    assert store.checkpoint()
+    store.upsert("users", "u2", {"name": "Bob"})
+    store.close()
+    (tmp_path / "kvstore.json").write_text('{"users": ')
+
+    with pytest.raises(RuntimeError, match="Error loading snapshot"):
+        make_store()
+
+
+def test_changes_wait_for_commit(make_store):
+    store = make_store(fsync_policy="always")
+    committed = []
+    store.add_listener(committed.append)
+    # Hold up the log writer so that the upsert is applied but not yet committed
+    with store._writer._io_lock:
+        store.upsert("users", "u1", {"name": "Ann"})
+        assert store.get("users", "u1").value == {"name": "Ann"}
+        assert store.committed_transaction_id == 0
+        assert store.get_changes_after(0, limit=10) == []
+    assert store.flush(timeout=5)
+    assert store.committed_transaction_id == 1
+    assert [doc.key for doc, _ in store.get_changes_after(0, limit=10)] == ["u1"]
+    assert committed == [1]
+
+
+def test_checkpoint_round_trip(make_store, tmp_path):
+    store = make_store()
+    store.upsert("users", "u1", {"name": "Ann"})
+    assert store.checkpoint()
+    store.upsert("users", "u2", {"name": "Bob"})
+    store.close()
+    # The sealed segment behind the snapshot is gone; only the active log is left
+    assert sorted(os.listdir(tmp_path)) == ["kvstore.json", "kvstore.json.log"]
+
+    reopened = make_store()
+    assert reopened.get("users", "u1").value == {"name": "Ann"}
+    assert reopened.get("users", "u2").value == {"name": "Bob"}
+    assert reopened.upsert("users", "u3", {}).transaction_id == 3
+
+
+def test_zero_snapshot_interval_disables_timed_snapshots(make_store):
+    store = make_store(snapshot_interval_s=0)
+    assert store._snapshotter is None
+    store.close()
+
+    store = make_store(snapshot_every=2, snapshot_interval_s=0)
+    assert store.snapshot_interval_s is None
+    store.upsert("users", "u1", {"name": "Ann"})
+    store.upsert("users", "u2", {"name": "Bob"})
+    deadline = time.monotonic() + 5
+    while store._snapshot_lsn < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert store._snapshot_lsn == 2
+
+
+def test_removed_tombstone_triggers_rollback(store):
+    store.upsert("c", "a", {"n": 1})
+    store.delete("c", "a")
+    store.upsert("c", "b", {"n": 1})
+    assert store.rollback_watermark("c") == 0
+    assert store.garbage_collect(max_age_seconds=-1) == 3
+    assert store.rollback_watermark("c") == 2
+    assert store.get_changes_after(0, limit=10) == []
+
+
+def test_collections_named_after_snapshot_metadata_survive_restart(make_store):
+    store = make_store()
+    for collection in ("consumers", "indexes", "columns", "users"):
+        store.upsert(collection, "k1", {"collection": collection})
+    store.create_index("indexes", "value.collection")
+    store.create_consumer("c1", collection="consumers")
+    assert store.checkpoint()
+    store.close()
+
+    reopened = make_store()
+    for collection in ("consumers", "indexes", "columns", "users"):
+        assert reopened.get(collection, "k1").value == {"collection": collection}
+    assert reopened.get_consumer("c1").collection == "consumers"
+    assert [index["field"] for index in reopened.list_indexes("indexes")] == ["value.collection"]
+
+
+def test_loads_snapshots_with_collections_at_the_top_level(make_store, tmp_path):
+    doc = {"key": "u1", "value": {"name": "Ann"}, "version": 1, "timestamp": 1.0, "transaction_id": 1}
+    (tmp_path / "kvstore.json").write_text(json.dumps({
+        "users": {"u1": [doc]},
+        "last_transaction_id": 1,
+        "highest_removed_tombstone_id": 0,
+        "last_lsn": 1,
+        "consumers": {},
+    }))
+
+    store = make_store()
+    assert store.get("users", "u1").value == {"name": "Ann"}
+    assert list(store.store) == ["users"]
+    assert store.upsert("users", "u2", {}).transaction_id == 2
+
+
+def write_versions(store, collection, key, count):
+    for n in range(count):
+        store.upsert(collection, key, {"n": n})
+
+
+def test_gc_retains_versions_consumers_have_not_acked(store):
+    write_versions(store, "orders", "o1", 3)
+    write_versions(store, "users", "u1", 3)
+    store.create_consumer("billing", collection="orders", start=1)
+
+    # Version 2 of o1 waits for billing; nobody reads users
+    assert store.garbage_collect(max_versions=1, retain_for_consumers=True) == 3
+    assert [doc.transaction_id for doc in store.store["orders"]["o1"]] == [2, 3]
+    assert [doc.transaction_id for doc in store.store["users"]["u1"]] == [6]
+    assert store.flush(timeout=5)
+
+    store.ack_consumer("billing", 3)
+    assert store.garbage_collect(max_versions=1, retain_for_consumers=True) == 1
+    assert [doc.transaction_id for doc in store.store["orders"]["o1"]] == [3]
+
+
+def test_gc_byte_cap_releases_oldest_retained_versions(store):
+    write_versions(store, "orders", "o1", 4)
+    store.create_consumer("billing", collection="orders")
+    # Each retained value is 8 bytes of JSON; room for two
+    assert store.garbage_collect(max_versions=1, retain_for_consumers=True, max_retained_bytes=16) == 1
+    assert [doc.transaction_id for doc in store.store["orders"]["o1"]] == [2, 3, 4]
@@ -0,0 +1,73 @@
+import time
+
+import pytest
+
+from change_streams.wal import FsyncPolicy, GroupCommitWriter, WriteAheadLog
+
+
+@pytest.fixture
+def make_writer(tmp_path):
+    writers = []
+
+    def make(policy, interval_ms=100.0):
+        writer = GroupCommitWriter(WriteAheadLog(str(tmp_path / "test.log")), policy, interval_ms)
+        writer.start()
+        writers.append(writer)
+        return writer
+
+    yield make
+    for writer in writers:
+        writer.close()
+
+
+def submit(writer, first, last):
+    for lsn in range(first, last + 1):
+        writer.submit(lsn, {"lsn": lsn})
+
+
+def test_always_fsyncs_before_commit(make_writer):
+    writer = make_writer(FsyncPolicy.ALWAYS)
+    submit(writer, 1, 3)
+    assert writer.wait(3, timeout=5)
+    stats = writer.stats()
+    assert stats["durable_lsn"] == stats["written_lsn"] == 3
+    assert stats["fsyncs"] == stats["batches"] >= 1
+
+
+def test_concurrent_records_share_a_batch(make_writer):
+    writer = make_writer(FsyncPolicy.ALWAYS)
+    # Hold up the writer so that everything submitted meanwhile queues behind it
+    with writer._io_lock:
+        submit(writer, 1, 100)
+    assert writer.wait(100, timeout=5)
+    stats = writer.stats()
+    assert stats["records"] == 100
+    assert stats["batches"] <= 2
+    assert stats["fsyncs"] == stats["batches"]
+
+
+def test_none_leaves_syncing_to_the_os(make_writer):
+    writer = make_writer(FsyncPolicy.NONE)
+    submit(writer, 1, 10)
+    assert writer.wait(10, timeout=5)
+    assert writer.stats()["fsyncs"] == 0
+    assert writer.stats()["durable_lsn"] == 0
+
+
+def test_interval_fsyncs_in_the_background(make_writer):
+    writer = make_writer(FsyncPolicy.INTERVAL, interval_ms=20)
+    submit(writer, 1, 10)
+    assert writer.wait(10, timeout=5)
+    deadline = time.monotonic() + 5
+    while writer.stats()["durable_lsn"] < 10 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert writer.stats()["durable_lsn"] == 10
+
+
+def test_records_replay_in_order(tmp_path):
+    writer = GroupCommitWriter(WriteAheadLog(str(tmp_path / "test.log")), FsyncPolicy.ALWAYS)
+    writer.start()
+    submit(writer, 1, 50)
+    writer.close()
+    writer.close()  # Closing again leaves the closed log alone
+    assert [record["lsn"] for record in WriteAheadLog(str(tmp_path / "test.log")).replay()] == list(range(1, 51))